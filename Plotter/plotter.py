@@ -4,10 +4,11 @@ import argparse
 from itertools import product
 import sys
 import os 
-import uproot
 sys.path.append("..")
 import libraries as lib
 lib.customize_style("python")
+# On-disk cache of the profiles, opt-in with --cache or TAU_CACHE=1
+CACHE = lib.column_cache()
 
 
 text_conversion = {
@@ -56,15 +57,16 @@ def ArgumentParser():
                         help="Choose if the systematic uncertainties are included or not")
     parser.add_argument('--cut', type=str, default="muon_free",
                         help="Choose if the muons are included or not")
+    parser.add_argument('--cache', action='store_true',
+                        help="Read from and write to the on-disk column cache (also enabled by TAU_CACHE=1)")
     args = parser.parse_args()
     return args
 
 def _root_to_tables(root_file, tree_name = "outTree", columns = ["chi2","TauNorm"]):
     
-    # Load the root file
-    with uproot.open(root_file) as f:
-        data = f[tree_name].arrays(columns, library="numpy")
-    return data
+    # Load the root file, or its cached copy
+    df = lib.load_rootfile_to_df(root_file, columns, tree_name, cache=CACHE)
+    return {column: df[column].to_numpy() for column in columns}
 
 def load_data(
     channel,
@@ -248,6 +250,8 @@ if __name__ == '__main__':
     channel = args.channel
     systematic = args.systematic
     cut_option = args.cut
+    if args.cache:
+        CACHE = lib.column_cache(True)
     
     save_path = os.path.join(path, f"plots/{cut_option}/{systematic}/{type}")
     
@@ -1,6 +1,13 @@
 import os
 import sys
+import numpy as np
+import uproot
 import file_management as fm
+from cache import column_cache
+from mapreduce import map_reduce, run_entry_ranges, load_entry_ranges
+from result_cache import ResultCache
+from collections import Counter
+from functools import partial
 from argparse import ArgumentParser
 from tabulate import tabulate
 
@@ -10,8 +17,171 @@ def argument_parser():
     parser.add_argument("--r", type=str, dest="input_root_file", help="The input root file.", default="full_nutau_sample.root")
     parser.add_argument("--p", type=str, dest="path_to_file", help="The path for all files. It's assumed that the same directory structure is kept accross platforms.",
                         default="/home/wecapstor3/capn/mppi133h/ANTARES/mc/cut_selection/low_energy")
+    parser.add_argument("--cache", action="store_true", dest="cache",
+                        help="Read from and write to the on-disk column cache (also enabled by TAU_CACHE=1).")
+    parser.add_argument("--no_result_cache", action="store_true", dest="no_result_cache",
+                        help="Do not reuse the partial results of previous runs of the script.")
+    parser.add_argument("--compact", action="store_true", dest="compact",
+                        help="Compact the dtypes of the loaded table.")
+    parser.add_argument("--fast", action="store_true", dest="fast",
+                        help="Count the runs from the unique (Type, interaction_type, RunID) triples of NumPy chunks, without building a DataFrame.")
+    parser.add_argument("--chunksize", type=int, dest="chunksize", default=1_000_000,
+                        help="The number of entries per chunk in fast mode.")
+    parser.add_argument("--per_run", action="store_true", dest="per_run",
+                        help="Count the runs run by run in a process pool.")
+    parser.add_argument("--n_workers", type=int, dest="n_workers", default=1,
+                        help="The number of worker processes in fast and per-run mode.")
     return parser.parse_args()
 
+# Bit layout of the packed (Type, interaction_type, RunID) keys: 16 bits for the PDG type, 16 for the interaction type
+# and 32 for the run, each shifted by an offset so negative types are kept
+TYPE_OFFSET, INTERACTION_OFFSET = 1 << 15, 1 << 15
+
+def pack_triples(types, interaction_types, run_ids):
+    """
+    Pack (Type, interaction_type, RunID) triples into single uint64 keys, ordered as the triples.
+    
+    Args:
+        types (array): The PDG types.
+        interaction_types (array): The interaction types.
+        run_ids (array): The run ids.
+        
+    Raises:
+        ValueError: If a value does not fit into its bits.
+        
+    Returns:
+        array: The packed keys.
+    """
+    types = types.astype(np.int64) + TYPE_OFFSET
+    interaction_types = interaction_types.astype(np.int64) + INTERACTION_OFFSET
+    run_ids = run_ids.astype(np.int64)
+    
+    
+    for name, values, n_bits in (("Type", types, 16), ("interaction_type", interaction_types, 16), ("RunID", run_ids, 32)):
+        if len(values) and (values.min() < 0 or values.max() >= 1 << n_bits):
+            raise ValueError(f"The {name} values do not fit into the {n_bits} bits of the packed key")
+    
+    return (types.astype(np.uint64) << np.uint64(48)) | (interaction_types.astype(np.uint64) << np.uint64(32)) | run_ids.astype(np.uint64)
+
+def merge_unique(keys, other):
+    """
+    Merge two sorted arrays of unique keys in linear time, inserting the new keys of other into keys.
+    """
+    positions = np.searchsorted(keys, other)
+    is_new = positions == len(keys)
+    is_new[~is_new] = keys[positions[~is_new]] != other[~is_new]
+    return np.insert(keys, positions[is_new], other[is_new])
+
+def chunk_unique_triples(entry_range, rootfile, tree="sel", result_cache=None):
+    """
+    Return the sorted unique packed (Type, interaction_type, RunID) keys of a range of entries.
+    
+    Args:
+        entry_range (tuple): The (start, stop) entries to read.
+        rootfile (str): The path to the ROOT file.
+        tree (str, optional): The name of the tree. Defaults to "sel".
+        result_cache (ResultCache, optional): Cache of the keys of each chunk. Defaults to None.
+        
+    Returns:
+        array: The unique packed keys.
+    """
+    start, stop = entry_range
+    
+    def compute():
+        with uproot.open(rootfile) as f:
+            chunk = f[tree].arrays(["Type", "interaction_type", "RunID"], library="np", entry_start=start, entry_stop=stop)
+        return np.unique(pack_triples(chunk["Type"], chunk["interaction_type"], chunk["RunID"]))
+    
+    if result_cache is None:
+        return compute()
+    return result_cache.load("unique_triples", rootfile, compute, tree=tree, start=start, stop=stop)
+
+def fast_count_runs_per_type(rootfile, chunksize=1_000_000, n_workers=1, tree="sel", result_cache=None):
+    """
+    Count the number of runs per (Type, interaction_type) from the unique triples of each chunk.
+    
+    The three branches are read chunk by chunk as NumPy arrays, each chunk is reduced to its unique packed
+    (Type, interaction_type, RunID) keys with np.unique and the sorted key sets are merged in linear time
+    with merge_unique, so no DataFrame is built and the memory is bounded by one chunk.
+    
+    Args:
+        rootfile (str): The path to the ROOT file.
+        chunksize (int, optional): The number of entries per chunk. Defaults to 1_000_000.
+        n_workers (int, optional): Number of worker processes reading the chunks. Defaults to 1.
+        tree (str, optional): The name of the tree. Defaults to "sel".
+        result_cache (ResultCache, optional): Cache of the keys of each chunk, stale entries are evicted. Defaults to None.
+        
+    Returns:
+        list: The ((Type, interaction_type), number of runs) items, sorted as the groupby.
+    """
+    with uproot.open(rootfile) as f:
+        num_entries = f[tree].num_entries
+    entry_ranges = [(start, min(start + chunksize, num_entries)) for start in range(0, num_entries, chunksize)]
+    
+    func = partial(chunk_unique_triples, rootfile=rootfile, tree=tree, result_cache=result_cache)
+    keys, failures = map_reduce(func, entry_ranges, merge_unique, initial=np.array([], dtype=np.uint64),
+                                n_workers=n_workers, desc="Chunks")
+    if result_cache is not None:
+        result_cache.evict()
+    if failures:
+        raise RuntimeError(f"{len(failures)} chunks of {rootfile} could not be read")
+    
+    # The keys are sorted by (Type, interaction_type), and each run appears once per pair
+    pairs = (keys >> np.uint64(32)).astype(np.int64)
+    starts = np.flatnonzero(np.concatenate([[True], pairs[1:] != pairs[:-1]])) if len(pairs) else np.array([], dtype=np.int64)
+    counts = np.diff(np.append(starts, len(pairs)))
+    types = (pairs[starts] >> 16) - TYPE_OFFSET
+    interaction_types = (pairs[starts] & 0xFFFF) - INTERACTION_OFFSET
+    
+    return [((int(t), int(i)), int(n)) for t, i, n in zip(types, interaction_types, counts)]
+
+def run_types(work_unit, rootfile, columns, result_cache=None):
+    """
+    Return the (Type, interaction_type) pairs of one run, each counting the run once.
+    
+    Args:
+        work_unit (tuple): The run id and its entry ranges.
+        rootfile (str): The path to the ROOT file.
+        columns (list): The columns to load.
+        result_cache (ResultCache, optional): Cache of the pairs of each run. Defaults to None.
+        
+    Returns:
+        Counter: One count per (Type, interaction_type) pair of the run.
+    """
+    run_id, ranges = work_unit
+    
+    def compute():
+        df = load_entry_ranges(rootfile, ranges, columns)
+        return Counter(df[["Type", "interaction_type"]].drop_duplicates().itertuples(index=False, name=None))
+    
+    if result_cache is None:
+        return compute()
+    return result_cache.load("run_types", rootfile, compute, run_id=run_id, ranges=ranges, columns=columns)
+
+def count_runs_per_type(rootfile, columns, n_workers=1, result_cache=None):
+    """
+    Count the number of runs per (Type, interaction_type) run by run, in a process pool.
+    
+    Args:
+        rootfile (str): The path to the ROOT file.
+        columns (list): The columns to load.
+        n_workers (int, optional): Number of worker processes. Defaults to 1.
+        result_cache (ResultCache, optional): Cache of the pairs of each run, stale entries are evicted. Defaults to None.
+        
+    Returns:
+        list: The ((Type, interaction_type), number of runs) items, sorted as the groupby.
+    """
+    ranges = run_entry_ranges(rootfile)
+    func = partial(run_types, rootfile=rootfile, columns=columns, result_cache=result_cache)
+    counts, failures = map_reduce(func, ranges.items(), lambda a, b: a + b, initial=Counter(), n_workers=n_workers, desc="Runs")
+    if result_cache is not None:
+        result_cache.evict()
+    
+    if failures:
+        print(f"WARNING: the runs {[work_unit[0] for work_unit, _ in failures]} failed and are not counted.")
+    
+    return sorted(counts.items())
+
 
 if __name__ == "__main__":
     
@@ -31,9 +201,18 @@ if __name__ == "__main__":
     
     COLUMNS = ["RunID", "Type", "interaction_type"] 
         
-    df_antdst = fm.load_large_rootfile_to_df(os.path.join(path, root_file), columns=COLUMNS)
-    
-    unique_runs = list(df_antdst.groupby(["Type","interaction_type"])["RunID"].nunique().items())
+    result_cache = None if args.no_result_cache else ResultCache()
+    if args.fast:
+        unique_runs = fast_count_runs_per_type(os.path.join(path, root_file), args.chunksize, n_workers=args.n_workers,
+                                               result_cache=result_cache)
+    elif args.per_run:
+        unique_runs = count_runs_per_type(os.path.join(path, root_file), COLUMNS, n_workers=args.n_workers,
+                                          result_cache=result_cache)
+    else:
+        cache = column_cache(True if args.cache else None)
+        df_antdst = fm.load_large_rootfile_to_df(os.path.join(path, root_file), columns=COLUMNS, cache=cache, compact=args.compact)
+        
+        unique_runs = list(df_antdst.groupby(["Type","interaction_type"])["RunID"].nunique().items())
     
     print(tabulate(unique_runs, headers=[["Type", "interaction_type"], "Number of files"], tablefmt="pretty"))
     
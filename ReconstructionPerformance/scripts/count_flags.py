@@ -2,14 +2,55 @@ import pandas as pd
 import numpy as np
 from tabulate import tabulate
 import os
-import time
-from datetime import timedelta
 import argparse
+from functools import partial
 import sys
 sys.path.append("scripts")
 import file_management as fm
+from cache import column_cache
+from file_index import FileIndex
+from joins import merge_events
+from mapreduce import map_reduce, run_entry_ranges, load_entry_ranges, hdf5_run_entry_ranges, load_hdf5_entry_ranges
+from result_cache import ResultCache
+from instrumentation import stage
 import lib_masks as masks
 
+# AntDST columns loaded from the summary files
+COLUMNS = [
+    "RunID",
+    "EventID",
+    "TriggCounter",
+    "Frame",
+    "interaction_type",
+    "is_cc",
+    "Type",
+    "aafit_flag",
+    "bbfit_flag",
+    "gridfit_flag",
+    "showerdusj_flag",
+    "bbfit_shower_flag",
+]
+
+# NNFit columns needed for the flags: the join keys (before renaming) and the fitted angles
+NNFIT_COLUMNS = [
+    "RunID",
+    "EventID",
+    "TrigCount",
+    "NNFitTrack_Theta",
+    "NNFitShower_Theta",
+]
+
+# Groups and flags of the summary table of flag_counter
+GROUP_COLUMNS = ["Flavour type", "Event type"]
+FLAG_COLUMNS = [
+    "aafit_flag",
+    "bbfit_flag",
+    "gridfit_flag",
+    "showerdusj_flag",
+    "NNFitTrack_flag",
+    "NNFitShower_flag",
+]
+
 def argument_parser():
     parser = argparse.ArgumentParser(description="Application to do count the number of reconstructed events per reconstructed algorithm.")
 
@@ -20,6 +61,28 @@ def argument_parser():
                         help="The files you are working with.", default="test")
     parser.add_argument("--d", type=str, dest="path",
                         help="The path to the data.", default="cut_selection/low_energy")
+    parser.add_argument("--cache", action="store_true", dest="cache",
+                        help="Read from and write to the on-disk column cache (also enabled by TAU_CACHE=1).")
+    parser.add_argument("--compact", action="store_true", dest="compact",
+                        help="Compact the dtypes of the loaded tables (small integers, bool flags, categorical labels).")
+    parser.add_argument("--no_result_cache", action="store_true", dest="no_result_cache",
+                        help="Do not reuse the results of previous runs of the script.")
+    parser.add_argument("--index", type=str, dest="index", default=None,
+                        help="SQLite file index used to select the NNFit files instead of listing the directory.")
+    parser.add_argument("--refresh_index", action="store_true", dest="refresh_index",
+                        help="Refresh the file index of the NNFit directory before using it.")
+    parser.add_argument("--stream", action="store_true", dest="stream",
+                        help="Count the flags in chunks of whole runs, with the memory bounded by one chunk.")
+    parser.add_argument("--per_run", action="store_true", dest="per_run",
+                        help="Count the flags run by run in a process pool.")
+    parser.add_argument("--n_workers", type=int, dest="n_workers", default=1,
+                        help="The number of worker processes in per-run mode.")
+    parser.add_argument("--join_partitions", type=int, dest="join_partitions", default=1,
+                        help="The number of RunID partitions of the AntDST-NNFit join.")
+    parser.add_argument("--join_workers", type=int, dest="join_workers", default=1,
+                        help="The number of worker processes joining the RunID partitions.")
+    parser.add_argument("--chunksize", type=int, dest="chunksize", default=500_000,
+                        help="The maximum number of AntDST entries per chunk of runs in streaming and per-run mode.")
     args = parser.parse_args()
     return args
 
@@ -52,25 +115,8 @@ def create_masks(df):
     Returns:
         df (pd.DataFrame): The dataframe containing the data with the masks.
     """
-    # Create the masks for the flavour types
-    df_el_ma = masks.get_nuemask(df)
-    df.loc[df_el_ma, "Flavour type"] = "electron"
-
-    df_muon_ma = masks.get_numumask(df)
-    df.loc[df_muon_ma, "Flavour type"] = "muon"
-
-    df_tau_ma = masks.get_nutaumask(df)
-    df.loc[df_tau_ma, "Flavour type"] = "tau"
-    
-    # Create the masks for the event types
-    df_track_ma = masks.get_trackmask(df)
-    df.loc[df_track_ma, "Event type"] = "tracks"
-
-    df_shower_nc_ma = masks.get_showermask_nc(df)
-    df.loc[df_shower_nc_ma, "Event type"] = "showers_nc"
-
-    df_shower_cc_ma = masks.get_showermask_cc(df)
-    df.loc[df_shower_cc_ma, "Event type"] = "showers_cc"
+    # Label the flavour and event types in a single pass through the lookup tables, from the PDG type of the summary files
+    df = masks.classify_events(df, type_column="Type")
     
     return df
 
@@ -100,9 +146,32 @@ def set_file(file):
     
     return identifier, summary_file
 
+def list_nnfit_files(nnfit_path, identifier, index=None):
+    """
+    List the NNFit files of an identifier.
+    
+    Args:
+        nnfit_path (str): The path to the NNFit files.
+        identifier (str): The identifier of the data.
+        index (FileIndex, optional): File index used to select the NNFit files without listing the directory. Defaults to None.
+        
+    Returns:
+        nnfit_files (list): The NNFit HDF5 files.
+    """
+    if index is not None:
+        nnfit_files = index.query(directory=nnfit_path, identifier=identifier)
+    else:
+        nnfit_files = fm.list_files_with_pattern(nnfit_path, f"*{identifier}*")
+        
+    return [nnfit_file for nnfit_file in nnfit_files if nnfit_file.endswith(".hdf5")]
+
 def load_nnfit(
     path, 
-    identifier
+    identifier,
+    cache=None,
+    compact=False,
+    columns=NNFIT_COLUMNS,
+    index=None,
 ):
     """
     Load the nnfit data.
@@ -110,6 +179,10 @@ def load_nnfit(
     Args:
         path (str): The path to the data.
         identifier (str): The identifier of the data.
+        cache (ColumnCache, optional): On-disk cache for the NNFit files. Defaults to None.
+        compact (bool, optional): Compact the dtypes of the loaded table. Defaults to False.
+        columns (list, optional): The NNFit columns to read. Defaults to NNFIT_COLUMNS.
+        index (FileIndex, optional): File index used to select the NNFit files without listing the directory. Defaults to None.
         
     Returns:
         df_nnfit (pd.DataFrame): The dataframe containing the nnfit data.
@@ -118,14 +191,13 @@ def load_nnfit(
     print("Loading the data...")
     print(f"NNfit data: {identifier}")
     print(f"Path: {path}")
-    ctime = time.time()
     
     #Load the dataframes
     print("Importing the dataframes...")
     nnfit_path = os.path.join(path, "nnfit_reco")
-    nnfit_files = fm.list_files_with_pattern(nnfit_path, f"*{identifier}*")
+    nnfit_files = list_nnfit_files(nnfit_path, identifier, index)
     
-    df_nnfit = fm.load_dataframes(nnfit_files, folder_path=nnfit_path)
+    df_nnfit = fm.load_dataframes(nnfit_files, folder_path=nnfit_path, cache=cache, compact=compact, columns=columns)
         
     return df_nnfit
 
@@ -139,7 +211,7 @@ def flag_counter(df):
     Returns:
         df_flags (pd.DataFrame): The dataframe containing the number of reconstructed events per reconstructed algorithm.
     """ 
-    df_flags =  df.groupby(["Flavour type", "Event type"])[["aafit_flag",
+    df_flags =  df.groupby(["Flavour type", "Event type"], observed=True)[["aafit_flag",
                                                             "bbfit_flag",
                                                             "gridfit_flag",
                                                             "showerdusj_flag",
@@ -147,10 +219,10 @@ def flag_counter(df):
                                                             "NNFitShower_flag"]].sum()                                                           
     
     # Merge the dataframes with the number of generated events
-    df_flags = df_flags.merge(df.groupby(["Flavour type", "Event type"])["TriggCounter"].count(), on=["Flavour type", "Event type"])
+    df_flags = df_flags.merge(df.groupby(["Flavour type", "Event type"], observed=True)["TriggCounter"].count(), on=["Flavour type", "Event type"])
     
     # Merge the number of RunID, Flavor type and Event type
-    df_flags = df_flags.merge( df[["RunID", "Flavour type", "Event type"]].drop_duplicates().groupby(["Flavour type", "Event type"]).count(), on=["Flavour type", "Event type"])
+    df_flags = df_flags.merge( df[["RunID", "Flavour type", "Event type"]].drop_duplicates().groupby(["Flavour type", "Event type"], observed=True).count(), on=["Flavour type", "Event type"])
     
     df_flags["Missing flags"] = np.abs(df_flags["RunID"] - df["RunID"].nunique())
     
@@ -170,86 +242,506 @@ def rename_h5_df_cols(
 ):
     return df.rename(columns=mapper)
 
-if __name__ == "__main__":
-    print("Counting reconstructed events...")
+def prepare_nnfit(df_nnfit):
+    """
+    Rename the NNFit columns to the AntDST names and add the NNFit reconstruction flags.
     
-    # Define the columns to be loaded
-    COLUMNS = [
-        "RunID",
-        "EventID",
-        "TriggCounter",
-        "Frame",
-        "interaction_type",
-        "is_cc",
-        "Type",
-        "aafit_flag",
-        "bbfit_flag",
-        "gridfit_flag",
-        "showerdusj_flag",
-        "bbfit_shower_flag"
-    ]    
+    Args:
+        df_nnfit (pd.DataFrame): The dataframe containing the nnfit data.
+        
+    Returns:
+        df_nnfit (pd.DataFrame): The dataframe ready to be merged with the AntDST data.
+    """
+    df_nnfit = rename_h5_df_cols(df_nnfit)
     
-    # Parse the arguments
-    args = argument_parser()
-    cluster = args.cluster
-    file = args.files
-    sub_path = args.path
+    df_nnfit["NNFitTrack_flag"] = df_nnfit["NNFitTrack_Theta"].notna()
+    df_nnfit["NNFitShower_flag"] = df_nnfit["NNFitShower_Theta"].notna()
     
-    # Define the cluster
-    path = define_clusters(cluster)
+    return df_nnfit
+
+def file_run_map(nnfit_file, nnfit_path, cache=None, result_cache=None):
+    """
+    Map the RunIDs of one NNFit file to the file, reading only its RunID column.
+    With a result cache the map is only recomputed when the file changed.
+    """
+    def compute():
+        run_ids = fm.load_runfile(nnfit_file, folder_path=nnfit_path, cache=cache, columns=["RunID"])["RunID"].unique()
+        return {run_id: [nnfit_file] for run_id in run_ids}
     
+    if result_cache is None:
+        return compute()
+    return result_cache.load("nnfit_run_map", os.path.join(nnfit_path, nnfit_file), compute)
+
+def merge_run_maps(run_map, other):
+    """
+    Merge two maps from RunID to NNFit files.
+    """
+    run_map = dict(run_map)
+    for run_id, nnfit_files in other.items():
+        run_map[run_id] = run_map.get(run_id, []) + nnfit_files
+    return run_map
+
+def nnfit_run_map(nnfit_files, nnfit_path, cache=None, n_workers=1, result_cache=None):
+    """
+    Map each RunID to the NNFit files holding its events, reading only the RunID column of the files.
     
-    # Define the flavour type
-    identifier, summary_file = set_file(file)
+    Args:
+        nnfit_files (list): The NNFit files.
+        nnfit_path (str): The path to the NNFit files.
+        cache (ColumnCache, optional): On-disk cache for the NNFit files. Defaults to None.
+        n_workers (int, optional): Number of worker processes reading the files. Defaults to 1.
+        result_cache (ResultCache, optional): Cache of the run map of each file. Defaults to None.
+        
+    Returns:
+        run_map (dict): The NNFit files of each RunID. Files that cannot be read are reported and left out.
+    """
+    func = partial(file_run_map, nnfit_path=nnfit_path, cache=cache, result_cache=result_cache)
+    run_map, failures = map_reduce(func, nnfit_files, merge_run_maps, initial={}, n_workers=n_workers, desc="NNFit files")
     
-    # Load the nnfit data
-    df_nnfit = load_nnfit(path, identifier)
+    if failures:
+        print(f"WARNING: the NNFit files {[nnfit_file for nnfit_file, _ in failures]} could not be read, their events are counted as not reconstructed.")
+            
+    return run_map
+
+def flag_partials(df):
+    """
+    Compute the partial sums of flag_counter on a chunk of the merged and labelled data.
     
-    print("Renaming the columns...\n")
-    df_nnfit = rename_h5_df_cols(df_nnfit)
+    Args:
+        df (pd.DataFrame): A chunk of the data, with the masks.
+        
+    Returns:
+        partials (dict): The flag sums and TriggCounter counts per (Flavour type, Event type) ("sums"),
+        the distinct RunIDs per group ("runs") and the distinct RunIDs of the chunk ("all_runs").
+    """
+    groups = df.groupby(GROUP_COLUMNS, observed=True)
     
-    df_nnfit["NNFitTrack_flag"] = df_nnfit["NNFitTrack_Theta"].notna()
-    df_nnfit["NNFitShower_flag"] = df_nnfit["NNFitShower_Theta"].notna() 
+    sums = groups[FLAG_COLUMNS].sum()
+    sums["TriggCounter"] = groups["TriggCounter"].count()
+    
+    runs = {key: set(values) for key, values in groups["RunID"].unique().items()}
+    
+    return {"sums": sums, "runs": runs, "all_runs": set(df["RunID"].unique())}
+
+def merge_flag_partials(partials, other):
+    """
+    Merge the partial sums of two chunks.
+    
+    Args:
+        partials (dict): The partial sums accumulated so far, or None.
+        other (dict): The partial sums of a new chunk.
+        
+    Returns:
+        partials (dict): The merged partial sums.
+    """
+    if partials is None:
+        return other
+    
+    sums = pd.concat([partials["sums"], other["sums"]]).groupby(level=GROUP_COLUMNS, observed=True).sum()
+    
+    runs = partials["runs"]
+    for key, values in other["runs"].items():
+        runs.setdefault(key, set()).update(values)
+        
+    return {"sums": sums, "runs": runs, "all_runs": partials["all_runs"] | other["all_runs"]}
+
+def finalize_flag_partials(partials):
+    """
+    Build the table of flag_counter from the accumulated partial sums.
+    
+    Args:
+        partials (dict): The partial sums of all the chunks, or None if there was no chunk.
+        
+    Returns:
+        df_flags (pd.DataFrame): The dataframe containing the number of reconstructed events per reconstructed algorithm,
+        empty if there was no chunk.
+    """
+    if partials is None:
+        index = pd.MultiIndex.from_tuples([], names=GROUP_COLUMNS)
+        return pd.DataFrame(columns=FLAG_COLUMNS + ["TriggCounter", "RunID", "Missing flags"], index=index)
+    
+    df_flags = partials["sums"][FLAG_COLUMNS + ["TriggCounter"]].copy()
+    
+    df_flags["RunID"] = [len(partials["runs"][key]) for key in df_flags.index]
+    
+    df_flags["Missing flags"] = np.abs(df_flags["RunID"] - len(partials["all_runs"]))
+    
+    algo = ["aafit", "bbfit", "gridfit", "showerdusj", "NNFitTrack", "NNFitShower"]
+    
+    for a in algo:
+        df_flags[f"{a}_flag"] = df_flags[f"{a}_flag"] / df_flags["TriggCounter"]
+        
+    return df_flags
+
+def select_nnfit_runs(nnfit_frames, dfnu, run_ids):
+    """
+    Select the NNFit events of some runs, ready to be merged with the AntDST events.
+    
+    Args:
+        nnfit_frames (list): The prepared NNFit dataframes holding the runs.
+        dfnu (pd.DataFrame): The AntDST events of the runs.
+        run_ids (array): The runs.
+        
+    Returns:
+        df_nnfit (pd.DataFrame): The NNFit events of the runs.
+    """
+    if nnfit_frames:
+        df_nnfit = pd.concat(nnfit_frames, ignore_index=True)
+        return df_nnfit[df_nnfit["RunID"].isin(run_ids)]
+    
+    # Runs without NNFit file: an empty table with the key dtypes of the AntDST events
+    df_nnfit = prepare_nnfit(pd.DataFrame({column: pd.Series(dtype=float) for column in NNFIT_COLUMNS}))
+    return df_nnfit.astype({column: dfnu[column].dtype for column in ["RunID", "Frame", "TriggCounter"]})
+
+def file_run_ranges(nnfit_file, nnfit_path, result_cache=None):
+    """
+    Map the RunIDs of one NNFit file to their row ranges in the file, reading only its RunID column.
+    With a result cache the ranges are only recomputed when the file changed.
+    """
+    def compute():
+        ranges = hdf5_run_entry_ranges(os.path.join(nnfit_path, nnfit_file))
+        return {run_id: {nnfit_file: run_ranges} for run_id, run_ranges in ranges.items()}
+    
+    if result_cache is None:
+        return compute()
+    return result_cache.load("nnfit_run_ranges", os.path.join(nnfit_path, nnfit_file), compute)
+
+def merge_run_ranges(run_ranges, other):
+    """
+    Merge two maps from RunID to the row ranges of the run in each NNFit file.
+    """
+    run_ranges = dict(run_ranges)
+    for run_id, file_ranges in other.items():
+        run_ranges[run_id] = {**run_ranges.get(run_id, {}), **file_ranges}
+    return run_ranges
+
+def run_chunks(ranges, chunksize):
+    """
+    Group consecutive runs into chunks of at most chunksize entries, a run larger than chunksize being a chunk of its own.
+    
+    Args:
+        ranges (dict): The entry ranges of each run, see run_entry_ranges.
+        chunksize (int): The maximum number of entries per chunk.
+        
+    Yields:
+        list: The runs of a chunk.
+    """
+    chunk, size = [], 0
+    for run_id, run_ranges in ranges.items():
+        run_size = sum(stop - start for start, stop in run_ranges)
+        if chunk and size + run_size > chunksize:
+            yield chunk
+            chunk, size = [], 0
+        chunk.append(run_id)
+        size += run_size
+    if chunk:
+        yield chunk
+
+def load_nnfit_runs(nnfit_path, nnfit_ranges, run_ids):
+    """
+    Load the NNFit events of some runs, reading only their row ranges in the NNFit files.
+    
+    Args:
+        nnfit_path (str): The path to the NNFit files.
+        nnfit_ranges (dict): The row ranges of each run in each NNFit file, see file_run_ranges.
+        run_ids (list): The runs.
+        
+    Returns:
+        nnfit_frames (list): The prepared NNFit dataframes of the runs, one per file.
+    """
+    file_ranges = {}
+    for run_id in run_ids:
+        for nnfit_file, ranges in nnfit_ranges.get(run_id, {}).items():
+            file_ranges.setdefault(nnfit_file, []).extend(ranges)
+    
+    return [prepare_nnfit(load_hdf5_entry_ranges(os.path.join(nnfit_path, nnfit_file), sorted(ranges), NNFIT_COLUMNS))
+            for nnfit_file, ranges in sorted(file_ranges.items())]
+
+def stream_flag_counter(
+    summary_path,
+    nnfit_path,
+    nnfit_files,
+    columns,
+    chunksize=500_000,
+    result_cache=None,
+):
+    """
+    Count the number of reconstructed events per reconstructed algorithm chunk by chunk.
+    
+    The AntDST summary is split into chunks of whole runs, and each chunk is merged with the NNFit events of its runs only,
+    read from their row ranges in the NNFit files, labelled and reduced to partial sums. The memory is bounded by one chunk
+    (or one run when a run is larger than chunksize), and the result is the table of flag_counter.
+    
+    Args:
+        summary_path (str): The path to the AntDST summary file.
+        nnfit_path (str): The path to the NNFit files.
+        nnfit_files (list): The NNFit files.
+        columns (list): The AntDST columns to load.
+        chunksize (int, optional): The maximum number of AntDST entries per chunk. Defaults to 500_000.
+        result_cache (ResultCache, optional): Cache of the run ranges of the summary and of each NNFit file, stale entries are evicted. Defaults to None.
+        
+    Returns:
+        df_flags (pd.DataFrame): The dataframe containing the number of reconstructed events per reconstructed algorithm.
+    """
+    func = partial(file_run_ranges, nnfit_path=nnfit_path, result_cache=result_cache)
+    nnfit_ranges, failures = map_reduce(func, nnfit_files, merge_run_ranges, initial={}, desc="NNFit files")
+    if failures:
+        print(f"WARNING: the NNFit files {[nnfit_file for nnfit_file, _ in failures]} could not be read, their events are counted as not reconstructed.")
+    
+    if result_cache is None:
+        ranges = run_entry_ranges(summary_path)
+    else:
+        ranges = result_cache.load("run_entry_ranges", summary_path, partial(run_entry_ranges, summary_path))
+    
+    partials = None
+    for i, run_ids in enumerate(run_chunks(ranges, chunksize)):
+        with stage("count_chunk", chunk=i, runs=len(run_ids)) as current:
+            dfnu = load_entry_ranges(summary_path, sorted(r for run_id in run_ids for r in ranges[run_id]), columns)
+            
+            df_nnfit = select_nnfit_runs(load_nnfit_runs(nnfit_path, nnfit_ranges, run_ids), dfnu, run_ids)
+            df = merge_events(dfnu, df_nnfit, on=["RunID", "Frame", "TriggCounter"], how="left")
+            df = create_masks(df)
+            
+            partials = merge_flag_partials(partials, flag_partials(df))
+            current.rows_in, current.rows_out = len(dfnu), len(df)
+            current.metadata["nnfit_events"] = len(df_nnfit)
+    
+    if result_cache is not None:
+        result_cache.evict()
+        
+    return finalize_flag_partials(partials)
+
+def run_flag_partials(work_unit, summary_path, nnfit_path, columns, cache=None, result_cache=None):
+    """
+    Compute the partial sums of flag_counter for a batch of neighbouring runs. With a result cache the partial sums
+    are only recomputed when the summary file or the NNFit files of the runs changed.
+    
+    Args:
+        work_unit (tuple): The run ids, their AntDST entry ranges and their NNFit files.
+        summary_path (str): The path to the AntDST summary file.
+        nnfit_path (str): The path to the NNFit files.
+        columns (list): The AntDST columns to load.
+        cache (ColumnCache, optional): On-disk cache for the NNFit files. Defaults to None.
+        result_cache (ResultCache, optional): Cache of the partial sums of each run. Defaults to None.
+        
+    Returns:
+        partials (dict): The partial sums of the runs, see flag_partials.
+    """
+    run_ids, ranges, nnfit_files = work_unit
+    
+    def compute():
+        dfnu = load_entry_ranges(summary_path, ranges, columns)
+        nnfit_frames = [prepare_nnfit(fm.load_runfile(nnfit_file, folder_path=nnfit_path, cache=cache, columns=NNFIT_COLUMNS))
+                        for nnfit_file in nnfit_files]
+        
+        df_nnfit = select_nnfit_runs(nnfit_frames, dfnu, run_ids)
+        df = merge_events(dfnu, df_nnfit, on=["RunID", "Frame", "TriggCounter"], how="left")
+        df = create_masks(df)
+        
+        return flag_partials(df)
     
+    if result_cache is None:
+        return compute()
     
-    # Load the AntDST extracted files
-    print("Loading the AntDST files...")
-    ctime = time.time()
-    dfnu = fm.rootfile_to_df(os.path.join(path, sub_path, summary_file), columns=COLUMNS)
-    print(f"AntDST data loaded in {timedelta(seconds=time.time()-ctime)}\n")
+    paths = [summary_path] + [os.path.join(nnfit_path, nnfit_file) for nnfit_file in nnfit_files]
+    return result_cache.load("flag_partials", paths, compute, run_ids=run_ids, ranges=ranges, columns=columns)
+
+def per_run_flag_counter(
+    summary_path,
+    nnfit_path,
+    nnfit_files,
+    columns,
+    n_workers=1,
+    chunksize=500_000,
+    cache=None,
+    result_cache=None,
+):
+    """
+    Count the number of reconstructed events per reconstructed algorithm run by run, in a process pool.
     
-    # Merge the dataframes
-    print("\nMerging the dataframes...")
-    ctime = time.time()
-    df = pd.merge(dfnu, df_nnfit, on=["RunID", "Frame", "TriggCounter"], how="left")
+    Neighbouring runs are batched into work units of at most chunksize AntDST entries with run_chunks. Each batch
+    (the AntDST entries and the NNFit files of its runs) is loaded, merged, labelled and reduced to partial sums
+    in a worker, and the partial sums are merged with merge_flag_partials. A failed batch is reported and left out.
+    With a result cache only the batches whose files changed are recomputed, and the stale entries are evicted.
     
-    print("Number of merged events: ", df.shape[0])
-    print("Number of AntDST events: ", dfnu.shape[0])
-    print("Number of NNFit events: ", df_nnfit.shape[0])
+    Args:
+        summary_path (str): The path to the AntDST summary file.
+        nnfit_path (str): The path to the NNFit files.
+        nnfit_files (list): The NNFit files.
+        columns (list): The AntDST columns to load.
+        n_workers (int, optional): Number of worker processes. Defaults to 1.
+        chunksize (int, optional): The maximum number of AntDST entries per batch of runs. Defaults to 500_000.
+        cache (ColumnCache, optional): On-disk cache for the NNFit files. Defaults to None.
+        result_cache (ResultCache, optional): Cache of the partial sums of each batch of runs. Defaults to None.
+        
+    Raises:
+        RuntimeError: If every batch of runs failed.
+        
+    Returns:
+        df_flags (pd.DataFrame): The dataframe containing the number of reconstructed events per reconstructed algorithm.
+    """
+    run_map = nnfit_run_map(nnfit_files, nnfit_path, cache, n_workers, result_cache)
+    if result_cache is None:
+        ranges = run_entry_ranges(summary_path)
+    else:
+        ranges = result_cache.load("run_entry_ranges", summary_path, partial(run_entry_ranges, summary_path))
+    work_units = [(run_ids, sorted(r for run_id in run_ids for r in ranges[run_id]),
+                   sorted({nnfit_file for run_id in run_ids for nnfit_file in run_map.get(run_id, [])}))
+                  for run_ids in run_chunks(ranges, chunksize)]
+    
+    func = partial(run_flag_partials, summary_path=summary_path, nnfit_path=nnfit_path, columns=columns, cache=cache,
+                   result_cache=result_cache)
+    partials, failures = map_reduce(func, work_units, merge_flag_partials, n_workers=n_workers, desc="Runs")
+    
+    if result_cache is not None:
+        result_cache.evict()
+    
+    failed_runs = [run_id for work_unit, _ in failures for run_id in work_unit[0]]
+    if partials is None and failures:
+        raise RuntimeError(f"Every batch of runs failed, the runs {failed_runs} could not be counted.")
+    if failures:
+        print(f"WARNING: the runs {failed_runs} failed and are not counted.")
+    
+    return finalize_flag_partials(partials)
+
+def merged_flag_counter(
+    path,
+    sub_path,
+    summary_file,
+    identifier,
+    columns,
+    cache=None,
+    compact=False,
+    index=None,
+    join_partitions=1,
+    join_workers=1,
+    result_cache=None,
+):
+    """
+    Count the number of reconstructed events per reconstructed algorithm on the whole merged sample.
+    
+    The NNFit and AntDST tables are loaded whole, merged, labelled and counted with flag_counter. With a result cache
+    the table is only recomputed when the summary file or the NNFit files changed, and the stale entries are evicted.
+    
+    Args:
+        path (str): The path to the data of the cluster.
+        sub_path (str): The directory of the summary file in path.
+        summary_file (str): The AntDST summary file.
+        identifier (str): The identifier of the NNFit files.
+        columns (list): The AntDST columns to load.
+        cache (ColumnCache, optional): On-disk cache for the NNFit and AntDST files. Defaults to None.
+        compact (bool, optional): Compact the dtypes of the loaded tables. Defaults to False.
+        index (FileIndex, optional): File index used to select the NNFit files without listing the directory. Defaults to None.
+        join_partitions (int, optional): The number of RunID partitions of the AntDST-NNFit join. Defaults to 1.
+        join_workers (int, optional): The number of worker processes joining the RunID partitions. Defaults to 1.
+        result_cache (ResultCache, optional): Cache of the table. Defaults to None.
+        
+    Returns:
+        df_flags (pd.DataFrame): The dataframe containing the number of reconstructed events per reconstructed algorithm.
+    """
+    def compute():
+        # Load the nnfit data
+        df_nnfit = load_nnfit(path, identifier, cache, compact, index=index)
+    
+        print("Renaming the columns...\n")
+        df_nnfit = prepare_nnfit(df_nnfit)
+    
+        # Load the AntDST extracted files
+        print("Loading the AntDST files...")
+        dfnu = fm.load_rootfile_to_df(os.path.join(path, sub_path, summary_file), columns=columns, cache=cache, compact=compact)
+    
+        # Merge the dataframes
+        print("\nMerging the dataframes...")
+        with stage("merge_events", rows_in=len(dfnu), n_partitions=join_partitions) as current:
+            df, stats = merge_events(dfnu, df_nnfit, on=["RunID", "Frame", "TriggCounter"], how="left",
+                                     partition_on="RunID", n_partitions=join_partitions, n_workers=join_workers, return_stats=True)
+            current.rows_out = len(df)
+    
+        print("Number of merged events: ", df.shape[0])
+        print("Number of AntDST events: ", dfnu.shape[0])
+        print("Number of NNFit events: ", df_nnfit.shape[0])
+        print("Number of AntDST events without NNFit match: ", stats["unmatched_left"])
+        print("Number of NNFit events without AntDST match: ", stats["unmatched_right"])
+    
+        del dfnu, df_nnfit
+    
+        # Create the masks
+        print("\nCreating the masks...")
+        with stage("create_masks", rows_in=len(df)):
+            df = create_masks(df)
+            if compact:
+                df = fm.compact_dtypes(df)
+    
+        # Count the number of reconstructed events
+        print("\nCounting the number of reconstructed events...")
+        with stage("flag_counter", rows_in=len(df)):
+            return flag_counter(df)
+    
+    if result_cache is None:
+        return compute()
     
-    print(f"Data merged in {timedelta(seconds=time.time()-ctime)}\n")
+    nnfit_path = os.path.join(path, "nnfit_reco")
+    paths = [os.path.join(path, sub_path, summary_file)] + [os.path.join(nnfit_path, nnfit_file)
+                                                            for nnfit_file in list_nnfit_files(nnfit_path, identifier, index)]
+    df_flags = result_cache.load("flag_counter", paths, compute, identifier=identifier, columns=columns)
+    result_cache.evict()
+    return df_flags
+
+if __name__ == "__main__":
+    print("Counting reconstructed events...")
     
-    del dfnu, df_nnfit
+    # Parse the arguments
+    args = argument_parser()
+    cluster = args.cluster
+    file = args.files
+    sub_path = args.path
+    cache = column_cache(True if args.cache else None)
+    result_cache = None if args.no_result_cache else ResultCache()
     
-    # Create the masks
-    print("Creating the masks...")
-    ctime = time.time()
+    # Define the cluster
+    path = define_clusters(cluster)
     
-    df = create_masks(df)
-    print(f"Masks created in {timedelta(seconds=time.time()-ctime)}")
+    # Select the NNFit files from the file index instead of listing the directory
+    index = None
+    if args.index is not None:
+        index = FileIndex(args.index)
+        if args.refresh_index:
+            index.refresh(os.path.join(path, "nnfit_reco"))
     
-    # Count the number of reconstructed events
-    print("\nCounting the number of reconstructed events...")
-    ctime = time.time()
+    # Define the flavour type
+    identifier, summary_file = set_file(file)
     
-    df_flags = flag_counter(df)
+    if args.per_run:
+        # Count the flags run by run
+        print("\nCounting the number of reconstructed events run by run...")
+        
+        nnfit_path = os.path.join(path, "nnfit_reco")
+        nnfit_files = list_nnfit_files(nnfit_path, identifier, index)
+        
+        with stage("per_run_flag_counter", n_workers=args.n_workers):
+            df_flags = per_run_flag_counter(os.path.join(path, sub_path, summary_file), nnfit_path, nnfit_files,
+                                            COLUMNS, n_workers=args.n_workers, chunksize=args.chunksize, cache=cache,
+                                            result_cache=result_cache)
+    elif args.stream:
+        # Count the flags chunk by chunk
+        print("\nCounting the number of reconstructed events in streaming mode...")
+        
+        nnfit_path = os.path.join(path, "nnfit_reco")
+        nnfit_files = list_nnfit_files(nnfit_path, identifier, index)
+        
+        with stage("stream_flag_counter", chunksize=args.chunksize):
+            df_flags = stream_flag_counter(os.path.join(path, sub_path, summary_file), nnfit_path, nnfit_files,
+                                           COLUMNS, chunksize=args.chunksize, result_cache=result_cache)
+    else:
+        with stage("merged_flag_counter", n_partitions=args.join_partitions):
+            df_flags = merged_flag_counter(path, sub_path, summary_file, identifier, COLUMNS, cache=cache, compact=args.compact,
+                                           index=index, join_partitions=args.join_partitions, join_workers=args.join_workers,
+                                           result_cache=result_cache)
     
     print(tabulate(df_flags, headers="keys", tablefmt="psql"))
     
     if file != "test":
         with open(f"../summary_files/flag_summary_{file}.txt", "w") as f:
             f.write(tabulate(df_flags, headers="keys", tablefmt="psql"))
-        
-    print(f"Data counted in {timedelta(seconds=time.time()-ctime)}")
     
     print("\n======== END OF SCRIPT ========")
\ No newline at end of file
@@ -0,0 +1,42 @@
+import sys
+import argparse
+sys.path.append("../..")
+import libraries
+
+def argument_parser():
+    parser = argparse.ArgumentParser(description="Build the true-to-smeared energy x cosine zenith migration matrices of the smearing levels.")
+    parser.add_argument("output", type=str, help="The output directory of the migration_<label>.npz files.")
+    parser.add_argument("--levels", type=str, default=",".join(libraries.SMEARING_LEVELS),
+                        help="Comma separated smearing levels: percentages, antares, antares_<dir>_<energy>, orca6 or orca115.")
+    parser.add_argument("--asymmetry_energy", type=str, default="1", help="Comma separated asymmetry factors of the energy sigma.")
+    parser.add_argument("--asymmetry_direction", type=str, default="1", help="Comma separated asymmetry factors of the direction sigma.")
+    parser.add_argument("--method", type=str, default="analytic", choices=["analytic", "files"],
+                        help="Integrate the truncated Gaussians of the smearing, or count the events of the smeared files.")
+    parser.add_argument("--path", type=str, default="/sps/km3net/users/mchadoli/Swim/Data/events/",
+                        help="The directory of the ANTARES_Smeared_<label> directories, with --method files.")
+    parser.add_argument("--binning", type=str, default=None, help="A SWIM binning JSON file. Defaults to the grid of create_json_binning.")
+    parser.add_argument("--nbins", type=int, default=15,
+                        help="The nbins of create_json_binning, without --binning (15 is the binning_ANTARES_16.json of job.sh).")
+    parser.add_argument("--n_points", type=int, default=20, help="The number of points averaged in each true bin, with --method analytic.")
+    parser.add_argument("--chunksize", type=int, default=1_000_000, help="The number of events counted at once, with --method files.")
+    return parser.parse_args()
+
+def main():
+    args = argument_parser()
+    levels = args.levels.split(",")
+    asymmetries = [(float(energy), float(direction))
+                   for energy in args.asymmetry_energy.split(",") for direction in args.asymmetry_direction.split(",")]
+    binning = libraries.binning_from_json(args.binning) if args.binning else libraries.default_binning(args.nbins)
+    options = {"n_points": args.n_points} if args.method == "analytic" else {"chunksize": args.chunksize}
+
+    print(f"\nBuilding the {args.method} migration matrices of the levels: {', '.join(levels)}")
+    matrices = libraries.build_migration_matrices(levels, asymmetries, method=args.method, binning=binning,
+                                                  path=args.path, output=args.output, **options)
+
+    for label, migration in matrices.items():
+        print(f"{label}: {migration.matrix.nnz} non-zero entries")
+
+    print("\n||============== Successful execution! ==============||")
+
+if __name__ == "__main__":
+    main()
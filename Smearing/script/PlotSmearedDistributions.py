@@ -1,8 +1,9 @@
 import sys
 import os
+import argparse
 import numpy as np
-import seaborn as sns
 import matplotlib.pyplot as plt
+from functools import partial
 sys.path.append("../..")
 import libraries
 
@@ -11,35 +12,104 @@ plot_dict = {
     "cos_zenith": "Cosine Zenith",
 }
 
+BINNING = {
+    "energy": np.linspace(0, 100, 15),
+    "cos_zenith": np.linspace(-1, 1, 15),
+}
+
+SMEARING_LEVELS = ["10", "50", "70", "100", "200", "500", "antares"]
+
+COLUMNS = [
+    "energy_true",
+    "cos_zenith_true",
+    "energy_smeared",
+    "cos_zenith_smeared",
+]
+
+def argument_parser():
+    parser = argparse.ArgumentParser(description="Plot the true and smeared energy and direction distributions of the smeared samples.")
+    parser.add_argument("--path", type=str, default="/sps/km3net/users/mchadoli/Swim/Data/events/",
+                        help="The directory of the ANTARES_Smeared_<level> directories.")
+    parser.add_argument("--levels", type=str, default=",".join(SMEARING_LEVELS), help="Comma separated smearing levels.")
+    parser.add_argument("--n_workers", type=int, default=1, help="The number of levels histogrammed in parallel.")
+    parser.add_argument("--chunksize", type=int, default=1_000_000, help="The number of events histogrammed at once.")
+    parser.add_argument("--no_cache", action="store_true", help="Recompute the histograms instead of reading the cached counts.")
+    return parser.parse_args()
+
+def _bin_indices(values, edges):
+    """
+    The bin of each value as in np.histogram (the last bin includes its right edge), -1 outside the binning.
+    """
+    indices = np.searchsorted(edges, values, side="right") - 1
+    indices[values == edges[-1]] = len(edges) - 2
+    indices[(indices < 0) | (indices >= len(edges) - 1) | np.isnan(values)] = -1
+    return indices
+
+def _accumulate_chunk(counts, chunk, binning):
+    for variable, edges in binning.items():
+        n_bins = len(edges) - 1
+        true_bins = _bin_indices(chunk[f"{variable}_true"], edges)
+        smeared_bins = _bin_indices(chunk[f"{variable}_smeared"], edges)
+
+        counts[f"{variable}_true"] += np.bincount(true_bins[true_bins >= 0], minlength=n_bins)
+        counts[f"{variable}_smeared"] += np.bincount(smeared_bins[smeared_bins >= 0], minlength=n_bins)
+
+        both = (true_bins >= 0) & (smeared_bins >= 0)
+        counts[f"{variable}_2d"] += np.bincount(true_bins[both] * n_bins + smeared_bins[both],
+                                                minlength=n_bins * n_bins).reshape(n_bins, n_bins)
+
+def compute_histograms(root_file, binning=BINNING, chunksize=1_000_000):
+    """
+    Histogram the true and smeared energy and cosine zenith of a smeared sample chunk by chunk.
+
+    Args:
+        root_file (str): The smeared ROOT file.
+        binning (dict, optional): The bin edges of each variable. Defaults to BINNING.
+        chunksize (int, optional): The number of events histogrammed at once. Defaults to 1_000_000.
+
+    Returns:
+        dict: The 1D counts of the true and smeared values (<variable>_true, <variable>_smeared) and the 2D counts
+        of true (first axis) vs smeared values (<variable>_2d) of each variable.
+    """
+    counts = {}
+    for variable, edges in binning.items():
+        n_bins = len(edges) - 1
+        counts[f"{variable}_true"] = np.zeros(n_bins, dtype=np.int64)
+        counts[f"{variable}_smeared"] = np.zeros(n_bins, dtype=np.int64)
+        counts[f"{variable}_2d"] = np.zeros((n_bins, n_bins), dtype=np.int64)
+
+    for chunk in libraries.iter_rootfile_chunks(root_file, COLUMNS, chunksize=chunksize):
+        _accumulate_chunk(counts, chunk, binning)
+
+    return counts
+
+def level_histograms(smearing_level, path, binning=BINNING, chunksize=1_000_000, result_cache=None):
+    """
+    The histograms of a smearing level, served from the result cache when the file and the binning did not change.
+    """
+    root_file = os.path.join(path, f"ANTARES_Smeared_{smearing_level}", f"antares_smeared_{smearing_level}.root")
+    compute = partial(compute_histograms, root_file, binning, chunksize)
+
+    if result_cache is None:
+        return {smearing_level: compute()}
+    return {smearing_level: result_cache.load("smeared_histograms", root_file, compute,
+                                              binning={variable: edges.tolist() for variable, edges in binning.items()})}
+
+def _title(variable, smearing_level):
+    if (smearing_level == "antares"):
+        return f"{plot_dict[variable]} at ANTARES-level Smearing"
+    return f"{plot_dict[variable]} at {smearing_level} % Smearing"
+
 def _hist_1d_plot(
-        df,
+        counts,
         variable,
         smearing_level,
         binning,
 ):
     fig, ax = plt.subplots()
-    sns.histplot(
-        data=df,
-        x=f"{variable}_true",
-        bins=binning,
-        element="step",
-        hatch = "|",
-        label=f"True {plot_dict[variable]}",
-        ax=ax
-    )
-    sns.histplot(
-        data=df,
-        x=f"{variable}_smeared",
-        bins=binning,
-        element="step",
-        hatch = "///",
-        label=f"Smeared {plot_dict[variable]}",
-        ax=ax
-    )
-    if (smearing_level == "antares"):
-        ax.set_title(f"{plot_dict[variable]} at ANTARES-level Smearing")
-    else:
-        ax.set_title(f"{plot_dict[variable]} at {smearing_level} % Smearing")
+    ax.stairs(counts[f"{variable}_true"], binning, hatch="|", label=f"True {plot_dict[variable]}")
+    ax.stairs(counts[f"{variable}_smeared"], binning, hatch="///", label=f"Smeared {plot_dict[variable]}")
+    ax.set_title(_title(variable, smearing_level))
     ax.set_ylabel("Counts")
     if (variable == "energy"):
         ax.set_xscale("log")
@@ -52,25 +122,16 @@ def _hist_1d_plot(
     plt.close()
 
 def _hist_2d_plot(
-        df,
+        counts,
         variable,
         smearing_level,
         binning,
 ):
     fig, ax = plt.subplots()
-    sns.histplot(
-        data=df,
-        x=f"{variable}_true",
-        y=f"{variable}_smeared",
-        bins= (binning, binning),
-        cmap="viridis",
-        cbar=True,
-        ax=ax
-    )
-    if (smearing_level == "antares"):
-        ax.set_title(f"{plot_dict[variable]} at ANTARES-level Smearing")
-    else:
-        ax.set_title(f"{plot_dict[variable]} at {smearing_level} % Smearing")
+    # Empty bins are left blank, as in seaborn's histplot
+    mesh = ax.pcolormesh(binning, binning, np.ma.masked_equal(counts[f"{variable}_2d"].T, 0), cmap="viridis")
+    fig.colorbar(mesh, ax=ax)
+    ax.set_title(_title(variable, smearing_level))
     ax.set_xlabel(f"True {plot_dict[variable]}")
     ax.set_ylabel(f"Smeared {plot_dict[variable]}")
 
@@ -83,48 +144,48 @@ def _hist_2d_plot(
     plt.close()
 
 def run_plots(
-        df,
+        counts,
         smearing_level,
         variable,
 ):
     # Plotting
     print("\nStarting Plots")
-    
-    if variable == "energy":
-        binning = np.linspace(0, 100, 15)
-    else:
-        binning = np.linspace(-1, 1, 15)
-        
+    binning = BINNING[variable]
+
     # 1D Histograms
     print(f"Plotting 1D Histograms for {variable}")
-    _hist_1d_plot(df, variable, smearing_level, binning)
+    _hist_1d_plot(counts, variable, smearing_level, binning)
 
     # 2D Histograms
     print(f"Plotting 2D Histograms for {variable}")
-    _hist_2d_plot(df, variable, smearing_level, binning)
+    _hist_2d_plot(counts, variable, smearing_level, binning)
 
 def main():
-    # Define the path to the ROOT file
-    path = "/sps/km3net/users/mchadoli/Swim/Data/events/"
-    COLUMNS = [
-            "energy_true",
-            "cos_zenith_true",
-            "energy_smeared",
-            "cos_zenith_smeared", 
-            ]
-    
-    for smearing_level in ["10", "50", "70", "100", "200", "500", "antares"]:
-        print(f"\nRunning for smearing level {smearing_level} %")
-        root_file = f"antares_smeared_{smearing_level}.root"
+    args = argument_parser()
+    levels = args.levels.split(",")
 
-        # Load the ROOT file into a DataFrame
-        df = libraries.load_large_rootfile_to_df(os.path.join(path, f"ANTARES_Smeared_{smearing_level}", root_file), columns=COLUMNS)
+    result_cache = None if args.no_cache else libraries.ResultCache()
+
+    # Histogram the levels in parallel, the events are only read when a file or the binning changed
+    histograms, failures = libraries.map_reduce(
+        partial(level_histograms, path=args.path, chunksize=args.chunksize, result_cache=result_cache),
+        levels,
+        lambda histograms, other: {**histograms, **other},
+        initial={},
+        n_workers=args.n_workers,
+        desc="Smearing levels",
+    )
+
+    for smearing_level in levels:
+        if smearing_level not in histograms:
+            continue
+        print(f"\nRunning for smearing level {smearing_level} %")
 
         # Run plots for each variable
         for variable in ["energy", "cos_zenith"]:
-            run_plots(df, smearing_level, variable)
+            run_plots(histograms[smearing_level], smearing_level, variable)
 
     print("Done!")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,43 @@
+import sys
+import argparse
+sys.path.append("../..")
+import libraries
+
+def argument_parser():
+    parser = argparse.ArgumentParser(description="Smear the reconstructed energy and direction of a ROOT file, as Smearing.cc, a chunk of events at a time.")
+    parser.add_argument("input_file", type=str, help="The input ROOT file, with the energy_recoTrue and cos_zenith_recoTrue branches.")
+    parser.add_argument("output_file", type=str, help="The output ROOT file.")
+    parser.add_argument("smear_level", type=float, help="The smearing level in percent, e.g. 10.")
+    parser.add_argument("resolution", type=str, choices=["Y", "N"], help="Use the ANTARES resolution function (Y) or the constant level (N).")
+    parser.add_argument("detector", type=str, choices=libraries.DETECTORS, help="The detector.")
+    parser.add_argument("asymmetry_energy", type=float, help="The asymmetry factor of the energy sigma.")
+    parser.add_argument("asymmetry_direction", type=float, help="The asymmetry factor of the direction sigma.")
+    parser.add_argument("--seed", type=int, default=None, help="The master seed. Defaults to fresh entropy (printed).")
+    parser.add_argument("--chunksize", type=int, default=1_000_000, help="The number of events smeared at once.")
+    parser.add_argument("--n_workers", type=int, default=1, help="The number of worker processes. The output does not depend on it.")
+    return parser.parse_args()
+
+def main():
+    args = argument_parser()
+
+    print("\nStarting the smearing")
+    for name, value in vars(args).items():
+        print(f"{name}: {value}")
+
+    libraries.smear_rootfile(
+        args.input_file,
+        args.output_file,
+        smear_level=args.smear_level / 100,
+        use_resolution=args.resolution == "Y",
+        detector=args.detector,
+        asymmetry_energy=args.asymmetry_energy,
+        asymmetry_direction=args.asymmetry_direction,
+        seed=args.seed,
+        chunksize=args.chunksize,
+        n_workers=args.n_workers,
+    )
+
+    print("\n||============== Successful execution! ==============||")
+
+if __name__ == "__main__":
+    main()
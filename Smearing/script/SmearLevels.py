@@ -0,0 +1,34 @@
+import sys
+import argparse
+sys.path.append("../..")
+import libraries
+
+def argument_parser():
+    parser = argparse.ArgumentParser(description="Smear a ROOT file at several smearing levels, reading the input only once.")
+    parser.add_argument("input_file", type=str, help="The input ROOT file, with the energy_recoTrue and cos_zenith_recoTrue branches.")
+    parser.add_argument("output", type=str,
+                        help="The output directory (one ANTARES_Smeared_<level>/antares_smeared_<level>.root per level), or the output file with --mode columns.")
+    parser.add_argument("--levels", type=str, default="10,50,100,200,500",
+                        help="Comma separated smearing levels: percentages, antares, antares_<dir>_<energy>, orca6 or orca115.")
+    parser.add_argument("--mode", type=str, default="files", choices=["files", "columns"],
+                        help="One file per level, or one file with the smeared columns of every level.")
+    parser.add_argument("--seed", type=int, default=None, help="The master seed. Defaults to fresh entropy (printed).")
+    parser.add_argument("--chunksize", type=int, default=1_000_000, help="The number of events smeared at once.")
+    parser.add_argument("--n_workers", type=int, default=1, help="The number of worker processes. The output does not depend on it.")
+    return parser.parse_args()
+
+def main():
+    args = argument_parser()
+    levels = args.levels.split(",")
+
+    print(f"\nSmearing {args.input_file} at the levels: {', '.join(levels)}")
+    paths = libraries.smear_levels_rootfile(args.input_file, levels, args.output, mode=args.mode, seed=args.seed,
+                                           chunksize=args.chunksize, n_workers=args.n_workers)
+
+    for level, path in paths.items():
+        print(f"Level {level}: {path}")
+
+    print("\n||============== Successful execution! ==============||")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,175 @@
+import json
+import os
+import sys
+import tracemalloc
+import numpy as np
+import pandas as pd
+import pytest
+import uproot
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [os.path.join(REPO_DIR, "external_library"), os.path.join(REPO_DIR, "ReconstructionPerformance", "scripts")]
+
+import masks
+import synthetic
+
+# The scripts import the masks as lib_masks, from the analysis directory of the cluster
+sys.modules.setdefault("lib_masks", masks)
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+DEFAULT_SIZES = "10000,100000"
+
+# Time and peak memory of each benchmark of the session, compared to the baseline at the end
+RESULTS = {}
+
+def pytest_addoption(parser):
+    group = parser.getgroup("tau benchmarks")
+    group.addoption("--sizes", default=DEFAULT_SIZES,
+                    help=f"Comma separated numbers of events of the synthetic samples. Defaults to {DEFAULT_SIZES}.")
+    group.addoption("--rounds", type=int, default=3, help="Rounds of each benchmark. Defaults to 3.")
+    group.addoption("--baseline", default=BASELINE_PATH, help="The baseline JSON file.")
+    group.addoption("--update-baseline", action="store_true", help="Write the results of the session to the baseline.")
+    group.addoption("--tolerance", type=float, default=0.5,
+                    help="Relative slowdown or memory increase over the baseline reported as a regression. Defaults to 0.5.")
+    group.addoption("--fail-on-regression", action="store_true", help="Fail the session if a benchmark regressed.")
+
+def pytest_generate_tests(metafunc):
+    if "n_events" in metafunc.fixturenames:
+        sizes = [int(size) for size in metafunc.config.getoption("sizes").split(",")]
+        metafunc.parametrize("n_events", sizes, scope="session", ids=[f"{size}" for size in sizes])
+
+def make_events(n_events, seed=0):
+    """
+    Synthetic AntDST events with the columns of the sel trees, from the sample generator.
+    """
+    run_ids, counts = synthetic.run_event_counts(n_events, (30000, 30999), seed)
+    return synthetic.generate_events(run_ids, counts, np.random.default_rng(seed))
+
+def make_nnfit(events, seed=1):
+    """
+    Synthetic NNFit reconstructions of 90% of the events, with the column names of the NNFit files.
+    """
+    return synthetic.nnfit_reconstructions(events, np.random.default_rng(seed))
+
+@pytest.fixture(scope="session")
+def events(n_events):
+    return make_events(n_events)
+
+@pytest.fixture(scope="session")
+def events_df(events):
+    return pd.DataFrame(events)
+
+@pytest.fixture(scope="session")
+def nnfit_df(events):
+    return make_nnfit(events)
+
+@pytest.fixture(scope="session")
+def root_files(tmp_path_factory, events, n_events):
+    """
+    The events written into four ROOT files with a sel tree.
+    """
+    directory = tmp_path_factory.mktemp(f"root_{n_events}")
+    paths = []
+    for i, indices in enumerate(np.array_split(np.arange(n_events), 4)):
+        path = str(directory / f"sample_{i}.root")
+        with uproot.recreate(path) as f:
+            f.mktree("sel", {column: values.dtype for column, values in events.items()})
+            f["sel"].extend({column: values[indices] for column, values in events.items()})
+        paths.append(path)
+    return paths
+
+@pytest.fixture(scope="session")
+def hdf5_files(tmp_path_factory, events, n_events):
+    """
+    The NNFit reconstructions written into one HDF5 file per block of runs, in fixed and table format.
+    """
+    df = make_nnfit(events)
+    files = {}
+    for file_format in ("fixed", "table"):
+        directory = tmp_path_factory.mktemp(f"nnfit_{file_format}_{n_events}")
+        for i, indices in enumerate(np.array_split(np.arange(len(df)), 8)):
+            df.iloc[indices].to_hdf(str(directory / f"nnfit_{i}.hdf5"), key="df", format=file_format,
+                        data_columns=["RunID", "Type", "energy_true"] if file_format == "table" else None)
+        files[file_format] = (str(directory), sorted(os.listdir(directory)))
+    return files
+
+@pytest.fixture
+def measure(benchmark, request):
+    """
+    Benchmark a function: its time with pytest-benchmark and its peak memory with tracemalloc, in a separate call.
+    """
+    def run(func, *args, **kwargs):
+        tracemalloc.start()
+        func(*args, **kwargs)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        peak_mb = peak / 1024**2
+        benchmark.extra_info["peak_memory_mb"] = peak_mb
+        result = benchmark.pedantic(func, args, kwargs, rounds=request.config.getoption("rounds"), iterations=1)
+
+        stats = getattr(benchmark, "stats", None)
+        RESULTS[f"{request.node.module.__name__}::{request.node.name}"] = {
+            "min_s": stats.stats.min if stats is not None else None,
+            "mean_s": stats.stats.mean if stats is not None else None,
+            "peak_memory_mb": peak_mb,
+        }
+        return result
+    return run
+
+def _regressions(results, baseline, tolerance):
+    regressions = []
+    for name, result in sorted(results.items()):
+        reference = baseline.get(name)
+        if reference is None:
+            continue
+        # The fastest round is the least sensitive to the load of the machine
+        for metric in ("min_s", "peak_memory_mb"):
+            if result[metric] is None or not reference.get(metric):
+                continue
+            ratio = result[metric] / reference[metric]
+            if ratio > 1 + tolerance:
+                regressions.append(f"{name}: {metric} {result[metric]:.4g} vs baseline {reference[metric]:.4g} (x{ratio:.2f})")
+    return regressions
+
+@pytest.hookimpl(tryfirst=True)
+def pytest_sessionfinish(session, exitstatus):
+    """
+    Update the baseline, or compare the results of the session to it.
+    """
+    config = session.config
+    config.baseline_report = []
+    if not RESULTS:
+        return
+
+    baseline_path = config.getoption("baseline")
+    baseline = {}
+    if os.path.exists(baseline_path):
+        with open(baseline_path) as f:
+            baseline = json.load(f)
+
+    if config.getoption("update_baseline"):
+        baseline.update(RESULTS)
+        with open(baseline_path, "w") as f:
+            json.dump(baseline, f, indent=2, sort_keys=True)
+        config.baseline_report.append(f"Baseline of {len(RESULTS)} benchmarks written to {baseline_path}")
+        return
+
+    if not baseline:
+        config.baseline_report.append(f"No baseline at {baseline_path}, run with --update-baseline to create it")
+        return
+
+    regressions = _regressions(RESULTS, baseline, config.getoption("tolerance"))
+    compared = len([name for name in RESULTS if name in baseline])
+    config.baseline_report.append(f"{compared} benchmarks compared to {baseline_path}, {len(regressions)} regressions")
+    config.baseline_report.extend(f"REGRESSION {regression}" for regression in regressions)
+
+    if regressions and config.getoption("fail_on_regression"):
+        session.exitstatus = pytest.ExitCode.TESTS_FAILED
+
+def pytest_terminal_summary(terminalreporter, exitstatus, config):
+    report = getattr(config, "baseline_report", [])
+    if report:
+        terminalreporter.section("comparison with the baseline")
+        for line in report:
+            terminalreporter.write_line(line)
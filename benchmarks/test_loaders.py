@@ -0,0 +1,111 @@
+import os
+import pickle
+import numpy as np
+import pandas as pd
+import pytest
+import file_management as fm
+from cache import ColumnCache
+from result_cache import ResultCache
+
+COLUMNS = ["RunID", "EventID", "TriggCounter", "Frame", "Type", "interaction_type", "is_cc", "energy_true", "cos_zenith_true"]
+NNFIT_COLUMNS = ["RunID", "EventID", "TrigCount", "NNFitTrack_Theta", "NNFitShower_Theta"]
+CUTS = [
+    {"cut_key": "energy_true", "cut_value": 10, "cut_type": "greater"},
+    {"cut_key": "energy_true", "cut_value": 100, "cut_type": "less"},
+    {"cut_key": "Type", "cut_value": 16, "cut_type": "equal"},
+]
+
+def test_load_rootfile_to_df(measure, root_files):
+    df = measure(fm.load_rootfile_to_df, root_files[0], columns=COLUMNS)
+    assert list(df.columns) == COLUMNS
+
+def test_load_large_rootfile_to_df(measure, root_files):
+    df = measure(fm.load_large_rootfile_to_df, root_files[0], columns=COLUMNS, chunksize=10_000)
+    assert list(df.columns) == COLUMNS
+
+def test_load_large_rootfile_to_df_cuts(measure, root_files):
+    df = measure(fm.load_large_rootfile_to_df, root_files[0], columns=COLUMNS, chunksize=10_000, cuts=CUTS)
+    assert (df["Type"] == 16).all()
+
+def test_concat_rootfiles_to_df(measure, root_files, n_events):
+    df = measure(fm.concat_rootfiles_to_df, root_files, columns=COLUMNS, chunksize=10_000)
+    assert len(df) == n_events
+
+def test_load_dataframes_fixed(measure, hdf5_files):
+    folder, files = hdf5_files["fixed"]
+    df = measure(fm.load_dataframes, files, folder_path=folder, columns=NNFIT_COLUMNS)
+    assert list(df.columns) == NNFIT_COLUMNS
+
+def test_load_dataframes_table(measure, hdf5_files):
+    folder, files = hdf5_files["table"]
+    df = measure(fm.load_dataframes, files, folder_path=folder, columns=NNFIT_COLUMNS)
+    assert list(df.columns) == NNFIT_COLUMNS
+
+def test_load_dataframes_cuts(measure, hdf5_files):
+    folder, files = hdf5_files["fixed"]
+    df = measure(fm.load_dataframes, files, cuts=CUTS, folder_path=folder)
+    assert (df["Type"] == 16).all()
+
+def test_load_dataframes_where(measure, hdf5_files):
+    folder, files = hdf5_files["table"]
+    df = measure(fm.load_dataframes, files, folder_path=folder, where="(Type == 16) & (energy_true > 10) & (energy_true < 100)")
+    assert (df["Type"] == 16).all()
+
+def test_save_to_hdf5_chunks_min_itemsize(tmp_path):
+    # The strings of the second chunk are longer than those of the first one, which set the width of the table
+    chunks = [pd.DataFrame({"RunID": [1, 2], "label": ["ab", "cd"]}), pd.DataFrame({"RunID": [3], "label": ["much longer"]})]
+    with pytest.raises(ValueError):
+        fm.save_to_hdf5(iter(chunks), "narrow.h5", path=tmp_path, format="table")
+    fm.save_to_hdf5(iter(chunks), "wide.h5", path=tmp_path, format="table", min_itemsize={"label": 20})
+    df = pd.read_hdf(tmp_path / "wide.h5")
+    assert df["label"].tolist() == ["ab", "cd", "much longer"]
+
+def test_column_cache_eviction(tmp_path):
+    cache = ColumnCache(str(tmp_path))
+    for key, n_rows in [("old", 1000), ("new", 10)]:
+        cache.put(key, pd.DataFrame({"energy_true": np.arange(n_rows, dtype=np.float64)}))
+    os.utime(cache._path("old"), (1000, 1000))
+    os.utime(cache._path("new"), (2000, 2000))
+
+    # The least recently used entry goes first
+    cache.max_bytes = os.path.getsize(cache._path("new"))
+    cache.evict()
+    assert cache.get("old") is None and cache.get("new") is not None
+
+    # An entry removed by another process in the meantime is skipped
+    os.remove(cache._path("new"))
+    cache.evict()
+    cache.clear()
+    assert cache.entries() == []
+
+def test_result_cache_eviction(tmp_path):
+    cache = ResultCache(str(tmp_path / "results"))
+    inputs = [tmp_path / "run_1.hdf5", tmp_path / "run_2.hdf5"]
+    for path in inputs:
+        path.write_text("events")
+
+    calls = []
+    def compute():
+        calls.append(1)
+        return {"sums": np.arange(1000)}
+
+    for path in inputs:
+        cache.load("flag_partials", str(path), compute)
+    cache.load("flag_partials", str(inputs[0]), compute)
+    assert len(calls) == 2
+
+    # Only the entry of the changed input is stale
+    inputs[1].write_text("more events")
+    assert cache.evict_stale() == 1
+    assert len(cache.entries()) == 1
+
+    # Entries pickled by an older version of the cache are stale
+    path = cache.entries()[0][0]
+    with open(path, "wb") as f:
+        pickle.dump({"paths": [str(inputs[0])], "fingerprints": [], "result": None}, f)
+    cache.load("flag_partials", str(inputs[0]), compute)
+    assert len(calls) == 3
+
+    cache.max_bytes = 0
+    cache.evict()
+    assert cache.entries() == []
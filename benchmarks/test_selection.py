@@ -0,0 +1,135 @@
+import numpy as np
+import pandas as pd
+import pytest
+import count_flags
+import cuts
+import masks
+from joins import merge_events
+
+CUTS = [
+    {"cut_key": "energy_true", "cut_value": 10, "cut_type": "greater"},
+    {"cut_key": "energy_true", "cut_value": 100, "cut_type": "less"},
+    {"cut_key": "cos_zenith_true", "cut_value": 0, "cut_type": "less"},
+    {"cut_key": "Type", "cut_value": [16, -16], "cut_type": "isin"},
+]
+
+# AntDST columns merged with the NNFit reconstructions in count_flags, as the script loads them
+MERGE_COLUMNS = count_flags.COLUMNS
+
+def _nnfit(nnfit_df):
+    # The NNFit columns count_flags loads, ready to be merged
+    return count_flags.prepare_nnfit(nnfit_df[count_flags.NNFIT_COLUMNS].copy())
+
+def _cut_loop(df, cut_list):
+    # The cut loop of the loaders before the compiled cuts: one boolean indexing per cut
+    for cut in cut_list:
+        operator = cuts.CUT_TYPES.get(cut["cut_type"])
+        if operator is None:
+            df = df[df[cut["cut_key"]].isin(cut["cut_value"])]
+        else:
+            df = df.query(f"{cut['cut_key']} {operator} {cut['cut_value']}")
+    return df
+
+def test_cut_loop(measure, events_df):
+    measure(_cut_loop, events_df, CUTS)
+
+def test_compiled_cuts(measure, events_df):
+    df = measure(cuts.compile_cuts(CUTS).apply, events_df)
+    assert df.equals(_cut_loop(events_df, CUTS))
+
+def test_string_value_cut():
+    df = pd.DataFrame({"name": ["x", "y", "x&y"], "energy_true": [1.0, 2.0, 3.0]})
+    mask = cuts.cut_mask(df, [{"cut_key": "name", "cut_value": "x", "cut_type": "equal"}])
+    assert mask.tolist() == [True, False, False]
+    mask = cuts.cut_mask(df, [{"cut_key": "name", "cut_value": ["y", "x&y"], "cut_type": "isin"}])
+    assert mask.tolist() == [False, True, True]
+
+def test_non_identifier_column_cut():
+    df = pd.DataFrame({"my col": [1.0, 2.0, 3.0], "a|b": [0, 1, 1]})
+    cut = cuts.compile_cuts([{"cut_key": "my col", "cut_value": 1.5, "cut_type": "greater"},
+                             {"cut_key": "a|b", "cut_value": 1, "cut_type": "equal"}])
+    assert cut.columns == ["my col", "a|b"]
+    for engine in ["numexpr", "numpy"]:
+        assert cut.mask(df, engine=engine).tolist() == [False, True, True]
+    assert cuts.cut_mask(df, "(`my col` < 3) && !(`a|b` == 0)").tolist() == [False, True, False]
+
+def test_boolean_operators_engine_parity():
+    # Integer flags stored as 0/1 (or any non-zero value) are true as in Python, under numexpr as under NumPy
+    df = pd.DataFrame({"is_cc": [0, 1, 2, 0], "type": [1, 1, 0, 0], "flag": [True, False, True, False],
+                       "energy_true": [5.0, 20.0, 50.0, 200.0]})
+    expected = {
+        "!is_cc": [True, False, False, True],
+        "is_cc & type": [False, True, False, False],
+        "is_cc || flag": [True, True, True, False],
+        "!flag && (energy_true > 10)": [False, True, False, True],
+        "not (is_cc and flag)": [True, True, False, True],
+    }
+    for expression, mask in expected.items():
+        cut = cuts.compile_cuts(expression)
+        for engine in ["numexpr", "numpy"]:
+            assert cut.mask(df, engine=engine).tolist() == mask, (expression, engine)
+
+def test_cut_engine_parity(events_df):
+    expression = "(energy_true > 10) & (energy_true < 100) & !is_cc || (Type == 16) && (cos_zenith_true < 0)"
+    for cut in [cuts.compile_cuts(CUTS), cuts.compile_cuts(expression)]:
+        assert (cut.mask(events_df, engine="numexpr") == cut.mask(events_df, engine="numpy")).all()
+
+def test_classify_events_matches_apply_all_masks(events_df):
+    expected = masks.apply_all_masks(events_df.copy())
+    labelled = masks.classify_events(events_df.copy())
+    # The summary files of count_flags hold the PDG type as Type
+    summary = count_flags.create_masks(events_df[MERGE_COLUMNS].copy())
+    for column in ["Flavour type", "Event type"]:
+        for df in [labelled, summary]:
+            assert df[column].astype(object).fillna("").tolist() == expected[column].astype(object).fillna("").tolist()
+
+def test_query_maskbits(events_df):
+    df = masks.compute_maskbits(events_df.copy(), recompute=True)
+    expected = masks.get_nutaumask(df) & masks.get_upgoingmask(df) & ~masks.get_showermask_nc(df)
+    assert (masks.query_maskbits(df, "nutau & upgoing & ~showers_nc") == expected.to_numpy()).all()
+    assert (masks.query_maskbits(df, "nue or not numu") == (masks.get_nuemask(df) | ~masks.get_numumask(df)).to_numpy()).all()
+
+    df = masks.compute_maskbits(events_df.copy(), names=["nutau"], recompute=True)
+    with pytest.raises(KeyError):
+        masks.query_maskbits(df, "nutau & upgoing")
+
+def test_merge_events_matches_pandas(events_df, nnfit_df):
+    df_nnfit = _nnfit(nnfit_df)
+    for how in ["left", "inner"]:
+        expected = pd.merge(events_df[MERGE_COLUMNS], df_nnfit, on=["RunID", "Frame", "TriggCounter"], how=how)
+        pd.testing.assert_frame_equal(merge_events(events_df[MERGE_COLUMNS], df_nnfit, how=how), expected)
+        pd.testing.assert_frame_equal(merge_events(events_df[MERGE_COLUMNS], df_nnfit, how=how, partition_on="RunID",
+                                                   n_partitions=4), expected)
+
+def test_apply_all_masks(measure, events_df):
+    measure(masks.apply_all_masks, events_df.copy())
+
+def test_classify_events(measure, events_df):
+    measure(masks.classify_events, events_df.copy())
+
+def test_compute_maskbits(measure, events_df):
+    measure(masks.compute_maskbits, events_df.copy(), recompute=True)
+
+def _merged_events(events_df, nnfit):
+    df_nnfit = _nnfit(nnfit)
+    df = pd.merge(events_df[MERGE_COLUMNS], df_nnfit, on=["RunID", "Frame", "TriggCounter"], how="left")
+    return count_flags.create_masks(df)
+
+def test_pandas_merge(measure, events_df, nnfit_df):
+    measure(pd.merge, events_df[MERGE_COLUMNS], _nnfit(nnfit_df),
+            on=["RunID", "Frame", "TriggCounter"], how="left")
+
+def test_merge_events(measure, events_df, nnfit_df):
+    measure(merge_events, events_df[MERGE_COLUMNS], _nnfit(nnfit_df))
+
+def test_flag_counter(measure, events_df, nnfit_df):
+    df = _merged_events(events_df, nnfit_df)
+    measure(count_flags.flag_counter, df)
+
+def test_merge_events_float_keys():
+    # Keys upcast to float (e.g. by an earlier left join) cannot be packed and are joined as pd.merge does
+    left = pd.DataFrame({"RunID": [1.0, 2.0, np.nan, 2.0], "Frame": [1, 1, 1, 1], "TriggCounter": [0, 0, 0, 0], "a": [1, 2, 3, 4]})
+    right = pd.DataFrame({"RunID": [2.0, 1.0, 2.0], "Frame": [1, 1, 1], "TriggCounter": [0, 0, 0], "b": [5, 6, 7]})
+    for how in ["left", "inner"]:
+        pd.testing.assert_frame_equal(merge_events(left, right, how=how),
+                                      pd.merge(left, right, on=["RunID", "Frame", "TriggCounter"], how=how))
@@ -0,0 +1,30 @@
+import os
+import numpy as np
+import uproot
+import migration
+import smearing
+
+def _smeared(directory, label):
+    with uproot.open(os.path.join(directory, smearing.LEVEL_FILE_PATTERN.format(label=label))) as f:
+        return f["sel"].arrays(list(smearing.SMEARED_COLUMNS), library="np")
+
+def test_smearing_reproducibility(tmp_path, root_files):
+    # For a seed and a chunksize the sample does not depend on the number of workers or on the other levels of the pass
+    smearing.smear_levels_rootfile(root_files[0], ["10", "antares"], str(tmp_path / "serial"), seed=42, chunksize=1000)
+    smearing.smear_levels_rootfile(root_files[0], ["antares"], str(tmp_path / "parallel"), seed=42, chunksize=1000, n_workers=2)
+    smearing.smear_levels_rootfile(root_files[0], ["antares"], str(tmp_path / "other_seed"), seed=43, chunksize=1000)
+
+    serial, parallel = _smeared(tmp_path / "serial", "antares"), _smeared(tmp_path / "parallel", "antares")
+    other_seed = _smeared(tmp_path / "other_seed", "antares")
+    for column in smearing.SMEARED_COLUMNS:
+        assert np.array_equal(serial[column], parallel[column])
+        assert not np.array_equal(serial[column], other_seed[column])
+
+def test_migration_labels():
+    # The labels of the smeared directories of Chi2Profile/job.sh, e.g. ANTARES_Smeared_antares_0.9_1.0
+    assert migration.migration_label("antares") == "antares"
+    assert migration.migration_label("antares", asymmetry_energy=1.0, asymmetry_direction=0.9) == "antares_0.9_1.0"
+    assert migration.migration_label("10", asymmetry_energy=3, asymmetry_direction=1) == "10_1.0_3.0"
+    for asymmetry_energy, asymmetry_direction in [(0.8, 0.9), (1.0, 0.5)]:
+        label = migration.migration_label("antares", asymmetry_energy, asymmetry_direction)
+        assert smearing.level_config(label) == smearing.level_config("antares", asymmetry_energy, asymmetry_direction)
@@ -2,4 +2,14 @@
 
 from .style import *
 from .masks import *
-from .file_management import *
\ No newline at end of file
+from .file_management import *
+from .cache import *
+from .file_index import *
+from .cuts import *
+from .joins import *
+from .mapreduce import *
+from .result_cache import *
+from .synthetic import *
+from .instrumentation import *
+from .smearing import *
+from .migration import *
\ No newline at end of file
@@ -0,0 +1,197 @@
+import hashlib
+import json
+import os
+import pandas as pd
+
+DEFAULT_CACHE_DIR = os.environ.get(
+    "TAU_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "tau_appearance")
+)
+DEFAULT_MAX_BYTES = int(os.environ.get("TAU_CACHE_MAX_BYTES", 20 * 1024**3))
+# The column cache is opt-in: the scripts only use it with their --cache switch or with TAU_CACHE=1
+CACHE_ENABLED = os.environ.get("TAU_CACHE", "0").lower() not in ("", "0", "false", "no", "off")
+
+def file_fingerprint(path):
+    """
+    Fingerprint of a file made of its absolute path, modification time and size.
+
+    Args:
+        path (str): The path to the file.
+
+    Returns:
+        list: [absolute path, mtime in ns, size in bytes]
+    """
+    stat = os.stat(path)
+    return [os.path.abspath(path), stat.st_mtime_ns, stat.st_size]
+
+class ColumnCache:
+    """
+    Columnar on-disk cache for DataFrames read from ROOT or HDF5 files.
+
+    Each entry is stored as a Parquet (or Feather) file named after the hash of the input file fingerprints
+    (path, mtime and size), the tree, the columns and any extra reading parameter. Touching an input file
+    therefore invalidates its entries. When the cache grows beyond max_bytes the least recently used
+    entries are removed.
+
+    Args:
+        cache_dir (str, optional): Directory of the cache. Defaults to $TAU_CACHE_DIR or ~/.cache/tau_appearance.
+        max_bytes (int, optional): Size cap of the cache in bytes. Defaults to $TAU_CACHE_MAX_BYTES or 20 GB.
+        file_format (str, optional): "parquet" or "feather". Defaults to "parquet".
+    """
+    def __init__(self, cache_dir=None, max_bytes=None, file_format="parquet"):
+        if file_format not in ("parquet", "feather"):
+            raise ValueError("Invalid cache format. The valid formats are 'parquet' and 'feather'.")
+
+        self.cache_dir = cache_dir if cache_dir is not None else DEFAULT_CACHE_DIR
+        self.max_bytes = max_bytes if max_bytes is not None else DEFAULT_MAX_BYTES
+        self.file_format = file_format
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def key(self, paths, tree=None, columns=None, **params):
+        """
+        Build the cache key of a read.
+
+        Args:
+            paths (str or list): The input file(s).
+            tree (str, optional): The tree (ROOT) or key (HDF5) that is read. Defaults to None.
+            columns (list, optional): The columns that are read. None means all of them. Defaults to None.
+            **params: Any other parameter changing the content of the result (e.g. the cuts).
+
+        Returns:
+            str: The hexadecimal key of the entry.
+        """
+        if isinstance(paths, str):
+            paths = [paths]
+
+        description = {
+            "files": [file_fingerprint(path) for path in paths],
+            "tree": tree,
+            "columns": None if columns is None else list(columns),
+            "params": params,
+        }
+        return hashlib.sha1(json.dumps(description, sort_keys=True, default=str).encode()).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.{self.file_format}")
+
+    def get(self, key):
+        """
+        Return the cached DataFrame of a key, or None if there is no entry.
+        """
+        path = self._path(key)
+        if not os.path.exists(path):
+            return None
+
+        # The modification time of the entry is its last access time for the LRU eviction
+        os.utime(path)
+        if self.file_format == "parquet":
+            return pd.read_parquet(path)
+        return pd.read_feather(path)
+
+    def put(self, key, df):
+        """
+        Store a DataFrame under a key and evict old entries if the cache is over its size cap.
+        Frames that cannot be written in the cache format (e.g. jagged columns) are not cached.
+        """
+        path = self._path(key)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        try:
+            if self.file_format == "parquet":
+                df.to_parquet(tmp_path)
+            else:
+                df.reset_index(drop=True).to_feather(tmp_path)
+            os.replace(tmp_path, path)
+        except Exception as error:
+            # pyarrow raises its own ArrowException subclasses for the dtypes it cannot write
+            print(f"The DataFrame could not be cached: {error}")
+            _remove(tmp_path)
+            return
+
+        self.evict()
+
+    def load(self, paths, loader, tree=None, columns=None, **params):
+        """
+        Serve a read from the cache, or run the loader and cache its result.
+
+        Args:
+            paths (str or list): The input file(s).
+            loader (callable): Function without arguments returning the DataFrame when there is no cached copy.
+            tree (str, optional): The tree (ROOT) or key (HDF5) that is read. Defaults to None.
+            columns (list, optional): The columns that are read. Defaults to None.
+            **params: Any other parameter changing the content of the result.
+
+        Returns:
+            DataFrame: The cached or freshly loaded DataFrame.
+        """
+        key = self.key(paths, tree, columns, **params)
+        df = self.get(key)
+        if df is not None:
+            print(f"Loaded from the cache: {self._path(key)}")
+            return df
+
+        df = loader()
+        self.put(key, df)
+        return df
+
+    def entries(self):
+        """
+        Return the cache entries as a list of (path, size, last access time), the least recently used first.
+        """
+        entries = []
+        for entry in os.scandir(self.cache_dir):
+            if entry.is_file() and entry.name.endswith(f".{self.file_format}"):
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    # Evicted by another process in the meantime
+                    continue
+                entries.append((entry.path, stat.st_size, stat.st_mtime))
+        return sorted(entries, key=lambda entry: entry[2])
+
+    def size(self):
+        """
+        Return the total size of the cache in bytes.
+        """
+        return sum(size for _, size, _ in self.entries())
+
+    def evict(self):
+        """
+        Remove the least recently used entries until the cache is below its size cap.
+        """
+        entries = self.entries()
+        total = sum(size for _, size, _ in entries)
+        for path, size, _ in entries:
+            if total <= self.max_bytes:
+                break
+            _remove(path)
+            total -= size
+
+    def clear(self):
+        """
+        Remove every entry of the cache.
+        """
+        for path, _, _ in self.entries():
+            _remove(path)
+
+def _remove(path):
+    """
+    Remove a file, which another process sharing the cache may already have removed.
+    """
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+def column_cache(enabled=None, **kwargs):
+    """
+    Return a ColumnCache if the column cache is enabled, None otherwise.
+
+    Args:
+        enabled (bool, optional): Enable the cache, e.g. from the --cache switch of a script. Defaults to None ($TAU_CACHE).
+        **kwargs: Passed to ColumnCache.
+
+    Returns:
+        ColumnCache: The cache, or None if it is disabled.
+    """
+    if enabled is None:
+        enabled = CACHE_ENABLED
+    return ColumnCache(**kwargs) if enabled else None
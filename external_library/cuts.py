@@ -0,0 +1,301 @@
+import ast
+import re
+import keyword
+import numpy as np
+
+try:
+    import numexpr
+except ImportError:
+    numexpr = None
+
+# Comparison operators of the cut dictionaries used by the loaders ({'cut_key', 'cut_value', 'cut_type'})
+CUT_TYPES = {
+    "greater": ">",
+    "less": "<",
+    "equal": "==",
+    "greater_equal": ">=",
+    "less_equal": "<=",
+    "not_equal": "!=",
+}
+
+_COMPARISONS = {
+    ast.Gt: (">", np.greater),
+    ast.Lt: ("<", np.less),
+    ast.GtE: (">=", np.greater_equal),
+    ast.LtE: ("<=", np.less_equal),
+    ast.Eq: ("==", np.equal),
+    ast.NotEq: ("!=", np.not_equal),
+}
+
+_ARITHMETIC = {
+    ast.Add: ("+", np.add),
+    ast.Sub: ("-", np.subtract),
+    ast.Mult: ("*", np.multiply),
+    ast.Div: ("/", np.divide),
+    ast.Pow: ("**", np.power),
+    ast.Mod: ("%", np.mod),
+}
+
+_FUNCTIONS = {
+    "abs": np.abs,
+    "sqrt": np.sqrt,
+    "exp": np.exp,
+    "log": np.log,
+    "log10": np.log10,
+    "cos": np.cos,
+    "sin": np.sin,
+}
+
+def _translate(expression):
+    """
+    Translate the ROOT/pandas boolean operators (&&, ||, !, &, |, ~) of a selection into Python's and/or/not,
+    which bind looser than the comparisons. Quoted string literals are left untouched.
+    """
+    parts = re.split(r"""('(?:[^'\\]|\\.)*'|"(?:[^"\\]|\\.)*")""", expression)
+    for index in range(0, len(parts), 2):
+        part = re.sub(r"&&?", " and ", parts[index])
+        part = re.sub(r"\|\|?", " or ", part)
+        parts[index] = re.sub(r"!(?!=)|~", " not ", part)
+    return "".join(parts)
+
+def _literal(value):
+    """
+    Python literal of a cut value (NumPy scalars included), quoted when it is not a number.
+    """
+    if isinstance(value, (bool, np.bool_)):
+        return repr(bool(value))
+    if isinstance(value, (int, np.integer)):
+        return repr(int(value))
+    if isinstance(value, (str, bytes)):
+        return repr(str(value))
+    try:
+        return repr(float(value))
+    except (TypeError, ValueError):
+        return repr(str(value))
+
+def _column(name):
+    """
+    A column name of a cut dictionary, backtick-quoted when it is not a valid identifier.
+    """
+    name = str(name)
+    if name.isidentifier() and not keyword.iskeyword(name):
+        return name
+    return f"`{name}`"
+
+def _dict_to_expression(cut):
+    """
+    Translate one cut dictionary into an expression string.
+    """
+    cut_key   = _column(cut['cut_key'])
+    cut_value = cut['cut_value']
+    cut_type  = cut['cut_type']
+
+    if cut_type in CUT_TYPES:
+        return f"({cut_key} {CUT_TYPES[cut_type]} {_literal(cut_value)})"
+    elif cut_type == "between":
+        return f"between({cut_key}, {_literal(cut_value[0])}, {_literal(cut_value[1])})"
+    elif cut_type == "isin":
+        return f"isin({cut_key}, [{', '.join(_literal(value) for value in cut_value)}])"
+    raise ValueError("Invalid cut type")
+
+def _is_boolean(node):
+    """
+    Whether a node of a selection always evaluates to booleans: comparisons, and/or/not, between and isin.
+    """
+    if isinstance(node, (ast.Compare, ast.BoolOp)):
+        return True
+    if isinstance(node, ast.UnaryOp) and isinstance(node.op, ast.Not):
+        return True
+    if isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and node.func.id in ("between", "isin"):
+        return True
+    return isinstance(node, ast.Constant) and isinstance(node.value, bool)
+
+class CompiledCut:
+    """
+    A selection compiled once into a single vectorised evaluation over the columns.
+
+    The selection is a boolean expression combining comparisons with and/or/not (or their ROOT spellings &&, ||, !),
+    arithmetic, the functions abs, sqrt, exp, log, log10, cos and sin, and the helpers
+    between(x, low, high) (inclusive) and isin(x, [values]). Column names that are not identifiers are quoted with
+    backticks, as in DataFrame.query, and strings are compared with quoted literals. It is evaluated with numexpr
+    when available (numerical selections only), with NumPy otherwise, and always returns one boolean mask.
+
+    Args:
+        expression (str): The selection, e.g. "(abs(type) == 16) && between(energy_true, 10, 100) && !(cos_zenith_true > 0)".
+
+    Raises:
+        ValueError: If the expression uses unsupported syntax.
+    """
+    def __init__(self, expression):
+        self.expression = expression
+        # Backtick-quoted column names are replaced by identifiers before the operators are translated
+        names = list(dict.fromkeys(re.findall(r"`([^`]*)`", expression)))
+        self._quoted = {f"__column_{index}__": name for index, name in enumerate(names)}
+        source = re.sub(r"`([^`]*)`", lambda match: f"__column_{names.index(match.group(1))}__", expression)
+        try:
+            self._tree = ast.parse(_translate(source).strip(), mode="eval").body
+        except SyntaxError as error:
+            raise ValueError(f"Invalid cut expression: {expression}") from error
+
+        self.columns = []
+        self._identifiers = {}
+        self._strings = False
+        self._source = self._to_source(self._tree)
+
+    def __repr__(self):
+        return f"CompiledCut({self.expression!r})"
+
+    def _to_source(self, node):
+        """
+        Validate a node, record the columns it uses and return its numexpr source.
+        """
+        if isinstance(node, ast.BoolOp):
+            operator = " & " if isinstance(node.op, ast.And) else " | "
+            return "(" + operator.join(self._boolean_source(value) for value in node.values) + ")"
+        if isinstance(node, ast.UnaryOp):
+            if isinstance(node.op, ast.Not):
+                return f"(~{self._boolean_source(node.operand)})"
+            if isinstance(node.op, ast.USub):
+                return f"(-{self._to_source(node.operand)})"
+            if isinstance(node.op, ast.UAdd):
+                return self._to_source(node.operand)
+        if isinstance(node, ast.Compare):
+            terms, left = [], self._to_source(node.left)
+            for op, comparator in zip(node.ops, node.comparators):
+                if type(op) not in _COMPARISONS:
+                    raise ValueError(f"Unsupported comparison in cut expression: {self.expression}")
+                right = self._to_source(comparator)
+                terms.append(f"({left} {_COMPARISONS[type(op)][0]} {right})")
+                left = right
+            return "(" + " & ".join(terms) + ")"
+        if isinstance(node, ast.BinOp) and type(node.op) in _ARITHMETIC:
+            return f"({self._to_source(node.left)} {_ARITHMETIC[type(node.op)][0]} {self._to_source(node.right)})"
+        if isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and not node.keywords:
+            name, args = node.func.id, node.args
+            if name == "between" and len(args) == 3:
+                x = self._to_source(args[0])
+                return f"(({x} >= {self._to_source(args[1])}) & ({x} <= {self._to_source(args[2])}))"
+            if name == "isin" and len(args) == 2 and isinstance(args[1], (ast.List, ast.Tuple)):
+                x = self._to_source(args[0])
+                values = [self._to_source(value) for value in args[1].elts]
+                return "(" + " | ".join(f"({x} == {value})" for value in values) + ")" if values else "False"
+            if name in _FUNCTIONS and len(args) == 1:
+                return f"{name}({self._to_source(args[0])})"
+        if isinstance(node, ast.Name):
+            if node.id not in self._identifiers:
+                self._identifiers[node.id] = self._quoted.get(node.id, node.id)
+                self.columns.append(self._identifiers[node.id])
+            return node.id
+        if isinstance(node, ast.Constant) and isinstance(node.value, (bool, int, float, str)):
+            self._strings |= isinstance(node.value, str)
+            return repr(node.value)
+        raise ValueError(f"Unsupported syntax in cut expression: {self.expression}")
+
+    def _boolean_source(self, node):
+        """
+        The numexpr source of an operand of and/or/not. numexpr evaluates them bitwise, so operands that are not
+        already boolean (e.g. an integer flag column) are compared to zero, as Python's truth value does.
+        """
+        source = self._to_source(node)
+        if _is_boolean(node):
+            return source
+        return f"({source} != 0)"
+
+    def _evaluate(self, node, arrays):
+        """
+        Evaluate a node with NumPy.
+        """
+        if isinstance(node, ast.BoolOp):
+            reduce = np.logical_and.reduce if isinstance(node.op, ast.And) else np.logical_or.reduce
+            return reduce([self._evaluate(value, arrays) for value in node.values])
+        if isinstance(node, ast.UnaryOp):
+            operand = self._evaluate(node.operand, arrays)
+            if isinstance(node.op, ast.Not):
+                return np.logical_not(operand)
+            return np.negative(operand) if isinstance(node.op, ast.USub) else operand
+        if isinstance(node, ast.Compare):
+            result, left = True, self._evaluate(node.left, arrays)
+            for op, comparator in zip(node.ops, node.comparators):
+                right = self._evaluate(comparator, arrays)
+                result = result & _COMPARISONS[type(op)][1](left, right)
+                left = right
+            return result
+        if isinstance(node, ast.BinOp):
+            return _ARITHMETIC[type(node.op)][1](self._evaluate(node.left, arrays), self._evaluate(node.right, arrays))
+        if isinstance(node, ast.Call):
+            name, args = node.func.id, node.args
+            if name == "between":
+                x = self._evaluate(args[0], arrays)
+                return (x >= self._evaluate(args[1], arrays)) & (x <= self._evaluate(args[2], arrays))
+            if name == "isin":
+                return np.isin(self._evaluate(args[0], arrays), [self._evaluate(value, arrays) for value in args[1].elts])
+            return _FUNCTIONS[name](self._evaluate(args[0], arrays))
+        if isinstance(node, ast.Name):
+            return arrays[node.id]
+        return node.value
+
+    def mask(self, data, engine=None):
+        """
+        Evaluate the selection and return a single boolean mask.
+
+        Args:
+            data (DataFrame or dict): The columns, as a DataFrame or a dictionary of arrays (e.g. a chunk of iter_rootfile_chunks).
+            engine (str, optional): "numexpr" or "numpy". Defaults to None (numexpr when it is installed).
+
+        Returns:
+            array: A boolean NumPy array with one entry per row.
+        """
+        arrays = {identifier: np.asarray(data[column]) for identifier, column in self._identifiers.items()}
+        size = len(data) if not isinstance(data, dict) else len(next(iter(data.values()), []))
+
+        if engine is None:
+            engine = "numexpr" if numexpr is not None else "numpy"
+
+        result = None
+        if engine == "numexpr" and not self._strings and all(values.dtype.kind in "biuf" for values in arrays.values()):
+            try:
+                result = numexpr.evaluate(self._source, local_dict=arrays)
+            except (KeyError, TypeError, ValueError, NotImplementedError):
+                result = None
+        if result is None:
+            result = self._evaluate(self._tree, arrays)
+
+        return np.broadcast_to(np.asarray(result, dtype=bool), (size,))
+
+    def apply(self, df):
+        """
+        Filter a DataFrame with the selection, in a single step.
+        """
+        return df[self.mask(df)]
+
+def compile_cuts(cuts):
+    """
+    Compile cuts into a CompiledCut.
+
+    Args:
+        cuts (list of dict, str or CompiledCut): A list of dictionaries with 'cut_key', 'cut_value' and 'cut_type'
+        (greater, less, equal, greater_equal, less_equal, not_equal, between with a [low, high] value, isin with a list of values),
+        joined with AND, or a boolean expression string.
+
+    Raises:
+        ValueError: If a cut type is invalid or the expression uses unsupported syntax.
+
+    Returns:
+        CompiledCut: The compiled selection, or None if there are no cuts.
+    """
+    if cuts is None or isinstance(cuts, CompiledCut):
+        return cuts
+    if isinstance(cuts, str):
+        return CompiledCut(cuts) if cuts.strip() else None
+    if not cuts:
+        return None
+    return CompiledCut(" & ".join(_dict_to_expression(cut) for cut in cuts))
+
+def cut_mask(data, cuts):
+    """
+    Evaluate cuts on a DataFrame or a dictionary of arrays and return one boolean mask.
+    """
+    compiled = compile_cuts(cuts)
+    if compiled is None:
+        return np.ones(len(data) if not isinstance(data, dict) else len(next(iter(data.values()), [])), dtype=bool)
+    return compiled.mask(data)
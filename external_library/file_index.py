@@ -0,0 +1,224 @@
+import argparse
+import fnmatch
+import os
+import re
+import sqlite3
+import time
+from contextlib import closing, contextmanager
+import pandas as pd
+import uproot
+
+try:
+    from .cache import DEFAULT_CACHE_DIR
+except ImportError:
+    from cache import DEFAULT_CACHE_DIR
+
+DEFAULT_INDEX_PATH = os.environ.get("TAU_FILE_INDEX", os.path.join(DEFAULT_CACHE_DIR, "file_index.sqlite"))
+
+# The run id is the first group of 5 or 6 digits of the file name (ANTARES runs are numbered ~ 20000 to 100000)
+RUN_ID_PATTERN = re.compile(r"(?<!\d)(\d{5,6})(?!\d)")
+
+# Flavour identifiers used to name the reconstruction files, checked in this order
+FLAVOUR_IDENTIFIERS = ["tau", "numu", "nue", "showers", "mupage"]
+
+def parse_run_id(filename):
+    """
+    Return the run id found in a file name, or None.
+    """
+    match = RUN_ID_PATTERN.search(filename)
+    return int(match.group(1)) if match else None
+
+def parse_identifier(filename):
+    """
+    Return the first flavour identifier of FLAVOUR_IDENTIFIERS found in a file name, or None.
+    """
+    for identifier in FLAVOUR_IDENTIFIERS:
+        if identifier in filename:
+            return identifier
+    return None
+
+def count_file_entries(path):
+    """
+    Return the number of entries of an HDF5 (pandas) or ROOT ("sel" tree) file, or None if it cannot be read.
+    """
+    try:
+        if path.endswith((".hdf5", ".h5")):
+            with pd.HDFStore(path, mode="r") as store:
+                storer = store.get_storer(store.keys()[0])
+                return int(storer.nrows) if storer.is_table else int(storer.shape[0])
+        if path.endswith(".root"):
+            with uproot.open(path) as f:
+                return int(f["sel"].num_entries)
+    except Exception:
+        # Truncated or corrupted files raise the errors of PyTables (HDF5ExtError) or of uproot
+        return None
+    return None
+
+class FileIndex:
+    """
+    SQLite index of the reconstruction files, so the loaders can select files by run id or flavour
+    without listing the directories on the shared filesystem.
+
+    For each file the index records its path, run id, flavour identifier, size, mtime and number of entries.
+    The index is updated by refresh, which only re-inspects the files whose size or mtime changed.
+
+    Args:
+        db_path (str, optional): Path of the SQLite database. Defaults to $TAU_FILE_INDEX or file_index.sqlite in the cache directory.
+    """
+    def __init__(self, db_path=None):
+        self.db_path = db_path if db_path is not None else DEFAULT_INDEX_PATH
+        os.makedirs(os.path.dirname(os.path.abspath(self.db_path)), exist_ok=True)
+
+        with self._connect() as connection:
+            connection.execute(
+                """CREATE TABLE IF NOT EXISTS files (
+                    path TEXT PRIMARY KEY,
+                    directory TEXT NOT NULL,
+                    name TEXT NOT NULL,
+                    run_id INTEGER,
+                    identifier TEXT,
+                    size INTEGER NOT NULL,
+                    mtime_ns INTEGER NOT NULL,
+                    n_entries INTEGER
+                )"""
+            )
+            connection.execute("CREATE INDEX IF NOT EXISTS files_directory_run ON files (directory, run_id)")
+            connection.execute("CREATE TABLE IF NOT EXISTS directories (directory TEXT PRIMARY KEY, refreshed_ns INTEGER NOT NULL)")
+            # Indexes written before the refreshed directories were recorded
+            connection.execute("INSERT OR IGNORE INTO directories SELECT DISTINCT directory, 0 FROM files")
+
+    @contextmanager
+    def _connect(self):
+        """
+        Open a connection to the database, commit (or roll back) the transaction of the block and close it.
+        """
+        with closing(sqlite3.connect(self.db_path)) as connection:
+            with connection:
+                yield connection
+
+    def _check_indexed(self, connection, directory):
+        """
+        Raise an error if the directory (or any directory when None) was never refreshed, instead of returning no files.
+        """
+        if directory is None:
+            indexed = connection.execute("SELECT 1 FROM directories LIMIT 1").fetchone()
+        else:
+            indexed = connection.execute("SELECT 1 FROM directories WHERE directory = ?", (directory,)).fetchone()
+        if indexed is None:
+            target = "any directory" if directory is None else directory
+            raise RuntimeError(f"The file index {self.db_path} was never refreshed for {target}. Refresh it with "
+                               f"FileIndex.refresh (--refresh_index in the scripts, or python file_index.py <directory>).")
+
+    def refresh(self, directory, pattern="*.hdf5", count_entries=True):
+        """
+        Bring the index of a directory up to date. New and modified files are (re)inspected,
+        files that disappeared are removed.
+
+        Args:
+            directory (str): The directory to index.
+            pattern (str, optional): Glob pattern of the files to index. Defaults to "*.hdf5".
+            count_entries (bool, optional): Open new and modified files to count their entries. Defaults to True.
+
+        Returns:
+            tuple: The number of added, updated and removed files.
+        """
+        directory = os.path.abspath(directory)
+
+        with self._connect() as connection:
+            known = {path: (size, mtime_ns) for path, size, mtime_ns in connection.execute(
+                "SELECT path, size, mtime_ns FROM files WHERE directory = ?", (directory,))}
+
+            added, updated, seen = 0, 0, set()
+            for entry in os.scandir(directory):
+                if not entry.is_file() or not fnmatch.fnmatch(entry.name, pattern):
+                    continue
+
+                seen.add(entry.path)
+                stat = entry.stat()
+                if known.get(entry.path) == (stat.st_size, stat.st_mtime_ns):
+                    continue
+
+                n_entries = count_file_entries(entry.path) if count_entries else None
+                connection.execute(
+                    "INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    (entry.path, directory, entry.name, parse_run_id(entry.name), parse_identifier(entry.name),
+                     stat.st_size, stat.st_mtime_ns, n_entries),
+                )
+                if entry.path in known:
+                    updated += 1
+                else:
+                    added += 1
+
+            removed = [(path,) for path in known if path not in seen]
+            connection.executemany("DELETE FROM files WHERE path = ?", removed)
+            connection.execute("INSERT OR REPLACE INTO directories VALUES (?, ?)", (directory, time.time_ns()))
+
+        print(f"File index of {directory}: {added} added, {updated} updated, {len(removed)} removed")
+        return added, updated, len(removed)
+
+    def query(self, directory=None, run_id=None, identifier=None, pattern=None):
+        """
+        Select indexed files without touching the filesystem.
+
+        Args:
+            directory (str, optional): Only files of this directory. Defaults to None.
+            run_id (int, optional): Only files of this run id. Defaults to None.
+            identifier (str, optional): Only files whose name contains this string (like glob "*identifier*"). Defaults to None.
+            pattern (str, optional): Only files whose name matches this glob pattern. Defaults to None.
+
+        Raises:
+            RuntimeError: If the directory (or, without directory, any directory) was never refreshed.
+
+        Returns:
+            list: The paths of the matching files, sorted by name.
+        """
+        directory = None if directory is None else os.path.abspath(directory)
+        conditions, parameters = [], []
+        if directory is not None:
+            conditions.append("directory = ?")
+            parameters.append(directory)
+        if run_id is not None:
+            conditions.append("run_id = ?")
+            parameters.append(int(run_id))
+        if identifier is not None:
+            conditions.append("instr(name, ?) > 0")
+            parameters.append(identifier)
+        if pattern is not None:
+            conditions.append("name GLOB ?")
+            parameters.append(pattern)
+
+        sql = "SELECT path FROM files"
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+        sql += " ORDER BY name"
+
+        with self._connect() as connection:
+            self._check_indexed(connection, directory)
+            return [path for (path,) in connection.execute(sql, parameters)]
+
+    def to_dataframe(self, directory=None):
+        """
+        Return the index (of one directory, or all of it) as a DataFrame.
+        """
+        sql, parameters = "SELECT * FROM files", []
+        if directory is not None:
+            sql += " WHERE directory = ?"
+            parameters.append(os.path.abspath(directory))
+
+        with self._connect() as connection:
+            return pd.read_sql_query(sql + " ORDER BY name", connection, params=parameters)
+
+def main():
+    parser = argparse.ArgumentParser(description="Refresh the SQLite index of reconstruction directories.")
+    parser.add_argument("directories", nargs="+", help="The directories to index.")
+    parser.add_argument("--db", type=str, default=None, help="Path of the SQLite database.")
+    parser.add_argument("--pattern", type=str, default="*.hdf5", help="Glob pattern of the files to index.")
+    parser.add_argument("--no_entries", action="store_true", help="Do not open the files to count their entries.")
+    args = parser.parse_args()
+
+    index = FileIndex(args.db)
+    for directory in args.directories:
+        index.refresh(directory, args.pattern, count_entries=not args.no_entries)
+
+if __name__ == "__main__":
+    main()
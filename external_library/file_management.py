@@ -1,13 +1,102 @@
 import h5py
 import uproot
+import numpy as np
 import pandas as pd
 from tqdm import tqdm
-from datetime import timedelta
 import os
-import time
 import glob
+import json
+from concurrent.futures import ProcessPoolExecutor
 
-def load_rootfile_to_df(rootfile, columns=None, tree="sel"):
+try:
+    from .cuts import compile_cuts
+    from .instrumentation import stage
+except ImportError:
+    from cuts import compile_cuts
+    from instrumentation import stage
+
+# Columns indexed by save_to_hdf5 in table format, used for the where-queries of the HDF5 loaders
+HDF5_DATA_COLUMNS = ["RunID", "Type", "energy_true"]
+
+def _cut_columns(cuts):
+    """
+    Return the columns needed to evaluate the cuts.
+    """
+    compiled = compile_cuts(cuts)
+    return [] if compiled is None else compiled.columns
+
+def _apply_cuts(df, cuts):
+    """
+    Apply cuts (see cuts.compile_cuts) to a DataFrame, filtering it once with a single mask.
+
+    Returns:
+        DataFrame: The filtered DataFrame.
+    """
+    compiled = compile_cuts(cuts)
+    if compiled is None:
+        return df
+    return compiled.apply(df)
+
+def compact_dtypes(df, float32=False, verbose=True):
+    """
+    Compact the dtypes of an event table in place of the pandas defaults.
+
+    - Integer columns are downcast to the smallest integer type holding their values (e.g. Type to int8, RunID to int32).
+    - Flag columns (ending in "_flag", and "is_cc") holding only 0/1 become bool.
+    - String columns, like the "Flavour type" and "Event type" labels of masks.apply_all_masks, become category.
+    - Float columns become float32 only if requested, since it changes the precision of the energies.
+
+    Grouping on the category columns must use observed=True to give the same groups as the string columns.
+
+    Args:
+        df (DataFrame): The DataFrame to compact.
+        float32 (bool or list, optional): True to cast every float64 column to float32, or a list of the columns to cast. Defaults to False.
+        verbose (bool, optional): Print the memory saved. Defaults to True.
+
+    Returns:
+        DataFrame: The compacted DataFrame.
+    """
+    bytes_before = df.memory_usage(deep=True).sum()
+    df = df.copy(deep=False)
+
+    if float32 is True:
+        float32 = [column for column in df.columns if df[column].dtype == np.float64]
+    elif not float32:
+        float32 = []
+
+    for column in df.columns:
+        values = df[column]
+
+        if (str(column).endswith("_flag") or column == "is_cc") and values.dtype != bool:
+            if pd.api.types.is_numeric_dtype(values) and values.notna().all() and values.isin([0, 1]).all():
+                df[column] = values.astype(bool)
+                continue
+
+        if pd.api.types.is_integer_dtype(values) and not pd.api.types.is_bool_dtype(values):
+            df[column] = pd.to_numeric(values, downcast="integer")
+        elif column in float32:
+            df[column] = values.astype(np.float32)
+        elif (not isinstance(values.dtype, pd.CategoricalDtype) and pd.api.types.infer_dtype(values, skipna=True) == "string"
+              and values.nunique() < 0.5 * len(values)):
+            df[column] = values.astype("category")
+
+    bytes_after = df.memory_usage(deep=True).sum()
+    if verbose:
+        print(f"Compacted dtypes: {bytes_before / 1024**2:.2f} MB -> {bytes_after / 1024**2:.2f} MB "
+              f"({(bytes_before - bytes_after) / 1024**2:.2f} MB saved)")
+    return df
+
+def _compact(df, compact):
+    """
+    Apply compact_dtypes if requested by a loader. compact is either a bool or a dictionary of compact_dtypes options.
+    """
+    if not compact:
+        return df
+    if compact is True:
+        return compact_dtypes(df)
+    return compact_dtypes(df, **compact)
+
+def load_rootfile_to_df(rootfile, columns=None, tree="sel", cache=None, compact=False):
     """
     Load a ROOT file to a pandas DataFrame.
 
@@ -15,20 +104,125 @@ def load_rootfile_to_df(rootfile, columns=None, tree="sel"):
         rootfile (str): The path to the ROOT file.
         columns (list, optional): The columns to be loaded. Defaults to None.
         tree (str, optional): The name of the tree in the ROOT file. Defaults to "sel".
+        cache (ColumnCache, optional): On-disk cache serving repeated reads of the same file and columns. Defaults to None.
+        compact (bool or dict, optional): Compact the dtypes of the result with compact_dtypes, a dictionary is passed as its options. Defaults to False.
 
     Returns:
         DataFrame: A DataFrame containing the data from the ROOT file.
     """
     print(f"Loading the ROOT file: {rootfile}")
-    ctime = time.time()
     
-    with uproot.open(rootfile) as f:
-        df = f[tree].arrays(columns, library="pd")
+    def read():
+        with uproot.open(rootfile) as f:
+            return f[tree].arrays(columns, library="pd")
+    
+    with stage("load_rootfile_to_df", file=os.path.basename(rootfile)) as current:
+        df = read() if cache is None else cache.load(rootfile, read, tree=tree, columns=columns)
+        df = _compact(df, compact)
+        current.rows_out = len(df)
 
-    print(f"ROOT file imported as a Dataframe in: {timedelta(seconds=time.time()-ctime)}")
     return df
 
-def load_large_rootfile_to_df(rootfile, columns=None, tree="sel", chunksize=100_000):
+def count_rootfile_entries(rootfiles, tree="sel"):
+    """
+    Count the number of entries of a tree over one or many ROOT files, without reading any branch.
+
+    Args:
+        rootfiles (str or list): The path to a ROOT file or a list of paths.
+        tree (str, optional): The name of the tree in the ROOT files. Defaults to "sel".
+
+    Returns:
+        int: The total number of entries.
+    """
+    if isinstance(rootfiles, str):
+        rootfiles = [rootfiles]
+
+    num_entries = 0
+    for rootfile in rootfiles:
+        with uproot.open(rootfile) as f:
+            num_entries += f[tree].num_entries
+    return num_entries
+
+def iter_rootfile_chunks(rootfiles, columns=None, tree="sel", chunksize=100_000, cuts=None):
+    """
+    Iterate over one or many ROOT files in chunks of columns.
+
+    Args:
+        rootfiles (str or list): The path to a ROOT file or a list of paths, read one after the other.
+        columns (list, optional): A list of columns to load. If None, all the branches of the first file are loaded.
+        tree (str, optional): The name of the tree in the ROOT files. Defaults to "sel".
+        chunksize (int, optional): The number of entries read in each chunk. Defaults to 100_000.
+        cuts (list of dict or str, optional): Cuts applied to every chunk, in the format of load_large_rootfile_to_df. Defaults to None.
+
+    Yields:
+        dict: A dictionary mapping each column name to a NumPy array with the (selected) entries of the chunk.
+    """
+    if isinstance(rootfiles, str):
+        rootfiles = [rootfiles]
+
+    # The cuts are compiled once and evaluated on the raw arrays of every chunk
+    compiled = compile_cuts(cuts)
+
+    for rootfile in rootfiles:
+        with uproot.open(rootfile) as f:
+            ttree = f[tree]
+
+            # Specify the columns to load
+            if columns is None:
+                columns = ttree.keys()
+
+            # Columns only needed to evaluate the cuts are read but not kept
+            cut_columns = [column for column in _cut_columns(compiled) if column not in columns]
+            read_columns = list(columns) + cut_columns
+
+            for i in range(0, ttree.num_entries, chunksize):
+                chunk = ttree.arrays(read_columns, library="np", entry_start=i, entry_stop=i+chunksize)
+
+                if compiled is not None:
+                    mask = compiled.mask(chunk)
+                    chunk = {column: chunk[column][mask] for column in columns}
+
+                yield chunk
+
+def concat_chunks_preallocated(chunks, num_entries):
+    """
+    Concatenate column chunks into a DataFrame, filling preallocated NumPy arrays in place.
+
+    The arrays are allocated with num_entries rows when the first chunk arrives, so the chunks are never held
+    in memory together with the final arrays. When cuts removed rows the arrays are shrunk in place at the end.
+
+    Args:
+        chunks (iterable): Column chunks as yielded by iter_rootfile_chunks.
+        num_entries (int): An upper bound of the total number of rows, e.g. from count_rootfile_entries.
+
+    Returns:
+        DataFrame: A DataFrame containing all the chunks.
+    """
+    arrays = None
+    filled = 0
+
+    for chunk in chunks:
+        if arrays is None:
+            arrays = {column: np.empty(num_entries, dtype=values.dtype) for column, values in chunk.items()}
+
+        size = len(next(iter(chunk.values()), []))
+        if filled + size > num_entries:
+            raise ValueError(f"The chunks hold more than the {num_entries} preallocated entries")
+
+        for column, values in chunk.items():
+            arrays[column][filled:filled+size] = values
+        filled += size
+
+    if arrays is None:
+        return pd.DataFrame()
+
+    if filled < num_entries:
+        for values in arrays.values():
+            values.resize(filled, refcheck=False)
+
+    return pd.DataFrame(arrays, copy=False)
+
+def load_large_rootfile_to_df(rootfile, columns=None, tree="sel", chunksize=100_000, cuts=None, cache=None, compact=False):
     """
     Load a large ROOT file into a pandas DataFrame while optimizing memory usage.
 
@@ -37,34 +231,32 @@ def load_large_rootfile_to_df(rootfile, columns=None, tree="sel", chunksize=100_
     tree_name (str): The name of the TTree to load.
     columns (list, optional): A list of columns to load. If None, all columns will be loaded.
     chunksize (int, optional): The number of rows to load in each chunk.
+    cuts (list of dict or str, optional): Cuts applied to every chunk while reading, either in the format of
+    load_dataframes or as a selection string (e.g. "(energy_true < 100) && (cos_zenith_true < 0)"), see cuts.compile_cuts.
+    Rows failing the cuts are never kept. Defaults to None.
+    cache (ColumnCache, optional): On-disk cache serving repeated reads of the same file, columns and cuts. Defaults to None.
+    compact (bool or dict, optional): Compact the dtypes of the result with compact_dtypes, a dictionary is passed as its options. Defaults to False.
 
     Returns:
     A pandas DataFrame containing the data from the TTree.
     """
-    df_list = []
-    
     print(f"Loading the ROOT file: {rootfile}")
-    ctime = time.time()
     
-    # Open the ROOT file and get the TTree object
-    with uproot.open(rootfile) as f:
-
-        # Specify the columns to load
-        if columns is None:
-            columns = f[tree].keys()
-
-        # Load the data in chunks
-        for i in tqdm(range(0, f[tree].num_entries, chunksize)):
-            df = f["sel"].arrays(columns, library="pd", entry_start=i, entry_stop=i+chunksize)
+    with stage("load_large_rootfile_to_df", file=os.path.basename(rootfile)) as current:
+        def read():
+            num_entries = current.rows_in = count_rootfile_entries(rootfile, tree)
+            chunks = iter_rootfile_chunks(rootfile, columns, tree, chunksize, cuts)
             
-            # Append the chunk to the list
-            df_list.append(df)
+            # Fill the preallocated columns chunk by chunk
+            return concat_chunks_preallocated(tqdm(chunks, total=-(-num_entries // chunksize)), num_entries)
+        
+        df = read() if cache is None else cache.load(rootfile, read, tree=tree, columns=columns, cuts=cuts)
+        df = _compact(df, compact)
+        current.rows_out = len(df)
     
-    print(f"ROOT file imported as a Dataframe in: {timedelta(seconds=time.time()-ctime)}")
-    # Concatenate the chunks into a single DataFrame
-    return pd.concat(df_list, ignore_index=True)
+    return df
         
-def concat_rootfiles_to_df(rootfiles, columns, tree="sel"):
+def concat_rootfiles_to_df(rootfiles, columns, tree="sel", chunksize=100_000, cuts=None, cache=None, compact=False):
     """
     Concatenate multiple ROOT files to a single pandas DataFrame.
 
@@ -72,25 +264,35 @@ def concat_rootfiles_to_df(rootfiles, columns, tree="sel"):
         rootfiles (list): A list of ROOT files to be concatenated.
         columns (list): The columns to be loaded.
         tree (str, optional): The name of the tree in the ROOT file. Defaults to "sel".
+        chunksize (int, optional): The number of rows read in each chunk. Defaults to 100_000.
+        cuts (list of dict or str, optional): Cuts applied while reading, as in load_large_rootfile_to_df. Defaults to None.
+        cache (ColumnCache, optional): On-disk cache serving repeated reads of the same files, columns and cuts. Defaults to None.
+        compact (bool or dict, optional): Compact the dtypes of the result with compact_dtypes, a dictionary is passed as its options. Defaults to False.
 
     Returns:
-        DataFrame: _description_
+        DataFrame: A DataFrame containing the data of all the ROOT files, in the order they are given.
     """
-    df_list = []
-    for rootfile in rootfiles:
-        df = load_rootfile_to_df(rootfile, columns, tree)
-        df_list.append(df)
+    with stage("concat_rootfiles_to_df", files=len(rootfiles)) as current:
+        def read():
+            num_entries = current.rows_in = count_rootfile_entries(rootfiles, tree)
+            chunks = iter_rootfile_chunks(rootfiles, columns, tree, chunksize, cuts)
+            return concat_chunks_preallocated(chunks, num_entries)
 
-    return pd.concat(df_list, ignore_index=True)
+        df = read() if cache is None else cache.load(rootfiles, read, tree=tree, columns=columns, cuts=cuts)
+        df = _compact(df, compact)
+        current.rows_out = len(df)
+
+    return df
 
 
-def load_hd5f_to_pandas(file_path, key):
+def load_hd5f_to_pandas(file_path, key, compact=False):
     """
     Load a HDF5 file to a pandas DataFrame.
 
     Args:
         file_path (str): The path to the HDF5 file.
         key (str): The key to the data in the HDF5 file.
+        compact (bool or dict, optional): Compact the dtypes of the result with compact_dtypes, a dictionary is passed as its options. Defaults to False.
 
     Returns:
         DataFrame: A DataFrame containing the data from the HDF5 file.
@@ -99,7 +301,7 @@ def load_hd5f_to_pandas(file_path, key):
         # Load the data into a pandas DataFrame
         data = f[key][:]
         df = pd.DataFrame(data=data)
-    return df
+    return _compact(df, compact)
 
 def print_files(filename, index, num_files):
     """
@@ -108,14 +310,95 @@ def print_files(filename, index, num_files):
     percentage_processed = (index / num_files) * 100
     print(f"Processing file: {filename.ljust(40)} |   Files processed: {percentage_processed:.2f}%")
 
-def load_dataframes(filelist, cuts=None, folder_path = '/sps/km3net/users/jgarcia/NNfit/reconstructions/Taus/'):
+def _read_hdf(file_path, columns=None, where=None, cuts=None):
+    """
+    Read a pandas HDF5 file with column projection, a where-query and cuts.
+
+    Files written in table format (see save_to_hdf5) are queried by PyTables: only the requested columns are read,
+    and the where-query uses the indexed data columns so only the matching rows are read. Files in fixed format
+    cannot be queried, so they are read in full and the where-query is evaluated with DataFrame.query.
+
+    Args:
+        file_path (str): The path to the HDF5 file. It must hold a single DataFrame.
+        columns (list, optional): The columns to return. If None, all columns are returned. Defaults to None.
+        where (str, optional): A PyTables where-query, e.g. "(RunID > 35000) & (Type == 16)". Defaults to None.
+        cuts (list of dict or str, optional): Cuts applied after reading. Defaults to None.
+
+    Returns:
+        DataFrame: The selected rows and columns.
+    """
+    with pd.HDFStore(file_path, mode="r") as store:
+        keys = store.keys()
+        if len(keys) != 1:
+            raise ValueError(f"The HDF5 file {file_path} holds {len(keys)} DataFrames, only one is supported")
+        storer = store.get_storer(keys[0])
+
+        if storer.is_table:
+            read_columns = columns
+            if columns is not None:
+                # Columns only needed to evaluate the cuts are read but not kept
+                read_columns = list(columns) + [column for column in _cut_columns(cuts) if column not in columns]
+            df = store.select(keys[0], where=where, columns=read_columns)
+        else:
+            df = store.select(keys[0])
+            if where is not None:
+                df = df.query(where)
+
+    df = _apply_cuts(df, cuts)
+    if columns is not None:
+        df = df[list(columns)]
+    return df
+
+def _load_hdf5_with_cuts(file_path, cuts, cache=None, columns=None, where=None):
+    """
+    Load a single HDF5 file and apply the cuts. Defined at module level so it can be sent to the worker processes.
+    """
+    def read():
+        return _read_hdf(file_path, columns, where, cuts)
+
+    return read() if cache is None else cache.load(file_path, read, columns=columns, cuts=cuts, where=where)
+
+def _load_hdf5_files(file_paths, cuts, n_workers=1, cache=None, columns=None, where=None):
+    """
+    Load a list of HDF5 files, apply the cuts and return the cut DataFrames in file order.
+
+    Args:
+        file_paths (list): A list with the full paths of the HDF5 files.
+        cuts (list of dict): A list of dictionaries, where each dictionary contains 'cut_key', 'cut_value', and 'cut_type'.
+        n_workers (int, optional): Number of worker processes. With 1 the files are read sequentially in this process. Defaults to 1.
+        cache (ColumnCache, optional): On-disk cache for the cut frame of every file. Defaults to None.
+        columns (list, optional): The columns to load. If None, all columns are loaded. Defaults to None.
+        where (str, optional): A PyTables where-query selecting the rows to read. Defaults to None.
+
+    Returns:
+        list: A list containing the cut DataFrames, in the same order as file_paths.
+    """
+    if n_workers is None or n_workers <= 1:
+        return [_load_hdf5_with_cuts(file_path, cuts, cache, columns, where) for file_path in tqdm(file_paths)]
+
+    # executor.map keeps the input order and hands back every frame as soon as it and its predecessors are done
+    with ProcessPoolExecutor(max_workers=n_workers) as executor:
+        n_files = len(file_paths)
+        results = executor.map(_load_hdf5_with_cuts, file_paths, [cuts] * n_files, [cache] * n_files,
+                               [columns] * n_files, [where] * n_files)
+        return list(tqdm(results, total=len(file_paths)))
+
+def load_dataframes(filelist, cuts=None, folder_path = '/sps/km3net/users/jgarcia/NNfit/reconstructions/Taus/', n_workers=1, cache=None, compact=False, columns=None, where=None):
     """
     Load DataFrames from files in a folder and apply cuts based on the specified keys and criteria. Inspired by the script provided by Juan Garcia Mendez from the KM3NeT collaboration.
 
     Parameters:
         list (list): A list containing the HDF5 files (for example '2015').
-        cuts (list of dict): A list of dictionaries, where each dictionary contains 'cut_key', 'cut_value', and 'cut_type'.
+        cuts (list of dict or str): A list of dictionaries, where each dictionary contains 'cut_key', 'cut_value', and 'cut_type',
+        or a selection string. The cuts are compiled into a single mask, see cuts.compile_cuts.
         folder_path (str): Path to the reconstructions folder. Change it when copy the reconstrcutions to your own storage. It must end with '/'.
+        n_workers (int, optional): Number of worker processes used to read and cut the files in parallel. 
+        The results are kept in file order. Defaults to 1 (sequential).
+        cache (ColumnCache, optional): On-disk cache serving repeated reads of the same files and cuts. Defaults to None.
+        compact (bool or dict, optional): Compact the dtypes of the result with compact_dtypes, a dictionary is passed as its options. Defaults to False.
+        columns (list, optional): The columns to load. Only these columns are read from files in table format. Defaults to None (all columns).
+        where (str, optional): A PyTables where-query, e.g. "(RunID > 35000) & (energy_true < 100)". On files in table format
+        only the matching rows are read, using the indexed data columns. Defaults to None.
 
     Returns:
         pd.DataFrame: A DataFrame containing the combined data with applied cuts as per the specifications.
@@ -123,43 +406,18 @@ def load_dataframes(filelist, cuts=None, folder_path = '/sps/km3net/users/jgarci
     if cuts is None:
         cuts = []
 
-    # Initialize an empty DataFrame
-    dfs = []
-
-    # Measure time
-    ctime = time.time()
+    # Ensure only data files are processed
+    file_paths = [os.path.join(folder_path, file) for file in filelist if file.endswith(".hdf5")]
     
-    for file in tqdm(filelist):
-        if file.endswith(".hdf5"):  # Ensure only data files are processed
-            file_path = os.path.join(folder_path, file)
-            
-            # Load the DataFrame from the file
-            df = pd.read_hdf(file_path, index = False)
-            
-            # Apply cuts as per the specifications
-            for cut in cuts:
-                cut_key   = cut['cut_key']
-                cut_value = cut['cut_value']
-                cut_type  = cut['cut_type']
-                
-                if cut_type == "greater":
-                    df = df[df[cut_key] > cut_value]
-                elif cut_type == "less":
-                    df = df[df[cut_key] < cut_value]
-                elif cut_type == "equal":
-                    df = df[df[cut_key] == cut_value]
-                else:
-                    raise ValueError("Invalid cut type")
-            
-            # Concatenate the DataFrame to the final DataFrame
-            dfs.append(df)
+    with stage("load_dataframes", files=len(file_paths), n_workers=n_workers) as current:
+        dfs = _load_hdf5_files(file_paths, cuts, n_workers, cache, columns, where)
 
-    df_final = pd.concat(dfs, ignore_index=True)
+        df_final = _compact(pd.concat(dfs, ignore_index=True), compact)
+        current.rows_out = len(df_final)
 
-    print('Loading time:', timedelta(seconds=time.time()-ctime), '\n')
     return df_final
 
-def load_runfile(mc_file, folder_path = '/sps/km3net/users/jgarcia/NNfit/reconstructions/Taus/'):
+def load_runfile(mc_file, folder_path = '/sps/km3net/users/jgarcia/NNfit/reconstructions/Taus/', cache=None, compact=False, columns=None, where=None):
     """
     Load a single mc file from the reconstructions folder. 
     Function inspired by the script provided by Juan Garcia Mendez from the KM3NeT collaboration.
@@ -168,6 +426,11 @@ def load_runfile(mc_file, folder_path = '/sps/km3net/users/jgarcia/NNfit/reconst
         mc_file (str): The name of the file to be loaded.
         folder_path (str, optional): Path to the reconstructions folder. Change it when copy the reconstrcutions to your own storage. It must end with '/'.
         Defaults to '/sps/km3net/users/jgarcia/NNfit/reconstructions/Taus/'.
+        cache (ColumnCache, optional): On-disk cache serving repeated reads of the same file. Defaults to None.
+        compact (bool or dict, optional): Compact the dtypes of the result with compact_dtypes, a dictionary is passed as its options. Defaults to False.
+        columns (list, optional): The columns to load. Only these columns are read from files in table format. Defaults to None (all columns).
+        where (str, optional): A PyTables where-query, e.g. "(RunID > 35000) & (energy_true < 100)". On files in table format
+        only the matching rows are read, using the indexed data columns. Defaults to None.
 
     Returns:
         DataFrame: A DataFrame containing the data from the mc file.
@@ -175,11 +438,10 @@ def load_runfile(mc_file, folder_path = '/sps/km3net/users/jgarcia/NNfit/reconst
     file_path =  os.path.join(folder_path, mc_file)
 
     if file_path.endswith(".hdf5"):
-        df = pd.read_hdf(file_path)
-        #df = df[columns]
-    return df
+        df = _load_hdf5_with_cuts(file_path, [], cache, columns, where)
+    return _compact(df, compact)
 
-def load_singlerun(reco_folder, run_id, cuts=None, folder_path = '/sps/km3net/users/jgarcia/NNfit/reconstructions/'):
+def load_singlerun(reco_folder, run_id, cuts=None, folder_path = '/sps/km3net/users/jgarcia/NNfit/reconstructions/', n_workers=1, cache=None, compact=False, columns=None, where=None, index=None):
     """
     Load a single run from the reconstructions folder and apply cuts based on the specified keys and criteria.
     Function inspired by the script provided by Juan Garcia Mendez from the KM3NeT collaboration.
@@ -187,12 +449,22 @@ def load_singlerun(reco_folder, run_id, cuts=None, folder_path = '/sps/km3net/us
     Args:
         reco_folder (str): Subfolder containing the reconstructions.
         run_id (str): The run id of the files to be loaded.
-        cuts (dict, optional): A dictionary containing 'cut_key', 'cut_value', and 'cut_type' keys. Defaults to None.
+        cuts (list of dict or str, optional): Dictionaries containing 'cut_key', 'cut_value', and 'cut_type' keys, or a selection string
+        (see cuts.compile_cuts). Defaults to None.
         folder_path (str, optional): Path to the reconstructions folder. Change it when copy the reconstrcutions to your own storage. It must end with '/'. 
         Defaults to '/sps/km3net/users/jgarcia/NNfit/reconstructions/'.
+        n_workers (int, optional): Number of worker processes used to read and cut the files in parallel. 
+        The results are kept in file order. Defaults to 1 (sequential).
+        cache (ColumnCache, optional): On-disk cache serving repeated reads of the same files and cuts. Defaults to None.
+        compact (bool or dict, optional): Compact the dtypes of the result with compact_dtypes, a dictionary is passed as its options. Defaults to False.
+        columns (list, optional): The columns to load. Only these columns are read from files in table format. Defaults to None (all columns).
+        where (str, optional): A PyTables where-query, e.g. "(RunID > 35000) & (energy_true < 100)". On files in table format
+        only the matching rows are read, using the indexed data columns. Defaults to None.
+        index (FileIndex, optional): File index of the reconstruction folder. When given, the files are selected from the index
+        instead of listing the folder. Defaults to None.
 
     Raises:
-        ValueError: If the cut type is invalid. The valid cut types are 'greater', 'less', and 'equal'.
+        ValueError: If the cut type is invalid. The valid cut types are those of cuts.CUT_TYPES, 'between' and 'isin'.
 
     Returns:
         DataFrame: A DataFrame containing the combined data with applied cuts as per the specifications.
@@ -201,43 +473,20 @@ def load_singlerun(reco_folder, run_id, cuts=None, folder_path = '/sps/km3net/us
         cuts = []
 
     # Get the list of files in the folder that have the common characteristic
-    files = [file for file in os.listdir(folder_path+reco_folder) if run_id in file]
+    if index is not None:
+        files = [os.path.basename(file) for file in index.query(directory=folder_path+reco_folder, identifier=run_id)]
+    else:
+        files = [file for file in os.listdir(folder_path+reco_folder) if run_id in file]
 
+    # Ensure only data files are processed
+    file_paths = [os.path.join(folder_path+reco_folder, file) for file in files if file.endswith(".hdf5")]
     
-    # Initialize an empty DataFrame
-    dfs = []
+    with stage("load_singlerun", run_id=run_id, files=len(file_paths), n_workers=n_workers) as current:
+        dfs = _load_hdf5_files(file_paths, cuts, n_workers, cache, columns, where)
 
-    # Measure time
-    ctime = time.time()
-    
-    for file in files:
-        if file.endswith(".hdf5"):  # Ensure only data files are processed
-            file_path = os.path.join(folder_path+reco_folder, file)
-            
-            # Load the DataFrame from the file
-            df = pd.read_hdf(file_path, index = False)
-            
-            # Apply cuts as per the specifications
-            for cut in cuts:
-                cut_key   = cut['cut_key']
-                cut_value = cut['cut_value']
-                cut_type  = cut['cut_type']
-                
-                if cut_type == "greater":
-                    df = df[df[cut_key] > cut_value]
-                elif cut_type == "less":
-                    df = df[df[cut_key] < cut_value]
-                elif cut_type == "equal":
-                    df = df[df[cut_key] == cut_value]
-                else:
-                    raise ValueError("Invalid cut type")
-            
-            # Concatenate the DataFrame to the final DataFrame
-            dfs.append(df)
+        df_final = _compact(pd.concat(dfs, ignore_index=True), compact)
+        current.rows_out = len(df_final)
 
-    df_final = pd.concat(dfs, ignore_index=True)
-
-    print('Loading time:', timedelta(seconds=time.time()-ctime), '\n')
     return df_final
 
 
@@ -272,24 +521,95 @@ def list_files_with_pattern(directory, pattern):
     files = glob.glob(directory + '/' + pattern)
     return files
 
-def save_to_hdf5(df, filename, path = '/sps/km3net/users/mchadoli/ANTARES/nnfit_reco/'):
+def _iter_frame_chunks(data, chunksize, as_frame=False):
+    """
+    Iterate over a DataFrame in slices of chunksize rows, or over an iterable of chunks (DataFrames or dictionaries of arrays,
+    e.g. from iter_rootfile_chunks). The chunks are yielded as dictionaries of NumPy arrays, or as DataFrames if as_frame is True.
+    """
+    if isinstance(data, pd.DataFrame):
+        chunks = (data.iloc[i:i+chunksize] for i in range(0, max(len(data), 1), chunksize))
+    else:
+        chunks = data
+
+    for chunk in chunks:
+        if as_frame:
+            yield chunk if isinstance(chunk, pd.DataFrame) else pd.DataFrame(chunk, copy=False)
+        elif isinstance(chunk, pd.DataFrame):
+            yield {column: chunk[column].to_numpy() for column in chunk.columns}
+        else:
+            yield chunk
+
+# Compression codecs of uproot, selected by name in export_dataframe_to_rootfile
+ROOT_COMPRESSION = {
+    "zlib": uproot.ZLIB,
+    "lzma": uproot.LZMA,
+    "lz4": uproot.LZ4,
+    "zstd": uproot.ZSTD,
+}
+
+def _root_compression(compression, compression_level):
+    """
+    Return the uproot compression object of a codec name and level. "none" disables the compression.
+    """
+    if compression is None:
+        compression = "zlib"
+    if compression == "none":
+        return None
+    if compression not in ROOT_COMPRESSION:
+        raise ValueError(f"Invalid compression codec. The valid codecs are: {', '.join(ROOT_COMPRESSION)}, none.")
+    return ROOT_COMPRESSION[compression](1 if compression_level is None else compression_level)
+
+def save_to_hdf5(df, filename, path = '/sps/km3net/users/mchadoli/ANTARES/nnfit_reco/', format="fixed", data_columns=None,
+                 complevel=None, complib=None, chunksize=100_000, min_itemsize=None):
     """
     Export the DataFrame to a HDF5 file.
 
     Args:
-        df (DataFrame): The DataFrame to be exported.
+        df (DataFrame or iterable): The DataFrame to be exported, or an iterable of chunks (DataFrames or dictionaries of arrays,
+        e.g. from iter_rootfile_chunks). Chunks are appended one by one in table format, so the full sample is never in memory.
         filename (str): The name of the file to be exported.
         folder_path (str, optional): Directory where the HDF5 file will be exported. 
         Defaults to '/sps/km3net/users/mchadoli/ANTARES/nnfit_reco/'.
+        format (str, optional): "fixed" (fast to write, no queries) or "table" (queryable with columns= and where=
+        in the HDF5 loaders). Defaults to "fixed".
+        data_columns (list, optional): Columns stored as indexed data columns in table format, so where-queries on them
+        only read the matching rows. Defaults to the columns of HDF5_DATA_COLUMNS present in the DataFrame.
+        complevel (int, optional): Compression level from 0 (none) to 9. Defaults to None (no compression).
+        complib (str, optional): Compression library: "zlib", "lzo", "bzip2", "blosc" or a blosc compressor like "blosc:zstd".
+        Defaults to None ("zlib" when complevel is set).
+        chunksize (int, optional): Number of rows written at once in table format. Defaults to 100_000.
+        min_itemsize (int or dict, optional): The width of the string columns in table format, for all of them or per column.
+        The width of a streamed table is set by its first chunk, so it is needed when a later chunk holds longer strings.
+        Defaults to None (the longest string of the DataFrame, or of the first chunk).
+
+    Raises:
+        ValueError: If a chunk holds strings longer than the width of the table.
     """
     print(f"Exporting the Dataframe to a H5 file as: {filename}")
-    ctime = time.time()
     
-    path = os.path.join(path, filename)
-    df.to_hdf(path, key='df', mode='w')
+    with stage("save_to_hdf5", file=filename, format=format):
+        _write_hdf5(df, os.path.join(path, filename), format, data_columns, complevel, complib, chunksize, min_itemsize)
     
     print(f"DataFrame written to an H5 file as: {filename}")
-    print('Exporting time:', timedelta(seconds=time.time()-ctime), '\n')
+
+def _write_hdf5(df, path, format, data_columns, complevel, complib, chunksize, min_itemsize=None):
+    if not isinstance(df, pd.DataFrame):
+        # Chunks can only be appended to a table
+        with pd.HDFStore(path, mode='w', complevel=complevel, complib=complib) as store:
+            for chunk in _iter_frame_chunks(df, chunksize, as_frame=True):
+                if data_columns is None:
+                    data_columns = [column for column in HDF5_DATA_COLUMNS if column in chunk.columns]
+                store.append('df', chunk, format="table", data_columns=data_columns, index=False, min_itemsize=min_itemsize)
+            if data_columns and 'df' in store:
+                store.create_table_index('df', columns=data_columns)
+    elif format == "table":
+        if data_columns is None:
+            data_columns = [column for column in HDF5_DATA_COLUMNS if column in df.columns]
+        with pd.HDFStore(path, mode='w', complevel=complevel, complib=complib) as store:
+            store.append('df', df, format="table", data_columns=data_columns, index=True, chunksize=chunksize,
+                         min_itemsize=min_itemsize)
+    else:
+        df.to_hdf(path, key='df', mode='w', complevel=complevel, complib=complib)
 
 def rename_h5_df_cols(
     df,
@@ -301,12 +621,140 @@ def rename_h5_df_cols(
 ):
     return df.rename(columns=mapper)
 
-def export_dataframe_to_rootfile(df, filename, tree = "sel", path = '/home/wecapstor3/capn/mppi133h/ANTARES/mc/cut_selection/low_energy'):
+def export_dataframe_to_rootfile(df, filename, tree = "sel", path = '/home/wecapstor3/capn/mppi133h/ANTARES/mc/cut_selection/low_energy',
+                                 chunksize=100_000, compression=None, compression_level=None):
+    """
+    Export a DataFrame, or a stream of chunks, to a ROOT file.
+
+    The tree is written one basket per chunk with uproot's extend, so only one chunk is converted at a time
+    and a large selection never needs twice its size in memory.
+
+    Args:
+        df (DataFrame or iterable): The DataFrame to be exported, or an iterable of chunks (DataFrames or dictionaries
+        of arrays, e.g. from iter_rootfile_chunks).
+        filename (str): The name of the file to be exported.
+        tree (str, optional): The name of the tree. Defaults to "sel".
+        path (str, optional): Directory where the ROOT file will be exported.
+        chunksize (int, optional): Number of rows per basket when df is a DataFrame. Defaults to 100_000.
+        compression (str, optional): Compression codec: "zlib", "lzma", "lz4", "zstd" or "none". Defaults to None (zlib).
+        compression_level (int, optional): Compression level of the codec. Defaults to None (level 1).
+    """
     print(f"\nExporting the DataFrame to a ROOT file as: {filename}")
-    ctime = time.time()
     
-    with uproot.recreate(os.path.join(path, filename)) as f:
-        f[tree] = df.to_records(index = False)
+    with stage("export_dataframe_to_rootfile", file=filename) as current:
+        current.rows_out = 0
+        with uproot.recreate(os.path.join(path, filename), compression=_root_compression(compression, compression_level)) as f:
+            ttree = None
+            for chunk in _iter_frame_chunks(df, chunksize):
+                # mktree makes sure a TTree is written, as expected by SWIM
+                if ttree is None:
+                    ttree = f.mktree(tree, {column: values.dtype for column, values in chunk.items()})
+                ttree.extend(chunk)
+                current.rows_out += len(next(iter(chunk.values()), []))
         
     print(f"DataFrame written to a ROOT file as: {filename}")
-    print('Exporting time:', timedelta(seconds=time.time()-ctime), '\n')
\ No newline at end of file
+
+def export_to_column_store(data, directory, columns=None, tree="sel", chunksize=100_000):
+    """
+    Export a sample to a column store: one raw .npy file per column plus a JSON schema.
+    The store can then be opened with load_column_store without decoding the ROOT file again.
+
+    Args:
+        data (DataFrame or str): The DataFrame to export, or the path to a ROOT file which is streamed chunk by chunk
+        into the .npy files, so the sample is never fully loaded in memory.
+        directory (str): Directory of the column store. It is created if it does not exist.
+        columns (list, optional): The columns to export. If None, all columns are exported. Defaults to None.
+        tree (str, optional): The name of the tree when data is a ROOT file. Defaults to "sel".
+        chunksize (int, optional): The number of entries read in each chunk when data is a ROOT file. Defaults to 100_000.
+
+    Raises:
+        ValueError: If a column holds objects (e.g. jagged branches), which cannot be memory-mapped.
+
+    Returns:
+        dict: The schema of the column store.
+    """
+    print(f"\nExporting to a column store in: {directory}")
+    
+    with stage("export_to_column_store", directory=directory) as current:
+        schema = _write_column_store(data, directory, columns, tree, chunksize)
+        current.rows_out = schema["num_entries"]
+    
+    print(f"Column store written with {len(schema['columns'])} columns and {schema['num_entries']} entries")
+    return schema
+
+def _write_column_store(data, directory, columns, tree, chunksize):
+    os.makedirs(directory, exist_ok=True)
+
+    if isinstance(data, pd.DataFrame):
+        source = None
+        num_entries = len(data)
+        chunks = [{column: data[column].to_numpy() for column in (data.columns if columns is None else columns)}]
+    else:
+        source = os.path.abspath(data)
+        num_entries = count_rootfile_entries(data, tree)
+        chunks = tqdm(iter_rootfile_chunks(data, columns, tree, chunksize), total=-(-num_entries // chunksize))
+
+    arrays = None
+    filled = 0
+    for chunk in chunks:
+        if arrays is None:
+            arrays = {}
+            for column, values in chunk.items():
+                if values.dtype.hasobject:
+                    raise ValueError(f"The column {column} holds objects and cannot be exported to a column store")
+                arrays[column] = np.lib.format.open_memmap(os.path.join(directory, f"{column}.npy"), mode="w+",
+                                                           dtype=values.dtype, shape=(num_entries,))
+
+        size = len(next(iter(chunk.values()), []))
+        for column, values in chunk.items():
+            arrays[column][filled:filled+size] = values
+        filled += size
+
+    schema = {
+        "num_entries": num_entries,
+        "source": source,
+        "tree": None if source is None else tree,
+        "columns": {column: {"file": f"{column}.npy", "dtype": values.dtype.str} for column, values in (arrays or {}).items()},
+    }
+    for values in (arrays or {}).values():
+        values.flush()
+    
+    with open(os.path.join(directory, "schema.json"), "w") as f:
+        json.dump(schema, f, indent=4)
+    
+    return schema
+
+def load_column_store(directory, columns=None, mmap_mode="r", library="pd", compact=False):
+    """
+    Load a column store written by export_to_column_store.
+
+    With the default mmap_mode="r" the columns are memory-mapped: loading takes no time and processes
+    reading the same store on a node share the page cache.
+
+    Args:
+        directory (str): Directory of the column store.
+        columns (list, optional): The columns to load. If None, all columns are loaded. Defaults to None.
+        mmap_mode (str, optional): Memory-map mode passed to np.load. None reads the columns in memory. Defaults to "r".
+        library (str, optional): "pd" for a DataFrame or "np" for a dictionary of the (memory-mapped) arrays. Defaults to "pd".
+        compact (bool or dict, optional): Compact the dtypes of the DataFrame with compact_dtypes. The compacted columns are
+        copied in memory and no longer memory-mapped. Defaults to False.
+
+    Returns:
+        DataFrame or dict: The columns of the store.
+    """
+    with open(os.path.join(directory, "schema.json"), "r") as f:
+        schema = json.load(f)
+
+    if columns is None:
+        columns = list(schema["columns"])
+
+    missing = [column for column in columns if column not in schema["columns"]]
+    if missing:
+        raise KeyError(f"Columns not found in the column store: {missing}")
+
+    arrays = {column: np.load(os.path.join(directory, schema["columns"][column]["file"]), mmap_mode=mmap_mode)
+              for column in columns}
+
+    if library == "np":
+        return arrays
+    return _compact(pd.DataFrame(arrays, copy=False), compact)
@@ -0,0 +1,367 @@
+import functools
+import json
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from datetime import timedelta
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+import numpy as np
+import pandas as pd
+
+# Sinks configured from the environment, e.g. TAU_INSTRUMENTATION="log,jsonl:/tmp/trace.jsonl,chrome:/tmp/trace.json"
+DEFAULT_SINKS = os.environ.get("TAU_INSTRUMENTATION", "log")
+# The peak RSS of each stage is opt-in: it resets the RSS high-water mark of the process, which the batch system
+# and tools like /usr/bin/time read as the peak of the job
+STAGE_PEAK_RSS = os.environ.get("TAU_STAGE_PEAK_RSS", "0").lower() not in ("", "0", "false", "no", "off")
+
+# ru_maxrss is in kilobytes on Linux and in bytes on macOS
+_RSS_UNIT = 1 if sys.platform == "darwin" else 1024
+
+_local = threading.local()
+
+# The running stages of all the threads, whose peak RSS is saved before the high-water mark is reset,
+# and the peak RSS of the process before the last reset
+_RUNNING = set()
+_RUNNING_LOCK = threading.Lock()
+_PROCESS_PEAK_RSS = 0.0
+
+class LogSink:
+    """
+    Print a human-readable line per stage, indented by the nesting of the stages.
+
+    Args:
+        stream (file, optional): The stream of the lines. Defaults to None (sys.stdout).
+    """
+    def __init__(self, stream=None):
+        self.stream = stream
+
+    def emit(self, record):
+        parts = [f"{timedelta(seconds=record['wall_s'])} wall", f"{record['cpu_s']:.2f} s CPU"]
+        if record["peak_rss_mb"] is not None:
+            parts.append(f"{record['peak_rss_mb']:.0f} MB peak RSS")
+        elif record["process_peak_rss_mb"] is not None:
+            parts.append(f"{record['process_peak_rss_mb']:.0f} MB process peak RSS")
+        if record["rows_in"] is not None and record["rows_out"] is not None:
+            parts.append(f"{record['rows_in']} -> {record['rows_out']} rows")
+        elif record["rows_out"] is not None:
+            parts.append(f"{record['rows_out']} rows")
+        if record["bytes_read"] is not None:
+            parts.append(f"{record['bytes_read'] / 1024**2:.1f} MB read")
+
+        label = record["name"]
+        if record["metadata"]:
+            label += " (" + ", ".join(f"{key}={value}" for key, value in record["metadata"].items()) + ")"
+        print(f"{'  ' * record['depth']}{label}: {', '.join(parts)}", file=self.stream or sys.stdout)
+
+    def close(self):
+        pass
+
+class JsonLinesSink:
+    """
+    Append one JSON object per stage to a file. The file is opened in append mode for each record,
+    so the stages of several scripts and worker processes can be collected in one trace.
+
+    Args:
+        path (str): The path to the JSON lines file.
+    """
+    def __init__(self, path):
+        self.path = path
+
+    def emit(self, record):
+        with open(self.path, "a") as f:
+            f.write(json.dumps(record, default=str) + "\n")
+
+    def close(self):
+        pass
+
+class ChromeTraceSink:
+    """
+    Append the stages as complete events of the Chrome trace format, to open in chrome://tracing or Perfetto.
+
+    The file uses the JSON array format, whose closing bracket is optional, so events are appended as they come
+    and the stages of several processes and scripts land on one timeline.
+
+    Args:
+        path (str): The path to the trace file.
+    """
+    def __init__(self, path):
+        self.path = path
+
+    def emit(self, record):
+        event = {
+            "name": record["name"],
+            "cat": "stage",
+            "ph": "X",
+            "ts": record["start"] * 1e6,
+            "dur": record["wall_s"] * 1e6,
+            "pid": record["pid"],
+            "tid": record["thread"],
+            "args": {key: value for key, value in record.items() if key not in ("name", "start", "wall_s", "pid", "thread")},
+        }
+        with open(self.path, "a") as f:
+            if f.tell() == 0:
+                f.write("[\n")
+            f.write(json.dumps(event, default=str) + ",\n")
+
+    def close(self):
+        pass
+
+SINK_TYPES = {"jsonl": JsonLinesSink, "chrome": ChromeTraceSink}
+
+def sinks_from_spec(spec):
+    """
+    Build the sinks of a specification like "log,jsonl:/tmp/trace.jsonl,chrome:/tmp/trace.json".
+    An empty specification (or "none") disables the instrumentation.
+    """
+    sinks = []
+    for item in filter(None, (item.strip() for item in spec.split(","))):
+        kind, _, path = item.partition(":")
+        if kind == "log":
+            sinks.append(LogSink())
+        elif kind in SINK_TYPES and path:
+            sinks.append(SINK_TYPES[kind](path))
+        elif kind != "none":
+            raise ValueError(f"Invalid sink {item}. The valid sinks are 'log', 'jsonl:<path>', 'chrome:<path>' and 'none'.")
+    return sinks
+
+_SINKS = sinks_from_spec(DEFAULT_SINKS)
+
+def configure(*sinks):
+    """
+    Replace the sinks receiving the stage records. Without sinks the stages are not recorded.
+
+    Args:
+        *sinks: LogSink, JsonLinesSink, ChromeTraceSink or any object with emit(record) and close() methods,
+        or specification strings of sinks_from_spec.
+    """
+    global _SINKS
+    for sink in _SINKS:
+        sink.close()
+    _SINKS = [sink for item in sinks for sink in (sinks_from_spec(item) if isinstance(item, str) else [item])]
+
+def add_sink(sink):
+    """
+    Add a sink to the configured ones.
+    """
+    _SINKS.append(sink)
+
+def get_sinks():
+    """
+    Return the configured sinks.
+    """
+    return list(_SINKS)
+
+def _cpu_time():
+    times = os.times()
+    return times.user + times.system, times.children_user + times.children_system
+
+def _process_peak_children_rss_mb():
+    """
+    The peak RSS of the largest finished child since the start of the process.
+    """
+    if resource is None:
+        return None
+    return resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * _RSS_UNIT / 1024**2
+
+def _process_peak_rss_mb():
+    """
+    The peak RSS of the process since its start, including the marks saved before each reset.
+    """
+    if resource is not None:
+        high_water = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * _RSS_UNIT / 1024**2
+    else:
+        high_water = _rss_high_water_mb()
+    with _RUNNING_LOCK:
+        if high_water is None:
+            return _PROCESS_PEAK_RSS or None
+        return max(_PROCESS_PEAK_RSS, high_water)
+
+def _rss_high_water_mb():
+    """
+    The RSS high-water mark of the process (VmHWM of /proc/self/status), None where it is not available.
+    """
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+def _reset_rss_high_water():
+    """
+    Reset the RSS high-water mark of the process to its current RSS (Linux), after saving it in the running stages
+    and in the peak of the process. Returns whether the mark could be reset.
+    """
+    global _PROCESS_PEAK_RSS
+    with _RUNNING_LOCK:
+        high_water = _rss_high_water_mb()
+        if high_water is None:
+            return False
+        _PROCESS_PEAK_RSS = max(_PROCESS_PEAK_RSS, high_water)
+        for running in _RUNNING:
+            running._peak_rss = max(running._peak_rss, high_water)
+        try:
+            with open("/proc/self/clear_refs", "w") as f:
+                f.write("5")
+        except OSError:
+            return False
+        return True
+
+def _bytes_read():
+    """
+    The bytes read by this process so far (rchar of /proc/self/io), None where it is not available.
+    """
+    try:
+        with open("/proc/self/io") as f:
+            for line in f:
+                if line.startswith("rchar:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+def count_rows(result):
+    """
+    The number of rows of a result: the length of a DataFrame, Series, array or dictionary of arrays,
+    of the first element of a tuple, None otherwise.
+    """
+    if isinstance(result, tuple) and result:
+        result = result[0]
+    if isinstance(result, (pd.DataFrame, pd.Series, np.ndarray)):
+        return len(result)
+    if isinstance(result, dict) and result and all(isinstance(values, np.ndarray) for values in result.values()):
+        return len(next(iter(result.values())))
+    return None
+
+class Stage:
+    """
+    The measurements of a running stage. The code of the stage can set the rows and bytes it knows better
+    than the automatic measurements, e.g. stage.rows_out = len(df).
+
+    Attributes:
+        name (str): The name of the stage.
+        rows_in (int): The number of input rows, None if unknown.
+        rows_out (int): The number of output rows, None if unknown.
+        bytes_read (int): The bytes read. If None, the bytes read by this process during the stage (on Linux).
+        metadata (dict): Free-form fields added to the record, e.g. the file name.
+    """
+    def __init__(self, name, rows_in=None, rows_out=None, bytes_read=None, **metadata):
+        self.name = name
+        self.rows_in = rows_in
+        self.rows_out = rows_out
+        self.bytes_read = bytes_read
+        self.metadata = metadata
+        self._peak_rss = 0.0
+
+@contextmanager
+def stage(name, rows_in=None, rows_out=None, bytes_read=None, **metadata):
+    """
+    Time a stage and send its record to the configured sinks when it ends (also if it raises).
+
+    The record holds the wall time, the CPU time of the process and of its finished child processes, the peak RSS
+    of the process since its start, the rows in and out, the bytes read and the metadata. Stages can be nested.
+
+    With TAU_STAGE_PEAK_RSS=1 the record also holds the peak RSS of the process during the stage (peak_rss_mb, None
+    otherwise), measured by resetting the RSS high-water mark of the process when the stage starts and reading it when
+    the stage ends (Linux only). The marks of the other running stages are saved before each reset, so nested stages
+    and stages of other threads keep their own peak, but the resets hide the peak of the process from the batch system.
+    The peak RSS of the largest finished child process is only known since the start of the process, so it is recorded
+    as process_peak_children_rss_mb and does not describe the stage alone.
+
+    Args:
+        name (str): The name of the stage, e.g. "load_rootfile_to_df".
+        rows_in (int, optional): The number of input rows. Defaults to None.
+        rows_out (int, optional): The number of output rows. Defaults to None.
+        bytes_read (int, optional): The bytes read. Defaults to None (measured on Linux).
+        **metadata: Free-form fields of the record, e.g. file=rootfile.
+
+    Yields:
+        Stage: The stage, whose rows and bytes can be set in the block.
+    """
+    current = Stage(name, rows_in, rows_out, bytes_read, **metadata)
+    if not _SINKS:
+        yield current
+        return
+
+    stack = _local.__dict__.setdefault("stack", [])
+    parent = stack[-1].name if stack else None
+    stack.append(current)
+
+    measure_rss = STAGE_PEAK_RSS and _reset_rss_high_water()
+    with _RUNNING_LOCK:
+        _RUNNING.add(current)
+
+    start, wall_start = time.time(), time.perf_counter()
+    cpu_start, children_start = _cpu_time()
+    read_start = _bytes_read()
+    error = None
+    try:
+        yield current
+    except BaseException as exception:
+        error = type(exception).__name__
+        raise
+    finally:
+        stack.pop()
+        cpu_end, children_end = _cpu_time()
+        read_end = _bytes_read()
+        with _RUNNING_LOCK:
+            _RUNNING.discard(current)
+            high_water = _rss_high_water_mb()
+        peak_rss = max(current._peak_rss, high_water) if measure_rss and high_water is not None else None
+
+        bytes_read = current.bytes_read
+        if bytes_read is None and read_start is not None and read_end is not None:
+            bytes_read = read_end - read_start
+
+        record = {
+            "name": current.name,
+            "start": start,
+            "wall_s": time.perf_counter() - wall_start,
+            "cpu_s": (cpu_end - cpu_start) + (children_end - children_start),
+            "peak_rss_mb": peak_rss,
+            "process_peak_rss_mb": _process_peak_rss_mb(),
+            "process_peak_children_rss_mb": _process_peak_children_rss_mb(),
+            "rows_in": current.rows_in,
+            "rows_out": current.rows_out,
+            "bytes_read": bytes_read,
+            "pid": os.getpid(),
+            "thread": threading.get_ident(),
+            "depth": len(stack),
+            "parent": parent,
+            "error": error,
+            "metadata": current.metadata,
+        }
+        for sink in _SINKS:
+            sink.emit(record)
+
+def timed(name=None, **metadata):
+    """
+    Decorator running a function as a stage, named after the function by default.
+    The output rows are counted from the result with count_rows.
+
+    Can be used as @timed, @timed("name") or @timed(name="name", key=value).
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with stage(stage_name or func.__qualname__, **metadata) as current:
+                result = func(*args, **kwargs)
+                if current.rows_out is None:
+                    current.rows_out = count_rows(result)
+            return result
+        return wrapper
+
+    if callable(name):
+        stage_name = None
+        return decorator(name)
+    stage_name = name
+    return decorator
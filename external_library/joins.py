@@ -0,0 +1,274 @@
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+
+# Keys matching the AntDST events to the NNFit reconstructions (after renaming the NNFit columns)
+EVENT_KEYS = ["RunID", "Frame", "TriggCounter"]
+
+def _key_array(df, column):
+    """
+    Return a key column as an int64 NumPy array.
+    """
+    values = np.asarray(df[column])
+    if values.dtype.kind not in "biu":
+        raise TypeError(f"The key column {column} must hold integers, not {values.dtype}")
+    return values.astype(np.int64, copy=False)
+
+def _integer_keys(df, on):
+    """
+    Return whether all the key columns of a frame hold integers.
+    """
+    return all(np.asarray(df[column]).dtype.kind in "biu" for column in on)
+
+def _pandas_indexer(left, right, on, how):
+    """
+    Join the key columns of two frames with pd.merge and return the left and right row positions of the output rows,
+    -1 where a left row has no match. Used for the keys that cannot be packed, e.g. float keys.
+    """
+    left_keys = pd.DataFrame({column: left[column].to_numpy() for column in on})
+    left_keys["__left_row__"] = np.arange(len(left))
+    right_keys = pd.DataFrame({column: right[column].to_numpy() for column in on})
+    right_keys["__right_row__"] = np.arange(len(right))
+
+    rows = pd.merge(left_keys, right_keys, on=on, how=how)
+    return rows["__left_row__"].to_numpy(), rows["__right_row__"].fillna(-1).to_numpy(dtype=np.int64)
+
+def key_layout(left, right, on):
+    """
+    Choose the offsets and bit widths packing several integer key columns into one uint64 key.
+
+    Each column is shifted by its minimum over both frames and stored on the number of bits of its range.
+
+    Args:
+        left (pd.DataFrame): The left frame.
+        right (pd.DataFrame): The right frame.
+        on (list): The key columns.
+
+    Raises:
+        ValueError: If the keys need more than 64 bits.
+
+    Returns:
+        list: One (column, offset, width) tuple per key column.
+    """
+    layout = []
+    for column in on:
+        values = [values for values in (_key_array(left, column), _key_array(right, column)) if len(values)]
+        low = min((int(values.min()) for values in values), default=0)
+        high = max((int(values.max()) for values in values), default=0)
+        layout.append((column, low, max(int(high - low).bit_length(), 1)))
+
+    n_bits = sum(width for _, _, width in layout)
+    if n_bits > 64:
+        raise ValueError(f"The keys {on} need {n_bits} bits and cannot be packed into a 64-bit key")
+    return layout
+
+def pack_keys(df, layout):
+    """
+    Pack the key columns of a frame into one uint64 key, following a layout of key_layout.
+
+    Args:
+        df (pd.DataFrame): The frame.
+        layout (list): The (column, offset, width) tuples of key_layout.
+
+    Returns:
+        array: The packed uint64 keys.
+    """
+    keys = np.zeros(len(df), dtype=np.uint64)
+    for column, offset, width in layout:
+        keys <<= np.uint64(width)
+        keys |= (_key_array(df, column) - offset).astype(np.uint64)
+    return keys
+
+def _take(series, indexer, allow_fill):
+    """
+    Take the rows of a column, -1 giving a missing value (with the upcasting of pd.merge) when allow_fill is True.
+    """
+    if isinstance(series.dtype, pd.api.extensions.ExtensionDtype):
+        return series.array.take(indexer, allow_fill=allow_fill)
+    return pd.api.extensions.take(series.to_numpy(), indexer, allow_fill=allow_fill)
+
+def _sort_keys(keys, key_bits=64):
+    """
+    Stable sort of packed keys, returning the sorted keys and their original positions.
+
+    When the keys and the row positions fit together into 64 bits they are sorted as one uint64 array,
+    which is much faster than a stable argsort.
+    """
+    row_bits = max(len(keys).bit_length(), 1)
+    if key_bits + row_bits > 64:
+        order = np.argsort(keys, kind="stable")
+        return keys[order], order
+
+    combined = (keys << np.uint64(row_bits)) | np.arange(len(keys), dtype=np.uint64)
+    combined.sort()
+    return combined >> np.uint64(row_bits), (combined & np.uint64((1 << row_bits) - 1)).astype(np.int64)
+
+def _join_indexer(left_keys, right_keys, how="left", key_bits=64):
+    """
+    Sort-merge join of two arrays of packed keys.
+
+    Both sides are sorted (stably, so duplicates keep their order) and the sorted left keys are located in the
+    sorted right keys with searchsorted, which walks both arrays in order.
+
+    Returns:
+        tuple: The left and right row positions of the output rows, -1 where a left row has no match.
+    """
+    sorted_right, order = _sort_keys(right_keys, key_bits)
+    sorted_left, left_order = _sort_keys(left_keys, key_bits)
+
+    sorted_start = np.searchsorted(sorted_right, sorted_left, side="left")
+    start = np.empty(len(left_keys), dtype=np.int64)
+    start[left_order] = sorted_start
+
+    # With unique right keys (the usual case of one reconstruction per event) each left row has at most one match
+    if not np.any(sorted_right[1:] == sorted_right[:-1]):
+        found = np.zeros(len(left_keys), dtype=bool)
+        if len(sorted_right):
+            found[left_order] = sorted_right[np.minimum(sorted_start, len(sorted_right) - 1)] == sorted_left
+
+        if how == "left":
+            right_index = np.full(len(left_keys), -1, dtype=np.int64)
+            right_index[found] = order[start[found]]
+            return np.arange(len(left_keys)), right_index
+        left_index = np.flatnonzero(found)
+        return left_index, order[start[left_index]]
+
+    counts = np.empty(len(left_keys), dtype=np.int64)
+    counts[left_order] = np.searchsorted(sorted_right, sorted_left, side="right") - sorted_start
+
+    # Each left row gives one output row per match, and a single row without match in a left join
+    repeats = np.maximum(counts, 1) if how == "left" else counts
+    left_index = np.repeat(np.arange(len(left_keys)), repeats)
+    within = np.arange(len(left_index)) - np.repeat(np.cumsum(repeats) - repeats, repeats)
+
+    matched = np.repeat(counts > 0, repeats)
+    right_index = np.full(len(left_index), -1, dtype=np.int64)
+    right_index[matched] = order[np.repeat(start, repeats)[matched] + within[matched]]
+
+    return left_index, right_index
+
+def _partition_indexer(left_keys, right_keys, left_rows, right_rows, how, key_bits):
+    """
+    Join one partition and return the row positions in the full frames.
+    """
+    left_index, right_index = _join_indexer(left_keys, right_keys, how, key_bits)
+    right_index = np.where(right_index >= 0, right_rows[np.maximum(right_index, 0)], -1) if len(right_rows) else right_index
+    return left_rows[left_index], right_index
+
+def merge_events(
+    left,
+    right,
+    on=EVENT_KEYS,
+    how="left",
+    suffixes=("_x", "_y"),
+    partition_on=None,
+    n_partitions=1,
+    n_workers=1,
+    return_stats=False,
+):
+    """
+    Join two frames on integer keys packed into a single uint64 key, as a faster pd.merge(left, right, on=on, how=how).
+
+    The keys are packed with key_layout/pack_keys and the frames are joined with a sort-merge (sort and searchsorted)
+    on the packed keys. The output has the rows, columns, order and dtypes of pd.merge. Keys that are not integers
+    (e.g. float keys upcast by an earlier left join) cannot be packed, and are matched with pd.merge instead,
+    without partitions.
+
+    The rows can be split by a key column (e.g. RunID) into partitions joined one after the other, or in parallel in
+    worker processes, so only one partition of sorted keys is held at a time.
+
+    Args:
+        left (pd.DataFrame): The left frame, e.g. the AntDST events.
+        right (pd.DataFrame): The right frame, e.g. the NNFit events.
+        on (list, optional): The key columns. Defaults to EVENT_KEYS (RunID, Frame, TriggCounter).
+        how (str, optional): "left" or "inner". Defaults to "left".
+        suffixes (tuple, optional): Suffixes of the overlapping non-key columns. Defaults to ("_x", "_y").
+        partition_on (str, optional): The key column defining the partitions, e.g. "RunID". Defaults to None.
+        n_partitions (int, optional): The number of partitions (by value modulo n_partitions). Defaults to 1.
+        n_workers (int, optional): Number of worker processes joining the partitions. Defaults to 1 (sequential).
+        return_stats (bool, optional): Also return the unmatched-row statistics. Defaults to False.
+
+    Raises:
+        ValueError: If the join type is invalid or the keys do not fit into 64 bits.
+
+    Returns:
+        pd.DataFrame: The joined frame, and the dictionary of statistics if return_stats is True:
+        the number of left, right and output rows, the unmatched left and right rows, and the unmatched left rows
+        per value of partition_on (or of the first key) as a Series.
+    """
+    if how not in ("left", "inner"):
+        raise ValueError("Invalid join type. The valid types are 'left' and 'inner'.")
+
+    on = list(on)
+    integer_keys = _integer_keys(left, on) and _integer_keys(right, on)
+    if integer_keys:
+        layout = key_layout(left, right, on)
+        left_keys, right_keys = pack_keys(left, layout), pack_keys(right, layout)
+        key_bits = sum(width for _, _, width in layout)
+
+    if not integer_keys:
+        left_index, right_index = _pandas_indexer(left, right, on, how)
+    elif partition_on is None or n_partitions <= 1:
+        left_index, right_index = _join_indexer(left_keys, right_keys, how, key_bits)
+    else:
+
+        left_parts = _key_array(left, partition_on) % n_partitions
+        right_parts = _key_array(right, partition_on) % n_partitions
+
+        left_rows = [np.flatnonzero(left_parts == i) for i in range(n_partitions)]
+        right_rows = [np.flatnonzero(right_parts == i) for i in range(n_partitions)]
+        arguments = (
+            [left_keys[rows] for rows in left_rows],
+            [right_keys[rows] for rows in right_rows],
+            left_rows,
+            right_rows,
+            [how] * n_partitions,
+            [key_bits] * n_partitions,
+        )
+
+        if n_workers <= 1:
+            results = list(map(_partition_indexer, *arguments))
+        else:
+            with ProcessPoolExecutor(max_workers=n_workers) as executor:
+                results = list(executor.map(_partition_indexer, *arguments))
+
+        # Restore the order of the left rows, the matches of each row keep the right order
+        left_index = np.concatenate([result[0] for result in results])
+        right_index = np.concatenate([result[1] for result in results])
+        order = np.argsort(left_index, kind="stable")
+        left_index, right_index = left_index[order], right_index[order]
+
+    # Overlapping non-key columns get the suffixes, as in pd.merge
+    values = [column for column in right.columns if column not in on]
+    overlap = set(values) & set(left.columns)
+    if len(left_index) == len(left) and np.array_equal(left_index, np.arange(len(left))):
+        left_part = left.reset_index(drop=True)
+    else:
+        left_part = left.iloc[left_index].reset_index(drop=True)
+    left_part = left_part.rename(columns={column: f"{column}{suffixes[0]}" for column in overlap})
+
+    # Unmatched rows (-1) are filled with missing values, upcasting the dtypes like pd.merge (e.g. int to float, bool to object)
+    allow_fill = bool(np.any(right_index < 0))
+    right_part = pd.DataFrame(
+        {f"{column}{suffixes[1]}" if column in overlap else column:
+         _take(right[column], right_index, allow_fill) for column in values},
+        index=left_part.index,
+    )
+
+    df = pd.concat([left_part, right_part], axis=1)
+
+    if not return_stats:
+        return df
+
+    unmatched_left = right_index < 0 if how == "left" else ~np.isin(np.arange(len(left)), left_index)
+    unmatched_rows = left_index[unmatched_left] if how == "left" else np.flatnonzero(unmatched_left)
+    by = partition_on if partition_on is not None else on[0]
+    stats = {
+        "left_rows": len(left),
+        "right_rows": len(right),
+        "output_rows": len(df),
+        "unmatched_left": len(unmatched_rows),
+        "unmatched_right": len(right) - len(np.unique(right_index[right_index >= 0])),
+        f"unmatched_left_per_{by}": left[by].iloc[unmatched_rows].value_counts().sort_index(),
+    }
+    return df, stats
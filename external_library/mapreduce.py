@@ -0,0 +1,205 @@
+import traceback
+import numpy as np
+import pandas as pd
+import uproot
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from tqdm import tqdm
+
+try:
+    from .instrumentation import stage
+except ImportError:
+    from instrumentation import stage
+
+def run_entry_ranges(rootfile, tree="sel", run_column="RunID"):
+    """
+    Split the entries of a ROOT tree into work units, one per run, reading only the run branch.
+
+    Args:
+        rootfile (str): The path to the ROOT file.
+        tree (str, optional): The name of the tree. Defaults to "sel".
+        run_column (str, optional): The branch holding the run number. Defaults to "RunID".
+
+    Returns:
+        dict: The (start, stop) entry ranges of each run, in the order of the file. A run is split
+        into several ranges if its entries are not contiguous.
+    """
+    with uproot.open(rootfile) as f:
+        run_ids = f[tree][run_column].array(library="np")
+    return _run_blocks(run_ids)
+
+def _run_blocks(run_ids):
+    """
+    The (start, stop) ranges of the blocks of consecutive entries with the same run, grouped by run.
+    """
+    # Boundaries of the blocks of consecutive entries with the same run
+    boundaries = np.flatnonzero(run_ids[1:] != run_ids[:-1]) + 1
+    starts = np.concatenate([[0], boundaries]) if len(run_ids) else np.array([], dtype=np.int64)
+    stops = np.concatenate([boundaries, [len(run_ids)]]) if len(run_ids) else np.array([], dtype=np.int64)
+
+    ranges = {}
+    for start, stop in zip(starts.tolist(), stops.tolist()):
+        ranges.setdefault(run_ids[start].item(), []).append((start, stop))
+    return ranges
+
+def load_entry_ranges(rootfile, ranges, columns=None, tree="sel"):
+    """
+    Load the entries of a list of ranges of a ROOT tree into a DataFrame.
+
+    Args:
+        rootfile (str): The path to the ROOT file.
+        ranges (list): The (start, stop) entry ranges, e.g. of one run of run_entry_ranges.
+        columns (list, optional): The columns to load. If None, all the branches are loaded. Defaults to None.
+        tree (str, optional): The name of the tree. Defaults to "sel".
+
+    Returns:
+        pd.DataFrame: The entries of the ranges, in order.
+    """
+    with uproot.open(rootfile) as f:
+        ttree = f[tree]
+        chunks = [ttree.arrays(columns, library="np", entry_start=start, entry_stop=stop) for start, stop in ranges]
+
+    if not chunks:
+        return pd.DataFrame(columns=columns)
+    return pd.DataFrame({column: np.concatenate([chunk[column] for chunk in chunks]) for column in chunks[0]})
+
+def _hdf5_key(store, file_path):
+    """
+    The key of the single DataFrame of an HDF5 file.
+    """
+    keys = store.keys()
+    if len(keys) != 1:
+        raise ValueError(f"The HDF5 file {file_path} holds {len(keys)} DataFrames, only one is supported")
+    return keys[0]
+
+def hdf5_run_entry_ranges(file_path, run_column="RunID"):
+    """
+    Split the rows of a pandas HDF5 file into work units, one per run, reading only the run column of table-format files.
+
+    Args:
+        file_path (str): The path to the HDF5 file. It must hold a single DataFrame.
+        run_column (str, optional): The column holding the run number. Defaults to "RunID".
+
+    Returns:
+        dict: The (start, stop) row ranges of each run, as run_entry_ranges.
+    """
+    with pd.HDFStore(file_path, mode="r") as store:
+        key = _hdf5_key(store, file_path)
+        if store.get_storer(key).is_table:
+            run_ids = store.select(key, columns=[run_column])[run_column].to_numpy()
+        else:
+            run_ids = store.select(key)[run_column].to_numpy()
+    return _run_blocks(run_ids)
+
+def load_hdf5_entry_ranges(file_path, ranges, columns=None):
+    """
+    Load the rows of a list of ranges of a pandas HDF5 file, e.g. of one run of hdf5_run_entry_ranges.
+
+    Args:
+        file_path (str): The path to the HDF5 file. It must hold a single DataFrame.
+        ranges (list): The (start, stop) row ranges.
+        columns (list, optional): The columns to load. If None, all the columns are loaded. Defaults to None.
+
+    Returns:
+        pd.DataFrame: The rows of the ranges, in order.
+    """
+    with pd.HDFStore(file_path, mode="r") as store:
+        key = _hdf5_key(store, file_path)
+        is_table = store.get_storer(key).is_table
+        chunks = []
+        for start, stop in ranges:
+            chunk = store.select(key, start=start, stop=stop, columns=columns if is_table else None)
+            chunks.append(chunk if columns is None else chunk[list(columns)])
+
+    if not chunks:
+        return pd.DataFrame(columns=columns)
+    return pd.concat(chunks, ignore_index=True)
+
+def _call(func, item):
+    """
+    Run one work unit and return its result, or the formatted exception if it fails.
+    """
+    try:
+        return True, func(item)
+    except Exception:
+        return False, traceback.format_exc()
+
+def _outcomes(func, items, n_workers):
+    """
+    Yield the (index, success, value) outcome of each work unit as it finishes.
+
+    At most 2 * n_workers work units are running or waiting to be reduced at once. If the pool breaks
+    (e.g. a worker killed by the OOM killer), the work units that did not finish are yielded as failures.
+    """
+    window = 2 * n_workers
+    with ProcessPoolExecutor(max_workers=n_workers) as executor:
+        pending, next_item, broken = {}, 0, None
+        while pending or (next_item < len(items) and broken is None):
+            while broken is None and next_item < len(items) and len(pending) < window:
+                try:
+                    pending[executor.submit(_call, func, items[next_item])] = next_item
+                    next_item += 1
+                except BrokenProcessPool as error:
+                    broken = error
+
+            done, _ = wait(pending, return_when=FIRST_COMPLETED) if pending else (set(), set())
+            for future in done:
+                index = pending.pop(future)
+                try:
+                    yield (index, *future.result())
+                except BrokenProcessPool as error:
+                    broken = error
+                    yield index, False, f"The process pool broke before the work unit finished: {error!r}"
+
+        for index in range(next_item, len(items)):
+            yield index, False, f"The process pool broke before the work unit started: {broken!r}"
+
+def map_reduce(func, items, reduce, initial=None, n_workers=1, desc="Work units"):
+    """
+    Map a function over work units (e.g. runs) in a process pool and merge the partial results with an associative reduce.
+
+    The partial results are reduced in the order of the items as soon as they are available, so the reduce only needs
+    to be associative, and only the accumulator and the partial results waiting for an earlier work unit are held
+    in memory. A work unit that raises does not stop the others: it is reported and left out of the result. If the
+    process pool breaks (e.g. a worker killed by the OOM killer), the work units that did not finish are reported
+    as failed and the partial results of the others are kept.
+
+    Args:
+        func (callable): The function of one work unit. It must be picklable (a module-level function or a functools.partial of one).
+        items (iterable): The work units, e.g. the run ids.
+        reduce (callable): The function merging two partial results.
+        initial (optional): The initial value of the reduce. If None, the first partial result is used. Defaults to None.
+        n_workers (int, optional): Number of worker processes. With 1 the work units run in this process. Defaults to 1.
+        desc (str, optional): Description of the progress bar. Defaults to "Work units".
+
+    Returns:
+        tuple: The reduced result (None if every work unit failed) and the list of (work unit, traceback) of the failed work units.
+    """
+    items = list(items)
+
+    with stage("map_reduce", rows_in=len(items), desc=desc, n_workers=n_workers) as current:
+        if n_workers <= 1:
+            outcomes = ((index, *_call(func, item)) for index, item in enumerate(items))
+        else:
+            outcomes = _outcomes(func, items, n_workers)
+
+        result, has_result = initial, initial is not None
+        waiting, next_index, n_results, failures = {}, 0, 0, []
+        for index, success, value in tqdm(outcomes, total=len(items), desc=desc):
+            waiting[index] = (success, value)
+            # Reduce the outcomes that follow the last reduced one
+            while next_index in waiting:
+                success, value = waiting.pop(next_index)
+                if success:
+                    result = reduce(result, value) if has_result else value
+                    has_result = True
+                    n_results += 1
+                else:
+                    failures.append((items[next_index], value))
+                next_index += 1
+        current.rows_out = n_results
+
+    for item, error in failures:
+        print(f"Work unit {item} failed:\n{error}")
+
+    return result, failures
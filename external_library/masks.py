@@ -1,3 +1,12 @@
+import ast
+import numpy as np
+import pandas as pd
+
+# Labels written by apply_all_masks and classify_events, in the order of their categorical codes.
+# They are sorted so groupbys on the categorical labels give the same order as on the strings.
+FLAVOUR_LABELS = ["electron", "muon", "tau"]
+EVENT_LABELS = ["showers_cc", "showers_nc", "tracks"]
+
 def apply_all_masks(df):
     """
     Apply all masks to the dataframe.
@@ -28,6 +37,78 @@ def apply_all_masks(df):
 
     return df
 
+def _row_codes(df, type_column="type"):
+    """
+    Encode each row by (abs(type), is_cc, interaction_type) into a single code between 0 and 35.
+
+    - flavour: 0 for any other type, 1 for |type| == 12, 2 for |type| == 14, 3 for |type| == 16
+    - is_cc: 0 for False, 1 for True, 2 for anything else (e.g. missing)
+    - interaction_type: 0 for any other value, 1 for 2, 2 for 3
+    """
+    abs_type = np.abs(np.asarray(df[type_column]))
+    flavour = (1 * (abs_type == 12) + 2 * (abs_type == 14) + 3 * (abs_type == 16)).astype(np.int8)
+
+    is_cc = np.asarray(df["is_cc"])
+    if is_cc.dtype == bool:
+        cc = is_cc.astype(np.int8)
+    else:
+        cc = np.where(is_cc == True, 1, np.where(is_cc == False, 0, 2)).astype(np.int8)
+
+    interaction_type = np.asarray(df["interaction_type"])
+    interaction = (1 * (interaction_type == 2) + 2 * (interaction_type == 3)).astype(np.int8)
+
+    return flavour * 9 + cc * 3 + interaction
+
+_LOOKUP_TABLES = {}
+
+def _lookup_tables():
+    """
+    Return the lookup tables from row code to flavour and event type codes (-1 for no label),
+    and to the flavour/topology bits of compute_maskbits. They are built once by running the masks
+    on one representative row of each code, so the classification follows the masks exactly.
+    """
+    if not _LOOKUP_TABLES:
+        codes = np.arange(36)
+        flavour, cc, interaction = codes // 9, (codes // 3) % 3, codes % 3
+        df = pd.DataFrame({
+            "type": np.array([0, 12, 14, 16])[flavour],
+            "is_cc": pd.Series(np.array([False, True, None], dtype=object)[cc], dtype=object),
+            "interaction_type": np.array([0, 2, 3])[interaction],
+        })
+        bits = np.zeros(len(codes), dtype=np.uint16)
+        for name, function in _TOPOLOGY_FUNCTIONS.items():
+            bits |= np.asarray(function(df), dtype=np.uint16) << np.uint16(MASK_BITS[name])
+        _LOOKUP_TABLES["mask_bits"] = bits
+
+        df = apply_all_masks(df)
+
+        for column, labels in (("Flavour type", FLAVOUR_LABELS), ("Event type", EVENT_LABELS)):
+            values = df[column] if column in df.columns else pd.Series(np.nan, index=df.index)
+            _LOOKUP_TABLES[column] = np.array([labels.index(value) if value in labels else -1 for value in values], dtype=np.int8)
+    return _LOOKUP_TABLES
+
+def classify_events(df, type_column="type"):
+    """
+    Add the "Flavour type" and "Event type" labels of apply_all_masks in a single vectorised pass.
+
+    Each row is encoded by (abs(type), is_cc, interaction_type), the codes are mapped through small lookup tables
+    and the labels are assigned at once as categorical columns, instead of computing every mask and writing strings with df.loc.
+
+    Args:
+        df (pd.DataFrame): The dataframe you want to classify.
+        type_column (str, optional): The column holding the PDG type. Defaults to "type".
+
+    Returns:
+        pd.DataFrame: The dataframe with the categorical "Flavour type" and "Event type" columns.
+    """
+    codes = _row_codes(df, type_column)
+    tables = _lookup_tables()
+
+    df["Flavour type"] = pd.Categorical.from_codes(tables["Flavour type"][codes], categories=FLAVOUR_LABELS)
+    df["Event type"] = pd.Categorical.from_codes(tables["Event type"][codes], categories=EVENT_LABELS)
+
+    return df
+
 def get_trackmask(df):
     cc_ma = df["is_cc"] == True
     numu_ma = get_numumask(df)
@@ -98,3 +179,152 @@ def get_cutrun(df):
     run_mask = df["run_id"] > 34348 #no tau production beforehand
 
     return run_mask
+
+# Named masks packed by compute_maskbits, with the columns each one needs. The position in the dictionary is the bit.
+MASK_COLUMNS = {
+    "nue": ["type", "is_cc", "interaction_type"],
+    "numu": ["type", "is_cc", "interaction_type"],
+    "nutau": ["type", "is_cc", "interaction_type"],
+    "tracks": ["type", "is_cc", "interaction_type"],
+    "showers_nc": ["type", "is_cc", "interaction_type"],
+    "showers_cc": ["type", "is_cc", "interaction_type"],
+    "low_energy": ["energy_true"],
+    "region": ["energy_true"],
+    "upgoing": ["cos_zenith_true"],
+    "cutrun": ["run_id"],
+}
+MASK_BITS = {name: bit for bit, name in enumerate(MASK_COLUMNS)}
+
+_KINEMATIC_MASKS = {
+    "low_energy": get_low_energymask,
+    "region": get_region,
+    "upgoing": get_upgoingmask,
+    "cutrun": get_cutrun,
+}
+
+_TOPOLOGY_FUNCTIONS = {
+    "nue": get_nuemask,
+    "numu": get_numumask,
+    "nutau": get_nutaumask,
+    "tracks": get_trackmask,
+    "showers_nc": get_showermask_nc,
+    "showers_cc": get_showermask_cc,
+}
+
+def _held_masks(df, column):
+    """
+    The names of the masks recorded in the bit column by compute_maskbits, None if it has no record.
+    """
+    held = df.attrs.get(f"{column}_masks")
+    if held is None:
+        return None
+    return {name for name, bit in MASK_BITS.items() if (held >> bit) & 1}
+
+def compute_maskbits(df, names=None, column="mask_bits", type_column="type", recompute=False):
+    """
+    Compute the named analysis masks once and pack them into a single uint16 column, one bit per mask (see MASK_BITS).
+    Combined selections are then evaluated with query_maskbits on this compact column.
+
+    The bits of the computed masks are recorded in df.attrs[f"{column}_masks"], a single integer that pandas copies
+    cheaply to every derived frame. An existing column is reused when
+    it holds every requested mask, and recomputed otherwise. A column without this record (e.g. stored with the sample
+    by the exporters of file_management) is recomputed when the requested masks can be computed from the dataframe,
+    and reused when its source columns were not stored.
+
+    Args:
+        df (pd.DataFrame): The dataframe you want to compute the masks for.
+        names (list, optional): The masks to compute. Defaults to None, every mask whose columns are in the dataframe.
+        Masks not computed read as False.
+        column (str, optional): The name of the bit column. Defaults to "mask_bits".
+        type_column (str, optional): The column holding the PDG type. Defaults to "type".
+        recompute (bool, optional): Recompute the column even if it is already present. Defaults to False.
+
+    Returns:
+        pd.DataFrame: The dataframe with the bit column.
+    """
+    available = set(df.columns) | ({"type"} if type_column in df.columns else set())
+    computable = [name for name, columns in MASK_COLUMNS.items() if set(columns) <= available]
+    if names is None:
+        names = computable
+
+    unknown = [name for name in names if name not in MASK_BITS]
+    if unknown:
+        raise KeyError(f"Unknown masks: {unknown}. The valid masks are: {', '.join(MASK_BITS)}")
+
+    if column in df.columns and not recompute:
+        held = _held_masks(df, column)
+        if held is not None and set(names) <= held:
+            return df
+        if held is None and (not names or not set(names) <= set(computable)):
+            return df
+
+    bits = np.zeros(len(df), dtype=np.uint16)
+
+    topology = [name for name in names if name in _TOPOLOGY_FUNCTIONS]
+    if topology:
+        selected = np.uint16(sum(1 << MASK_BITS[name] for name in topology))
+        bits |= _lookup_tables()["mask_bits"][_row_codes(df, type_column)] & selected
+
+    for name in names:
+        if name in _KINEMATIC_MASKS:
+            bits |= np.asarray(_KINEMATIC_MASKS[name](df), dtype=np.uint16) << np.uint16(MASK_BITS[name])
+
+    df[column] = bits
+    df.attrs[f"{column}_masks"] = sum(1 << MASK_BITS[name] for name in set(names))
+    return df
+
+def _truth_table(node, patterns):
+    """
+    Evaluate a parsed mask expression on every bit pattern.
+    """
+    if isinstance(node, ast.Name):
+        if node.id not in MASK_BITS:
+            raise KeyError(f"Unknown mask: {node.id}. The valid masks are: {', '.join(MASK_BITS)}")
+        return (patterns >> MASK_BITS[node.id]) & 1 == 1
+    if isinstance(node, ast.UnaryOp) and isinstance(node.op, (ast.Invert, ast.Not)):
+        return ~_truth_table(node.operand, patterns)
+    if isinstance(node, ast.BinOp) and isinstance(node.op, (ast.BitAnd, ast.BitOr, ast.BitXor)):
+        left, right = _truth_table(node.left, patterns), _truth_table(node.right, patterns)
+        if isinstance(node.op, ast.BitAnd):
+            return left & right
+        return left | right if isinstance(node.op, ast.BitOr) else left ^ right
+    if isinstance(node, ast.BoolOp):
+        values = [_truth_table(value, patterns) for value in node.values]
+        return np.logical_and.reduce(values) if isinstance(node.op, ast.And) else np.logical_or.reduce(values)
+    raise ValueError(f"Unsupported syntax in mask expression: {ast.dump(node)}")
+
+def query_maskbits(data, expression, column="mask_bits"):
+    """
+    Evaluate a combination of named masks on the packed bit column.
+
+    The expression combines the names of MASK_BITS with &, |, ^, ~ (or and, or, not) and parentheses,
+    e.g. "nutau & upgoing & low_energy & ~showers_nc". It is evaluated once on all the bit patterns,
+    so the selection costs a single lookup over the compact column.
+
+    Args:
+        data (pd.DataFrame or array): The dataframe holding the bit column, or the bit column itself.
+        expression (str): The mask expression.
+        column (str, optional): The name of the bit column. Defaults to "mask_bits".
+
+    Raises:
+        KeyError: If the expression uses a mask that is not in the bit column of the dataframe.
+
+    Returns:
+        array: A boolean NumPy array with one entry per row.
+    """
+    bits = np.asarray(data[column] if isinstance(data, pd.DataFrame) else data)
+    try:
+        tree = ast.parse(expression.strip(), mode="eval").body
+    except SyntaxError as error:
+        raise ValueError(f"Invalid mask expression: {expression}") from error
+
+    # Masks that were not computed would silently read as False
+    held = _held_masks(data, column) if isinstance(data, pd.DataFrame) else None
+    if held is not None:
+        missing = sorted({node.id for node in ast.walk(tree) if isinstance(node, ast.Name)} - held)
+        if missing:
+            raise KeyError(f"The masks {missing} are not in the {column} column, compute them with compute_maskbits(df, names=...)")
+
+    patterns = np.arange(1 << len(MASK_BITS), dtype=np.uint32)
+    table = _truth_table(tree, patterns)
+    return table[bits]
@@ -0,0 +1,355 @@
+import os
+import json
+import numpy as np
+import scipy.sparse as sp
+from scipy.special import ndtr
+from tqdm import tqdm
+
+try:
+    from .file_management import iter_rootfile_chunks, count_rootfile_entries
+    from .instrumentation import stage
+    from .smearing import INPUT_COLUMNS, SMEARED_COLUMNS, smearing_sigmas, level_config, LEVEL_FILE_PATTERN
+except ImportError:
+    from file_management import iter_rootfile_chunks, count_rootfile_entries
+    from instrumentation import stage
+    from smearing import INPUT_COLUMNS, SMEARED_COLUMNS, smearing_sigmas, level_config, LEVEL_FILE_PATTERN
+
+# Axes of the true and reconstructed energy x cosine zenith histograms, the energy being the slow axis
+BINNING_AXES = ["true_energy", "true_cos_zenith", "reco_energy", "reco_cos_zenith"]
+
+def default_binning(nbins=15):
+    """
+    The energy x cosine zenith grid of create_json_binning in Chi2Profile/create_json_file.py: 120 logarithmic true
+    energy bins from 1 to 10^4 GeV, 40 true cosine zenith bins, the custom reconstructed energy bins and 25 reconstructed
+    cosine zenith bins.
+
+    Args:
+        nbins (int, optional): The nbins argument of create_json_binning. Defaults to 15, the
+        binning_ANTARES_16.json used by Chi2Profile/job.sh.
+
+    Returns:
+        dict: The bin edges of each axis of BINNING_AXES.
+    """
+    return {
+        "true_energy": np.geomspace(1, 10000, 121),
+        "true_cos_zenith": np.linspace(-1, 1, 41),
+        "reco_energy": np.append(np.round(np.geomspace(10, 100, nbins), 4), 20000),
+        "reco_cos_zenith": np.linspace(-1, 1, 26),
+    }
+
+def binning_from_json(json_file):
+    """
+    Read the grid of a SWIM binning file written by create_json_binning.
+
+    Args:
+        json_file (str): The path to the binning JSON file.
+
+    Returns:
+        dict: The bin edges of each axis of BINNING_AXES.
+    """
+    with open(json_file) as f:
+        binning = json.load(f)["binning"]
+
+    if binning.get("custom"):
+        reco_energy = np.asarray(binning["custom_EbinsReco"], dtype=np.float64)
+    else:
+        reco_energy = np.geomspace(binning["EminReco"], binning["EmaxReco"], binning["nEbinsReco"] + 1)
+
+    return {
+        "true_energy": np.geomspace(binning["EminTrue"], binning["EmaxTrue"], binning["nEbinsTrue"] + 1),
+        "true_cos_zenith": np.linspace(-1, 1, binning["ncosTbinsTrue"] + 1),
+        "reco_energy": reco_energy,
+        "reco_cos_zenith": np.linspace(-1, 1, binning["ncosTbinsReco"] + 1),
+    }
+
+class MigrationMatrix:
+    """
+    Normalised true-to-reconstructed migration matrix of the energy x cosine zenith histograms.
+
+    Entry (i, j) is the probability for an event of the true bin i to be reconstructed in the bin j, the bins being
+    flattened with the energy as the slow axis. Events reconstructed outside the reconstructed grid are lost, so a row
+    sums to the fraction of its events inside the grid.
+
+    Args:
+        matrix (sparse array): The (true bins, reconstructed bins) matrix.
+        binning (dict): The bin edges of each axis of BINNING_AXES.
+        config (dict, optional): The smearing options or the description of the source of the matrix. Defaults to None.
+    """
+    def __init__(self, matrix, binning, config=None):
+        self.matrix = sp.csr_array(matrix)
+        self.binning = {axis: np.asarray(binning[axis], dtype=np.float64) for axis in BINNING_AXES}
+        self.config = config or {}
+
+        if self.matrix.shape != (self.n_true, self.n_reco):
+            raise ValueError(f"The matrix has the shape {self.matrix.shape} instead of {(self.n_true, self.n_reco)} of the binning")
+
+    @property
+    def true_shape(self):
+        return (len(self.binning["true_energy"]) - 1, len(self.binning["true_cos_zenith"]) - 1)
+
+    @property
+    def reco_shape(self):
+        return (len(self.binning["reco_energy"]) - 1, len(self.binning["reco_cos_zenith"]) - 1)
+
+    @property
+    def n_true(self):
+        return self.true_shape[0] * self.true_shape[1]
+
+    @property
+    def n_reco(self):
+        return self.reco_shape[0] * self.reco_shape[1]
+
+    def apply(self, histogram):
+        """
+        Fold binned true histograms into reconstructed histograms with one sparse matrix product.
+
+        Args:
+            histogram (array): A (true energy, true cosine zenith) histogram, or a stack of them on the leading axes.
+
+        Raises:
+            ValueError: If the histogram does not have the true binning.
+
+        Returns:
+            array: The (reconstructed energy, reconstructed cosine zenith) histogram(s).
+        """
+        histogram = np.asarray(histogram, dtype=np.float64)
+        if histogram.shape[-2:] != self.true_shape:
+            raise ValueError(f"The histogram has the shape {histogram.shape[-2:]} instead of the true binning {self.true_shape}")
+
+        leading = histogram.shape[:-2]
+        flat = histogram.reshape(-1, self.n_true)
+        reco = (self.matrix.T @ flat.T).T
+        return reco.reshape(leading + self.reco_shape)
+
+    def save(self, path):
+        """
+        Save the matrix in a compressed .npz file, with its binning and configuration.
+        """
+        np.savez_compressed(
+            path,
+            data=self.matrix.data,
+            indices=self.matrix.indices,
+            indptr=self.matrix.indptr,
+            shape=np.asarray(self.matrix.shape),
+            config=json.dumps(self.config),
+            **self.binning,
+        )
+
+    @classmethod
+    def load(cls, path):
+        """
+        Load a matrix saved with save.
+        """
+        with np.load(path) as f:
+            matrix = sp.csr_array((f["data"], f["indices"], f["indptr"]), shape=tuple(f["shape"]))
+            return cls(matrix, {axis: f[axis] for axis in BINNING_AXES}, json.loads(str(f["config"])))
+
+def _normal_interval(low, high):
+    """
+    The probability of a standard normal variable to be in [low, high], evaluated in the precise tail.
+    """
+    upper_tail = low > 0
+    return np.where(upper_tail, ndtr(-low) - ndtr(-high), ndtr(high) - ndtr(low))
+
+def _truncated_bin_probabilities(mean, sigma, edges, low, high):
+    """
+    The probabilities of a Gaussian truncated to [low, high] to fall in each bin of edges, one row per mean.
+    """
+    mean = mean[:, None]
+    sigma = np.abs(sigma)[:, None]
+    edges = np.clip(edges, low, high)[None, :]
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        z = (edges - mean) / sigma
+        norm = _normal_interval((low - mean) / sigma, (high - mean) / sigma)
+        probabilities = _normal_interval(z[:, :-1], z[:, 1:]) / norm
+
+        # A zero sigma leaves the value unchanged
+        delta = ((edges[:, :-1] <= mean) & (mean < edges[:, 1:])).astype(np.float64)
+        probabilities = np.where(sigma > 0, probabilities, delta)
+    return np.nan_to_num(probabilities)
+
+def _sub_points(edges, n_points, log=False):
+    """
+    n_points points at the centres of equal sub-intervals of each bin, in log scale if log is True, one row per bin.
+    """
+    fractions = (np.arange(n_points) + 0.5) / n_points
+    if log:
+        low, high = np.log(edges[:-1]), np.log(edges[1:])
+        return np.exp(low[:, None] + (high - low)[:, None] * fractions)
+    return edges[:-1, None] + np.diff(edges)[:, None] * fractions
+
+def analytic_migration(config, binning=None, n_points=20, threshold=1e-8):
+    """
+    Build the migration matrix of a smearing configuration from the truncated Gaussians of SmearVariables (Smearing.cc).
+
+    The energy and the cosine zenith are smeared independently, their sigmas depending only on the energy and on the
+    cosine zenith, so the matrix is the Kronecker product of an energy and a cosine zenith migration matrix.
+    Each of them averages the truncated Gaussian bin probabilities over n_points points of the true bin (uniform
+    in log energy and in cosine zenith).
+
+    Args:
+        config (dict or str): The options of smearing_sigmas, or a level of level_config (e.g. "10", "antares_1.5_0.8").
+        binning (dict, optional): The bin edges of each axis of BINNING_AXES. Defaults to default_binning().
+        n_points (int, optional): The number of points averaged in each true bin. Defaults to 20.
+        threshold (float, optional): The probabilities below threshold are dropped from the sparse matrix. Defaults to 1e-8.
+
+    Returns:
+        MigrationMatrix: The migration matrix.
+    """
+    config = level_config(config) if isinstance(config, str) else dict(config)
+    binning = default_binning() if binning is None else binning
+
+    energy = _sub_points(np.asarray(binning["true_energy"], dtype=np.float64), n_points, log=True)
+    cos_zenith = _sub_points(np.asarray(binning["true_cos_zenith"], dtype=np.float64), n_points)
+
+    # The energy sigma only depends on the energy and the direction sigma on the cosine zenith
+    sigma_energy, _ = smearing_sigmas(energy.ravel(), np.zeros(energy.size), **config)
+    _, sigma_direction = smearing_sigmas(np.ones(cos_zenith.size), cos_zenith.ravel(), **config)
+
+    energy_matrix = _truncated_bin_probabilities(energy.ravel(), sigma_energy, np.asarray(binning["reco_energy"], dtype=np.float64),
+                                                 np.nextafter(0, 1), np.inf)
+    cos_matrix = _truncated_bin_probabilities(cos_zenith.ravel(), sigma_direction, np.asarray(binning["reco_cos_zenith"], dtype=np.float64),
+                                              -1, 1)
+
+    energy_matrix = energy_matrix.reshape(-1, n_points, energy_matrix.shape[1]).mean(axis=1)
+    cos_matrix = cos_matrix.reshape(-1, n_points, cos_matrix.shape[1]).mean(axis=1)
+    energy_matrix[energy_matrix < threshold] = 0
+    cos_matrix[cos_matrix < threshold] = 0
+
+    matrix = sp.kron(sp.csr_array(energy_matrix), sp.csr_array(cos_matrix), format="csr")
+    matrix.data[matrix.data < threshold] = 0
+    matrix.eliminate_zeros()
+    return MigrationMatrix(matrix, binning, {"method": "analytic", "n_points": n_points, **config})
+
+def _flat_bins(energy, cos_zenith, energy_edges, cos_edges):
+    """
+    The flattened energy x cosine zenith bin of each event, -1 outside the grid.
+    """
+    n_cos = len(cos_edges) - 1
+    energy_bins = np.searchsorted(energy_edges, energy, side="right") - 1
+    cos_bins = np.searchsorted(cos_edges, cos_zenith, side="right") - 1
+    # The last bins include their right edge, as in np.histogram
+    energy_bins[energy == energy_edges[-1]] = len(energy_edges) - 2
+    cos_bins[cos_zenith == cos_edges[-1]] = n_cos - 1
+
+    inside = (energy_bins >= 0) & (energy_bins < len(energy_edges) - 1) & (cos_bins >= 0) & (cos_bins < n_cos)
+    return np.where(inside, energy_bins * n_cos + cos_bins, -1)
+
+def migration_from_files(
+    root_files,
+    binning=None,
+    true_columns=INPUT_COLUMNS,
+    reco_columns=SMEARED_COLUMNS,
+    tree="sel",
+    chunksize=1_000_000,
+):
+    """
+    Build the migration matrix of smeared samples by counting their events, chunk by chunk.
+
+    Each row is normalised by the number of events of its true bin, including those reconstructed outside the grid.
+
+    Args:
+        root_files (str or list): The smeared ROOT file(s).
+        binning (dict, optional): The bin edges of each axis of BINNING_AXES. Defaults to default_binning().
+        true_columns (tuple, optional): The true energy and cosine zenith columns. Defaults to the inputs of the smearing.
+        reco_columns (tuple, optional): The smeared columns, e.g. ("energy_smeared_10", "cos_zenith_smeared_10")
+        for the files of smear_levels_rootfile in columns mode. Defaults to SMEARED_COLUMNS.
+        tree (str, optional): The name of the tree. Defaults to "sel".
+        chunksize (int, optional): The number of events counted at once. Defaults to 1_000_000.
+
+    Returns:
+        MigrationMatrix: The migration matrix.
+    """
+    if isinstance(root_files, str):
+        root_files = [root_files]
+    binning = default_binning() if binning is None else binning
+    edges = {axis: np.asarray(binning[axis], dtype=np.float64) for axis in BINNING_AXES}
+
+    n_true = (len(edges["true_energy"]) - 1) * (len(edges["true_cos_zenith"]) - 1)
+    n_reco = (len(edges["reco_energy"]) - 1) * (len(edges["reco_cos_zenith"]) - 1)
+    counts = np.zeros(n_true * n_reco, dtype=np.int64)
+    true_counts = np.zeros(n_true, dtype=np.int64)
+
+    num_entries = count_rootfile_entries(root_files, tree)
+    with stage("migration_from_files", rows_in=num_entries, files=len(root_files)):
+        chunks = iter_rootfile_chunks(root_files, list(true_columns) + list(reco_columns), tree, chunksize)
+        for chunk in tqdm(chunks, total=-(-num_entries // chunksize)):
+            true_bins = _flat_bins(chunk[true_columns[0]], chunk[true_columns[1]], edges["true_energy"], edges["true_cos_zenith"])
+            reco_bins = _flat_bins(chunk[reco_columns[0]], chunk[reco_columns[1]], edges["reco_energy"], edges["reco_cos_zenith"])
+
+            true_counts += np.bincount(true_bins[true_bins >= 0], minlength=n_true)
+            both = (true_bins >= 0) & (reco_bins >= 0)
+            counts += np.bincount(true_bins[both] * n_reco + reco_bins[both], minlength=n_true * n_reco)
+
+    matrix = sp.csr_array(counts.reshape(n_true, n_reco).astype(np.float64))
+    # Rows without events stay empty
+    matrix = sp.diags_array(1 / np.maximum(true_counts, 1)) @ matrix
+    return MigrationMatrix(sp.csr_array(matrix), binning, {"method": "files", "files": list(root_files),
+                                                           "true_columns": list(true_columns), "reco_columns": list(reco_columns)})
+
+def migration_label(level, asymmetry_energy=1.0, asymmetry_direction=1.0):
+    """
+    The label of a smearing level and its asymmetry factors, "<level>" without asymmetry and
+    "<level>_<direction factor>_<energy factor>" otherwise, with the factors written as in the
+    job scripts of Chi2Profile, e.g. "antares_0.9_1.0".
+
+    Note that Chi2Profile/job.sh only names the smeared files after their factors for the antares
+    level with a direction factor other than 1.0, the other jobs write ANTARES_Smeared_<level>.
+    """
+    if asymmetry_energy == 1.0 and asymmetry_direction == 1.0:
+        return str(level)
+    return f"{level}_{asymmetry_direction:.1f}_{asymmetry_energy:.1f}"
+
+def build_migration_matrices(
+    levels,
+    asymmetries=((1.0, 1.0),),
+    method="analytic",
+    binning=None,
+    path=None,
+    pattern=None,
+    output=None,
+    **kwargs,
+):
+    """
+    Build the migration matrix of each smearing level and each pair of asymmetry factors.
+
+    Args:
+        levels (list): The smearing levels of level_config.
+        asymmetries (list, optional): The (energy, direction) asymmetry factors. Defaults to ((1, 1),).
+        method (str, optional): "analytic" (analytic_migration) or "files" (migration_from_files). Defaults to "analytic".
+        binning (dict, optional): The bin edges of each axis of BINNING_AXES. Defaults to default_binning().
+        path (str, optional): The directory of the smeared files, for the "files" method. Defaults to None.
+        pattern (str, optional): The smeared file of a label, relative to path. Defaults to LEVEL_FILE_PATTERN.
+        output (str, optional): The directory where migration_<label>.npz are saved. Defaults to None (not saved).
+        **kwargs: Passed to analytic_migration or migration_from_files.
+
+    Raises:
+        ValueError: If the method is unknown or the "files" method has no path.
+
+    Returns:
+        dict: The MigrationMatrix of each label.
+    """
+    if method not in ("analytic", "files"):
+        raise ValueError(f"Unknown method {method}. The valid methods are 'analytic' and 'files'.")
+    if method == "files" and path is None:
+        raise ValueError("The 'files' method needs the directory of the smeared files.")
+    pattern = LEVEL_FILE_PATTERN if pattern is None else pattern
+    if output is not None:
+        os.makedirs(output, exist_ok=True)
+
+    matrices = {}
+    for level in levels:
+        for asymmetry_energy, asymmetry_direction in asymmetries:
+            label = migration_label(level, asymmetry_energy, asymmetry_direction)
+            with stage("build_migration_matrix", label=label, method=method):
+                if method == "analytic":
+                    migration = analytic_migration(level_config(level, asymmetry_energy, asymmetry_direction), binning, **kwargs)
+                else:
+                    migration = migration_from_files(os.path.join(path, pattern.format(label=label)), binning, **kwargs)
+                migration.config["label"] = label
+
+            if output is not None:
+                migration.save(os.path.join(output, f"migration_{label}.npz"))
+            matrices[label] = migration
+    return matrices
@@ -0,0 +1,191 @@
+import hashlib
+import json
+import os
+import pickle
+
+try:
+    from .cache import DEFAULT_CACHE_DIR, file_fingerprint, _remove
+except ImportError:
+    from cache import DEFAULT_CACHE_DIR, file_fingerprint, _remove
+
+DEFAULT_RESULT_DIR = os.environ.get("TAU_RESULT_CACHE_DIR", os.path.join(DEFAULT_CACHE_DIR, "results"))
+DEFAULT_RESULT_MAX_BYTES = int(os.environ.get("TAU_RESULT_CACHE_MAX_BYTES", 2 * 1024**3))
+
+def content_fingerprint(path, block_size=1 << 20):
+    """
+    Fingerprint of a file made of its absolute path and the SHA-1 of its content.
+
+    Args:
+        path (str): The path to the file.
+        block_size (int, optional): The size of the blocks read to hash the file. Defaults to 1 MB.
+
+    Returns:
+        list: [absolute path, SHA-1 of the content]
+    """
+    digest = hashlib.sha1()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return [os.path.abspath(path), digest.hexdigest()]
+
+class ResultCache:
+    """
+    On-disk memoization of the partial results of the summary scripts, one entry per input (a file, a run).
+
+    An entry is addressed by a name, the input files and the parameters of the computation, and records
+    the fingerprints of its input files (mtime and size, or the content hash) in a header pickled before
+    the result, so checking an entry never unpickles its result. A lookup whose inputs changed
+    is recomputed and overwrites the entry, so after a small change of the data only the partials of the
+    changed inputs are recomputed. Entries whose input files changed or disappeared are removed by evict_stale,
+    and the least recently used entries are removed when the cache grows beyond max_bytes.
+
+    Args:
+        cache_dir (str, optional): Directory of the cache. Defaults to $TAU_RESULT_CACHE_DIR or results/ in the column cache directory.
+        max_bytes (int, optional): Size cap of the cache in bytes. Defaults to $TAU_RESULT_CACHE_MAX_BYTES or 2 GB.
+        hash_contents (bool, optional): Fingerprint the input files by their content hash instead of their mtime and size. Defaults to False.
+    """
+    def __init__(self, cache_dir=None, max_bytes=None, hash_contents=False):
+        self.cache_dir = cache_dir if cache_dir is not None else DEFAULT_RESULT_DIR
+        self.max_bytes = max_bytes if max_bytes is not None else DEFAULT_RESULT_MAX_BYTES
+        self.hash_contents = hash_contents
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def _fingerprints(self, paths):
+        fingerprint = content_fingerprint if self.hash_contents else file_fingerprint
+        return [fingerprint(path) for path in paths]
+
+    def key(self, name, paths, **params):
+        """
+        Build the key of an entry from its name, input files and parameters (not from the state of the files).
+
+        Args:
+            name (str): The name of the computation, e.g. "flag_partials".
+            paths (str or list): The input file(s).
+            **params: Any parameter changing the result (e.g. the run id, the columns).
+
+        Returns:
+            str: The hexadecimal key of the entry.
+        """
+        if isinstance(paths, str):
+            paths = [paths]
+
+        description = {
+            "name": name,
+            "files": sorted(os.path.abspath(path) for path in paths),
+            "params": params,
+        }
+        return hashlib.sha1(json.dumps(description, sort_keys=True, default=str).encode()).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.pkl")
+
+    def _read(self, path, fingerprints=None):
+        """
+        Read the header of an entry, with its result if the fingerprints of its input files match fingerprints.
+        Entries that cannot be read, removed by another process or pickled by another version of the code, are None.
+        """
+        try:
+            with open(path, "rb") as f:
+                header = pickle.load(f)
+                if not isinstance(header, dict) or "fingerprints" not in header or "result" in header:
+                    return None
+                if fingerprints is None or header["fingerprints"] != fingerprints:
+                    return header
+                return dict(header, result=pickle.load(f))
+        except (OSError, EOFError, pickle.UnpicklingError, AttributeError, ImportError):
+            return None
+
+    def load(self, name, paths, compute, **params):
+        """
+        Serve a result from the cache if its input files did not change, or compute and store it.
+
+        Args:
+            name (str): The name of the computation.
+            paths (str or list): The input file(s) of the result.
+            compute (callable): Function without arguments computing the result when there is no valid entry.
+            **params: Any parameter changing the result.
+
+        Returns:
+            The cached or freshly computed result.
+        """
+        if isinstance(paths, str):
+            paths = [paths]
+
+        path = self._path(self.key(name, paths, **params))
+        fingerprints = self._fingerprints(paths)
+
+        entry = self._read(path, fingerprints)
+        if entry is not None and "result" in entry:
+            # The modification time of the entry is its last access time for the LRU eviction
+            try:
+                os.utime(path)
+            except FileNotFoundError:
+                pass
+            return entry["result"]
+
+        result = compute()
+
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            pickle.dump({"name": name, "paths": [os.path.abspath(p) for p in paths], "fingerprints": fingerprints},
+                        f, protocol=pickle.HIGHEST_PROTOCOL)
+            pickle.dump(result, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+
+        return result
+
+    def entries(self):
+        """
+        Return the cache entries as a list of (path, size, last access time), the least recently used first.
+        """
+        entries = []
+        for entry in os.scandir(self.cache_dir):
+            if entry.is_file() and entry.name.endswith(".pkl"):
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    # Evicted by another process in the meantime
+                    continue
+                entries.append((entry.path, stat.st_size, stat.st_mtime))
+        return sorted(entries, key=lambda entry: entry[2])
+
+    def evict_stale(self):
+        """
+        Remove the entries whose input files changed or disappeared, reading only their headers.
+
+        Returns:
+            int: The number of removed entries.
+        """
+        removed = 0
+        for path, _, _ in self.entries():
+            entry = self._read(path)
+            try:
+                stale = entry is None or self._fingerprints(entry["paths"]) != entry["fingerprints"]
+            except OSError:
+                stale = True
+
+            if stale:
+                _remove(path)
+                removed += 1
+        return removed
+
+    def evict(self):
+        """
+        Remove the stale entries, then the least recently used entries until the cache is below its size cap.
+        """
+        self.evict_stale()
+
+        entries = self.entries()
+        total = sum(size for _, size, _ in entries)
+        for path, size, _ in entries:
+            if total <= self.max_bytes:
+                break
+            _remove(path)
+            total -= size
+
+    def clear(self):
+        """
+        Remove every entry of the cache.
+        """
+        for path, _, _ in self.entries():
+            _remove(path)
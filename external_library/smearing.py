@@ -0,0 +1,439 @@
+import hashlib
+import json
+import os
+import numpy as np
+import uproot
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import ExitStack
+from functools import partial
+from scipy.special import ndtr, ndtri
+from tqdm import tqdm
+
+try:
+    from .file_management import iter_rootfile_chunks, count_rootfile_entries, _root_compression
+    from .instrumentation import stage
+except ImportError:
+    from file_management import iter_rootfile_chunks, count_rootfile_entries, _root_compression
+    from instrumentation import stage
+
+# Conversion of a full width at half maximum to the standard deviation of a Gaussian
+FWHM_TO_SIGMA = 1 / (2 * np.sqrt(2 * np.log(2)))
+
+# Parameters (a, b, c, d) of the ANTARES resolution function a / (b * x + c) + d of Smearing.cc
+ANTARES_RESOLUTION = {
+    "energy": (-640.34, -5.88, -20.44, -0.41),
+    "direction": (-21352.43, -561954.61, -556675.55, 0.09),
+}
+
+# Constant FWHM of the energy and of the cosine of the zenith angle of the ORCA detectors
+DETECTOR_FWHM = {
+    "ORCA6": (0.6, 0.2),
+    "ORCA115": (0.2, 0.1),
+}
+DETECTORS = ["ANTARES"] + list(DETECTOR_FWHM)
+
+# Lower bound of the direction sigma, applied after the asymmetry factor as in Smearing.cc
+SIGMA_DIR_FLOOR = 0.001
+
+# Columns read and written by Smearing.cc
+INPUT_COLUMNS = ("energy_recoTrue", "cos_zenith_recoTrue")
+SMEARED_COLUMNS = ("energy_smeared", "cos_zenith_smeared")
+
+# Smearing levels of the campaigns of submit-all.sh and Chi2Profile
+SMEARING_LEVELS = ["10", "30", "50", "70", "90", "100", "200", "500", "antares", "orca6", "orca115"]
+
+# Output file of each level, relative to the output directory, as in Chi2Profile/job.sh
+LEVEL_FILE_PATTERN = os.path.join("ANTARES_Smeared_{label}", "antares_smeared_{label}.root")
+
+def resolution_function(param, a, b, c, d):
+    """
+    The resolution function of Smearing.cc: a / (b * param + c) + d.
+    """
+    return a / (b * param + c) + d
+
+def smearing_sigmas(
+    energy,
+    cos_zenith,
+    smear_level=0.0,
+    use_resolution=False,
+    asymmetry_energy=1.0,
+    asymmetry_direction=1.0,
+    detector="ANTARES",
+):
+    """
+    The Gaussian widths of the energy and cosine zenith smearing of each event, as in SmearVariables of Smearing.cc.
+
+    The FWHM is the ANTARES resolution function (use_resolution), a fraction smear_level of the value itself, or
+    the constant of an ORCA detector. It is converted to a sigma and multiplied by the asymmetry factor. The direction
+    sigma is then raised to at least 0.001, so a negative sigma (e.g. smear_level * cos_zenith for a downgoing event)
+    becomes 0.001, while the energy sigma keeps its sign, which does not change the distribution of the draws.
+
+    Args:
+        energy (array): The energies.
+        cos_zenith (array): The cosines of the zenith angle.
+        smear_level (float, optional): The smearing fraction (0.1 for 10 %), unused with the resolution function. Defaults to 0.
+        use_resolution (bool, optional): Use the ANTARES resolution function. Defaults to False.
+        asymmetry_energy (float, optional): The asymmetry factor of the energy sigma. Defaults to 1.
+        asymmetry_direction (float, optional): The asymmetry factor of the direction sigma. Defaults to 1.
+        detector (str, optional): "ANTARES", "ORCA6" or "ORCA115". Defaults to "ANTARES".
+
+    Raises:
+        ValueError: If the detector is unknown.
+
+    Returns:
+        tuple: The energy and direction sigmas.
+    """
+    energy = np.asarray(energy, dtype=np.float64)
+    cos_zenith = np.asarray(cos_zenith, dtype=np.float64)
+
+    if detector == "ANTARES":
+        if use_resolution:
+            fwhm_en = resolution_function(energy, *ANTARES_RESOLUTION["energy"])
+            fwhm_dir = resolution_function(cos_zenith, *ANTARES_RESOLUTION["direction"])
+        else:
+            fwhm_en = smear_level * energy
+            fwhm_dir = smear_level * cos_zenith
+    elif detector in DETECTOR_FWHM:
+        fwhm_en = np.full(energy.shape, DETECTOR_FWHM[detector][0])
+        fwhm_dir = np.full(cos_zenith.shape, DETECTOR_FWHM[detector][1])
+    else:
+        raise ValueError(f"Unknown detector {detector}. The valid detectors are: {', '.join(DETECTORS)}")
+
+    sigma_en = fwhm_en * FWHM_TO_SIGMA * asymmetry_energy
+    sigma_dir = np.maximum(fwhm_dir * FWHM_TO_SIGMA * asymmetry_direction, SIGMA_DIR_FLOOR)
+    return sigma_en, sigma_dir
+
+def truncated_normal(rng, mean, sigma, low=-np.inf, high=np.inf):
+    """
+    Draw one value per event from a Gaussian truncated to [low, high], by inverse transform sampling.
+
+    This has the distribution of the rejection loops of Smearing.cc (draw until the value is in the range) with a
+    single uniform draw per event, whatever the fraction of the Gaussian in the range. When the mean is below the range
+    the draw is done on the mirrored Gaussian, so the CDF is evaluated in its precise lower tail.
+
+    Args:
+        rng (np.random.Generator): The random generator.
+        mean (array): The means.
+        sigma (array): The standard deviations. Negative values act as their absolute value, zero returns the mean.
+        low (float or array, optional): The lower bounds. Defaults to -inf.
+        high (float or array, optional): The upper bounds. Defaults to inf.
+
+    Returns:
+        array: The draws.
+    """
+    mean = np.asarray(mean, dtype=np.float64)
+    sigma = np.abs(np.broadcast_to(np.asarray(sigma, dtype=np.float64), mean.shape))
+    low = np.broadcast_to(np.asarray(low, dtype=np.float64), mean.shape)
+    high = np.broadcast_to(np.asarray(high, dtype=np.float64), mean.shape)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        alpha = (low - mean) / sigma
+        beta = (high - mean) / sigma
+
+        # Mirror the events whose range is above the mean
+        mirror = alpha > 0
+        lower = np.where(mirror, -beta, alpha)
+        upper = np.where(mirror, -alpha, beta)
+
+        cdf_lower = ndtr(lower)
+        z = ndtri(cdf_lower + rng.random(mean.shape) * (ndtr(upper) - cdf_lower))
+        z = np.where(mirror, -z, z)
+
+        values = np.where(sigma > 0, mean + sigma * z, mean)
+
+    # Guard the bounds against the rounding of the inverse CDF
+    return np.clip(values, low, high)
+
+def smear_arrays(energy, cos_zenith, rng, **config):
+    """
+    Smear the energies and the cosines of the zenith angle of a chunk of events.
+
+    The energies are drawn from Gaussians truncated to positive values and the cosines from Gaussians truncated
+    to [-1, 1], with the sigmas of smearing_sigmas.
+
+    Args:
+        energy (array): The energies.
+        cos_zenith (array): The cosines of the zenith angle.
+        rng (np.random.Generator): The random generator.
+        **config: The options of smearing_sigmas (smear_level, use_resolution, asymmetry factors, detector).
+
+    Returns:
+        tuple: The smeared energies and cosines of the zenith angle.
+    """
+    sigma_en, sigma_dir = smearing_sigmas(energy, cos_zenith, **config)
+
+    # The energy must be strictly positive, as in Smearing.cc
+    energy_smeared = truncated_normal(rng, energy, sigma_en, low=np.nextafter(0, 1))
+    cos_zenith_smeared = truncated_normal(rng, cos_zenith, sigma_dir, low=-1, high=1)
+    return energy_smeared, cos_zenith_smeared
+
+def smear_chunk(chunk, rng, input_columns=INPUT_COLUMNS, output_columns=SMEARED_COLUMNS, **config):
+    """
+    Add the smeared columns to a chunk of events (a dictionary of arrays, e.g. from iter_rootfile_chunks, or a DataFrame).
+
+    Args:
+        chunk (dict or pd.DataFrame): The events.
+        rng (np.random.Generator): The random generator.
+        input_columns (tuple, optional): The energy and cosine zenith columns to smear. Defaults to INPUT_COLUMNS.
+        output_columns (tuple, optional): The smeared columns. Defaults to SMEARED_COLUMNS.
+        **config: The options of smearing_sigmas.
+
+    Returns:
+        dict or pd.DataFrame: The chunk with the smeared columns.
+    """
+    energy_smeared, cos_zenith_smeared = smear_arrays(np.asarray(chunk[input_columns[0]]), np.asarray(chunk[input_columns[1]]), rng, **config)
+    chunk[output_columns[0]] = energy_smeared
+    chunk[output_columns[1]] = cos_zenith_smeared
+    return chunk
+
+def _key_words(text):
+    """
+    Four 32-bit words of the SHA-1 of a string, used in the spawn key of a SeedSequence.
+    """
+    digest = hashlib.sha1(text.encode()).digest()
+    return tuple(int.from_bytes(digest[i:i+4], "little") for i in range(0, 16, 4))
+
+def config_key(config):
+    """
+    The canonical description of the options of smearing_sigmas, identical for equivalent levels (e.g. "10" and "10_percent").
+    """
+    options = dict(smear_level=0.0, use_resolution=False, detector="ANTARES", asymmetry_energy=1.0, asymmetry_direction=1.0)
+    options.update(config)
+    options = {key: float(value) if key.startswith(("smear", "asym")) else value for key, value in options.items()}
+    return json.dumps(options, sort_keys=True)
+
+def chunk_rng(seed, file_key, entry_start, entry_stop, config):
+    """
+    The random generator of one chunk of events at one smearing level.
+
+    Its stream is spawned from the master seed with a key made of the file, the entry range of the chunk and the
+    smearing options, so every chunk has its own independent stream and the smeared values do not depend on
+    the number of workers, the order in which the chunks are processed or the other levels smeared in the same pass.
+
+    Args:
+        seed (int): The master seed.
+        file_key (str): The key of the input file, its name by default, so a copied or moved file gives the same sample.
+        entry_start (int): The first entry of the chunk.
+        entry_stop (int): The entry after the last entry of the chunk.
+        config (dict): The options of smearing_sigmas.
+
+    Returns:
+        np.random.Generator: The random generator of the chunk.
+    """
+    spawn_key = _key_words(file_key) + (entry_start, entry_stop) + _key_words(config_key(config))
+    return np.random.default_rng(np.random.SeedSequence(seed, spawn_key=spawn_key))
+
+def smear_levels_chunk(energy, cos_zenith, configs, seed, file_key, entry_start, entry_stop):
+    """
+    Smear a chunk of events at every level, each with the stream of chunk_rng.
+
+    Returns:
+        dict: The smeared energies and cosines of the zenith angle of each level.
+    """
+    return {label: smear_arrays(energy, cos_zenith, chunk_rng(seed, file_key, entry_start, entry_stop, config), **config)
+            for label, config in configs.items()}
+
+def smear_entry_range(entry_range, input_file, configs, seed, file_key, tree="sel"):
+    """
+    Read the energy_recoTrue and cos_zenith_recoTrue entries of a range and smear them at every level, in a worker process.
+    """
+    start, stop = entry_range
+    with uproot.open(input_file) as f:
+        chunk = f[tree].arrays(list(INPUT_COLUMNS), library="np", entry_start=start, entry_stop=stop)
+    return smear_levels_chunk(chunk[INPUT_COLUMNS[0]], chunk[INPUT_COLUMNS[1]], configs, seed, file_key, start, stop)
+
+def _ordered_results(func, items, n_workers):
+    """
+    Map a function over items in a process pool, yielding the results in the order of the items
+    with at most two pending items per worker, so the results never pile up in memory.
+    """
+    with ProcessPoolExecutor(max_workers=n_workers) as executor:
+        pending = deque()
+        for item in items:
+            pending.append(executor.submit(func, item))
+            if len(pending) >= 2 * n_workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+def smear_rootfile(
+    input_file,
+    output_file,
+    smear_level=0.0,
+    use_resolution=False,
+    detector="ANTARES",
+    asymmetry_energy=1.0,
+    asymmetry_direction=1.0,
+    seed=None,
+    tree="sel",
+    chunksize=1_000_000,
+    compression=None,
+    n_workers=1,
+):
+    """
+    Copy the tree of a ROOT file with the energy_smeared and cos_zenith_smeared columns, like Smearing.cc.
+
+    The file is read and written chunk by chunk and each chunk is smeared at once, with the random streams of chunk_rng:
+    for a given seed and chunksize the output is the same as the level in smear_levels_rootfile, whatever n_workers.
+
+    Args:
+        input_file (str): The path to the input ROOT file, with the energy_recoTrue and cos_zenith_recoTrue branches.
+        output_file (str): The path to the output ROOT file.
+        smear_level (float, optional): The smearing fraction (0.1 for 10 %). Defaults to 0.
+        use_resolution (bool, optional): Use the ANTARES resolution function. Defaults to False.
+        detector (str, optional): "ANTARES", "ORCA6" or "ORCA115". Defaults to "ANTARES".
+        asymmetry_energy (float, optional): The asymmetry factor of the energy sigma. Defaults to 1.
+        asymmetry_direction (float, optional): The asymmetry factor of the direction sigma. Defaults to 1.
+        seed (int, optional): The master seed. Defaults to None (fresh entropy, printed to reproduce the sample).
+        tree (str, optional): The name of the tree. Defaults to "sel".
+        chunksize (int, optional): The number of events smeared at once. Defaults to 1_000_000.
+        compression (str, optional): The compression codec of the output file. Defaults to None (zlib).
+        n_workers (int, optional): The number of worker processes smearing the chunks. Defaults to 1.
+
+    Returns:
+        int: The number of smeared events.
+    """
+    config = dict(smear_level=smear_level, use_resolution=use_resolution, detector=detector,
+                  asymmetry_energy=asymmetry_energy, asymmetry_direction=asymmetry_direction)
+    smear_levels_rootfile(input_file, {"level": config}, os.path.dirname(output_file) or ".", pattern=os.path.basename(output_file),
+                          seed=seed, tree=tree, chunksize=chunksize, compression=compression, n_workers=n_workers)
+    return count_rootfile_entries(output_file, tree)
+
+def level_config(level, asymmetry_energy=1.0, asymmetry_direction=1.0):
+    """
+    The options of smearing_sigmas of a smearing level of the campaign scripts, as chosen in Chi2Profile/job.sh.
+
+    Args:
+        level (str): A percentage ("10" or "10_percent"), "antares" (resolution function), "orca6" or "orca115".
+        "antares_<direction factor>_<energy factor>" sets the asymmetry factors, as in the names of the smeared files.
+        asymmetry_energy (float, optional): The asymmetry factor of the energy sigma. Defaults to 1.
+        asymmetry_direction (float, optional): The asymmetry factor of the direction sigma. Defaults to 1.
+
+    Raises:
+        ValueError: If the level is not recognised.
+
+    Returns:
+        dict: The options of smearing_sigmas.
+    """
+    level = str(level).lower()
+    if level.startswith("antares_"):
+        asymmetry_direction, asymmetry_energy = (float(factor) for factor in level.split("_")[1:3])
+        level = "antares"
+
+    config = dict(smear_level=0.0, use_resolution=False, detector="ANTARES",
+                  asymmetry_energy=asymmetry_energy, asymmetry_direction=asymmetry_direction)
+    if level == "antares":
+        config["use_resolution"] = True
+    elif level.upper() in DETECTOR_FWHM:
+        config["detector"] = level.upper()
+    else:
+        try:
+            config["smear_level"] = float(level.removesuffix("_percent")) / 100
+        except ValueError:
+            raise ValueError(f"Invalid smearing level {level}. The valid levels are percentages, 'antares', 'antares_<dir>_<energy>', 'orca6' and 'orca115'.")
+    return config
+
+def smear_levels_rootfile(
+    input_file,
+    levels,
+    output,
+    mode="files",
+    pattern=LEVEL_FILE_PATTERN,
+    seed=None,
+    tree="sel",
+    chunksize=1_000_000,
+    compression=None,
+    n_workers=1,
+    file_key=None,
+):
+    """
+    Smear a ROOT file at several levels in a single pass: each chunk of the input is read once and smeared at every level.
+
+    In "files" mode every level is written to its own copy of the tree (output/pattern), as Smearing.cc would write it.
+    In "columns" mode a single file (output) holds the input tree and one pair of columns per level,
+    energy_smeared_<label> and cos_zenith_smeared_<label>.
+
+    Each chunk and level is smeared with its own random stream (chunk_rng), derived from the master seed, the file key,
+    the entry range and the smearing options. The chunks can be smeared by worker processes while this process
+    writes them in order, and for a given seed and chunksize the output is bit-identical whatever n_workers.
+
+    Args:
+        input_file (str): The path to the input ROOT file, with the energy_recoTrue and cos_zenith_recoTrue branches.
+        levels (list or dict): The levels of level_config (e.g. ["10", "50", "antares"]), or a dictionary of
+        labels and options of smearing_sigmas.
+        output (str): The output directory in "files" mode, the output file in "columns" mode.
+        mode (str, optional): "files" or "columns". Defaults to "files".
+        pattern (str, optional): The path of the file of each level in the output directory, formatted with the label.
+        Defaults to LEVEL_FILE_PATTERN.
+        seed (int, optional): The master seed. Defaults to None (fresh entropy, printed to reproduce the sample).
+        tree (str, optional): The name of the tree. Defaults to "sel".
+        chunksize (int, optional): The number of events smeared at once. Defaults to 1_000_000.
+        compression (str, optional): The compression codec of the output files. Defaults to None (zlib).
+        n_workers (int, optional): The number of worker processes smearing the chunks. Defaults to 1.
+        file_key (str, optional): The key of the input file in the random streams. Defaults to None (the file name).
+
+    Raises:
+        ValueError: If the mode is invalid.
+
+    Returns:
+        dict: The output file of each level.
+    """
+    if mode not in ("files", "columns"):
+        raise ValueError("Invalid mode. The valid modes are 'files' and 'columns'.")
+
+    configs = levels if isinstance(levels, dict) else {str(level): level_config(level) for level in levels}
+    if seed is None:
+        seed = np.random.SeedSequence().entropy
+        print(f"Master seed of the smearing: {seed}")
+    if file_key is None:
+        file_key = os.path.basename(input_file)
+
+    if mode == "files":
+        paths = {label: os.path.join(output, pattern.format(label=label)) for label in configs}
+    else:
+        paths = {label: output for label in configs}
+
+    num_entries = count_rootfile_entries(input_file, tree)
+    ranges = [(start, min(start + chunksize, num_entries)) for start in range(0, num_entries, chunksize)]
+
+    # The worker processes only read and smear the input columns, this process copies the tree
+    smeared_chunks = None
+    if n_workers > 1:
+        smeared_chunks = _ordered_results(partial(smear_entry_range, input_file=input_file, configs=configs, seed=seed,
+                                                  file_key=file_key, tree=tree), ranges, n_workers)
+
+    with stage("smear_levels_rootfile", rows_in=num_entries, file=input_file, levels=len(configs), mode=mode, n_workers=n_workers) as current, ExitStack() as files:
+        for path in set(paths.values()):
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        outputs = {path: files.enter_context(uproot.recreate(path, compression=_root_compression(compression, None)))
+                   for path in set(paths.values())}
+        trees = {}
+
+        chunks = iter_rootfile_chunks(input_file, tree=tree, chunksize=chunksize)
+        for (start, stop), chunk in tqdm(zip(ranges, chunks), total=len(ranges)):
+            if smeared_chunks is not None:
+                smeared = next(smeared_chunks)
+            else:
+                smeared = smear_levels_chunk(chunk[INPUT_COLUMNS[0]], chunk[INPUT_COLUMNS[1]], configs, seed, file_key, start, stop)
+
+            if mode == "files":
+                branches = {label: {**chunk, SMEARED_COLUMNS[0]: values[0], SMEARED_COLUMNS[1]: values[1]}
+                            for label, values in smeared.items()}
+            else:
+                columns = dict(chunk)
+                for label, values in smeared.items():
+                    columns[f"{SMEARED_COLUMNS[0]}_{label}"] = values[0]
+                    columns[f"{SMEARED_COLUMNS[1]}_{label}"] = values[1]
+                branches = {label: columns for label in list(configs)[:1]}
+
+            for label, columns in branches.items():
+                path = paths[label]
+                # mktree makes sure a TTree is written, as expected by SWIM
+                if path not in trees:
+                    trees[path] = outputs[path].mktree(tree, {column: values.dtype for column, values in columns.items()})
+                trees[path].extend(columns)
+
+        current.rows_out = num_entries
+
+    return paths
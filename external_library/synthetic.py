@@ -0,0 +1,336 @@
+import argparse
+import os
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+from tqdm import tqdm
+
+try:
+    from .file_management import export_dataframe_to_rootfile, HDF5_DATA_COLUMNS
+    from .instrumentation import stage
+except ImportError:
+    from file_management import export_dataframe_to_rootfile, HDF5_DATA_COLUMNS
+    from instrumentation import stage
+
+# PDG codes of the flavours of the --mix option
+FLAVOURS = {"nue": 12, "numu": 14, "nutau": 16}
+DEFAULT_MIX = {"nue": 0.3, "numu": 0.5, "nutau": 0.2}
+
+# Fraction of the tau CC events decaying into a muon (track, interaction_type 2), the others give showers (interaction_type 3)
+TAU_TO_MU_FRACTION = 0.174
+
+FLAG_EFFICIENCIES = {
+    "aafit_flag": 0.85,
+    "bbfit_flag": 0.9,
+    "gridfit_flag": 0.8,
+    "showerdusj_flag": 0.6,
+    "bbfit_shower_flag": 0.7,
+}
+
+# NNFit columns of the HDF5 files, with the AntDST names of the join keys
+NNFIT_RENAME = {"Frame": "EventID", "TriggCounter": "TrigCount"}
+NNFIT_COLUMNS = ["RunID", "Frame", "TriggCounter", "Type", "energy_true", "cos_zenith_true",
+                 "NNFitTrack_Theta", "NNFitShower_Theta", "NNFitShower_Energy", "NNFit_Bjorken_y"]
+
+def parse_mix(mix):
+    """
+    Parse a flavour mix like "nue=0.3,numu=0.5,nutau=0.2" into normalised probabilities.
+    """
+    if isinstance(mix, dict):
+        fractions = dict(mix)
+    else:
+        fractions = {}
+        for item in mix.split(","):
+            name, value = item.split("=")
+            fractions[name.strip()] = float(value)
+
+    unknown = [name for name in fractions if name not in FLAVOURS]
+    if unknown:
+        raise ValueError(f"Unknown flavours {unknown}. The valid flavours are: {', '.join(FLAVOURS)}")
+
+    total = sum(fractions.values())
+    return {name: value / total for name, value in fractions.items()}
+
+def run_event_counts(n_events, run_range, seed=0):
+    """
+    Distribute the events uniformly over the runs of a run-id range.
+
+    Args:
+        n_events (int): The total number of events.
+        run_range (tuple): The first and last run id (included).
+        seed (int, optional): The master seed. Defaults to 0.
+
+    Returns:
+        tuple: The run ids and their number of events.
+    """
+    run_ids = np.arange(run_range[0], run_range[1] + 1)
+    rng = np.random.default_rng(np.random.SeedSequence(seed, spawn_key=(0,)))
+    return run_ids, rng.multinomial(n_events, np.full(len(run_ids), 1 / len(run_ids)))
+
+def generate_events(run_ids, counts, rng, mix=DEFAULT_MIX, anti_fraction=0.4, cc_fraction=0.7):
+    """
+    Generate the events of consecutive runs with the columns of the AntDST sel trees.
+
+    The (RunID, Frame, TriggCounter) keys are unique and sorted, as in the AntDST summaries.
+
+    Args:
+        run_ids (array): The run ids.
+        counts (array): The number of events of each run.
+        rng (np.random.Generator): The random generator.
+        mix (dict, optional): The fraction of each flavour. Defaults to DEFAULT_MIX.
+        anti_fraction (float, optional): The fraction of antineutrinos. Defaults to 0.4.
+        cc_fraction (float, optional): The fraction of CC interactions. Defaults to 0.7.
+
+    Returns:
+        dict: A dictionary of NumPy arrays, one per column.
+    """
+    n_events = int(counts.sum())
+    index = np.arange(n_events)
+    run_id = np.repeat(run_ids, counts).astype(np.int32)
+    run_start = np.repeat(np.cumsum(counts) - counts, counts)
+
+    # Frames sorted within each run, the trigger counter numbers the events of a frame
+    frame = rng.integers(0, 10 * np.maximum(np.repeat(counts, counts), 1), dtype=np.int64)
+    frame = frame[np.lexsort((frame, run_id))].astype(np.int32)
+    new_frame = np.ones(n_events, dtype=bool)
+    new_frame[1:] = (frame[1:] != frame[:-1]) | (run_id[1:] != run_id[:-1])
+    trigg_counter = (index - np.maximum.accumulate(np.where(new_frame, index, 0))).astype(np.int32)
+
+    mix = parse_mix(mix)
+    pdg = rng.choice([FLAVOURS[name] for name in mix], n_events, p=list(mix.values()))
+    pdg = np.where(rng.random(n_events) < anti_fraction, -pdg, pdg).astype(np.int32)
+
+    is_cc = rng.random(n_events) < cc_fraction
+    tau_decay = np.where(rng.random(n_events) < TAU_TO_MU_FRACTION, 2, 3)
+    interaction_type = np.where(is_cc, np.where(np.abs(pdg) == 16, tau_decay, 1), 0).astype(np.int32)
+
+    energy = 10 ** rng.uniform(0, 4, n_events)
+    cos_zenith = rng.uniform(-1, 1, n_events)
+    bjorken_y = rng.beta(1, 2, n_events)
+
+    def smear_energy(sigma):
+        return energy * rng.lognormal(0, sigma, n_events)
+
+    def smear_cos(sigma):
+        return np.clip(cos_zenith + rng.normal(0, sigma, n_events), -1, 1)
+
+    events = {
+        "RunID": run_id,
+        "run_id": run_id,
+        "EventID": (index - run_start).astype(np.int64),
+        "TriggCounter": trigg_counter,
+        "Frame": frame,
+        "Type": pdg,
+        "type": pdg,
+        "interaction_type": interaction_type,
+        "is_cc": is_cc,
+        "energy_true": energy,
+        "cos_zenith_true": cos_zenith,
+        "energy_recoTrue": smear_energy(0.3),
+        "cos_zenith_recoTrue": smear_cos(0.05),
+        "bjorken_y_recoTrue": bjorken_y,
+        "energy_aafit_dEdX_CEA": smear_energy(0.6),
+        "energy_aafit_ANN_ECAP": smear_energy(0.5),
+        "aafit_cos_zenith": smear_cos(0.1),
+        "aafit_bjy": np.clip(bjorken_y + rng.normal(0, 0.2, n_events), 0, 1),
+        "NNFitShower_Energy": smear_energy(0.4),
+        "NNFitShower_cos_zenith": smear_cos(0.15),
+        "NNFit_Bjorken_y": np.clip(bjorken_y + rng.normal(0, 0.15, n_events), 0, 1),
+    }
+    for flag, efficiency in FLAG_EFFICIENCIES.items():
+        events[flag] = rng.random(n_events) < efficiency
+    return events
+
+def nnfit_reconstructions(events, rng, efficiency=0.9):
+    """
+    Select the events reconstructed by NNFit and return them with the columns of the NNFit HDF5 files.
+    """
+    selected = rng.random(len(events["RunID"])) < efficiency
+    n_selected = int(selected.sum())
+    theta = np.arccos(np.clip(events["NNFitShower_cos_zenith"][selected], -1, 1))
+
+    df = pd.DataFrame({column: events[column][selected] for column in NNFIT_COLUMNS if column in events})
+    df["NNFitTrack_Theta"] = np.where(rng.random(n_selected) < 0.3, np.nan, theta)
+    df["NNFitShower_Theta"] = np.where(rng.random(n_selected) < 0.1, np.nan, theta)
+    df["NNFitShower_Energy"] = events["NNFitShower_Energy"][selected]
+    df["NNFit_Bjorken_y"] = events["NNFit_Bjorken_y"][selected]
+    return df[NNFIT_COLUMNS].rename(columns=NNFIT_RENAME)
+
+def _write_nnfit(df, path, hdf5_format):
+    if hdf5_format == "table":
+        df.to_hdf(path, key="df", mode="w", format="table",
+                  data_columns=[column for column in HDF5_DATA_COLUMNS if column in df.columns])
+    else:
+        df.to_hdf(path, key="df", mode="w")
+
+def _chunk_runs(counts, runs_per_file, chunksize):
+    """
+    Group the runs into chunks of about chunksize events, made of whole groups of runs_per_file runs.
+    """
+    chunks, start, size = [], 0, 0
+    for group_start in range(0, len(counts), runs_per_file):
+        group_size = int(counts[group_start:group_start + runs_per_file].sum())
+        if size and size + group_size > chunksize:
+            chunks.append((start, group_start))
+            start, size = group_start, 0
+        size += group_size
+    if start < len(counts):
+        chunks.append((start, len(counts)))
+    return chunks
+
+def write_file(
+    file_index,
+    run_ids,
+    counts,
+    root_dir,
+    name,
+    nnfit_dir=None,
+    identifier="numu",
+    seed=0,
+    chunksize=1_000_000,
+    runs_per_file=1,
+    hdf5_format="fixed",
+    mix=DEFAULT_MIX,
+    compression=None,
+):
+    """
+    Write the events of a block of runs into one ROOT file, and their NNFit reconstructions into HDF5 files.
+
+    The events are generated chunk by chunk, each chunk with its own random stream spawned from (seed, file index, chunk index),
+    so the output does not depend on the number of worker processes.
+
+    Args:
+        file_index (int): The index of the ROOT file.
+        run_ids (array): The run ids of the file.
+        counts (array): The number of events of each run.
+        root_dir (str): The directory of the ROOT file.
+        name (str): The name of the ROOT file.
+        nnfit_dir (str, optional): The directory of the NNFit files. Defaults to None (no NNFit files).
+        identifier (str, optional): The identifier in the names of the NNFit files, e.g. "numu" or "tau". Defaults to "numu".
+        seed (int, optional): The master seed. Defaults to 0.
+        chunksize (int, optional): The number of events generated at once. Defaults to 1_000_000.
+        runs_per_file (int, optional): The number of runs of each NNFit file. Defaults to 1.
+        hdf5_format (str, optional): The format of the NNFit files, "fixed" or "table". Defaults to "fixed".
+        mix (dict, optional): The fraction of each flavour. Defaults to DEFAULT_MIX.
+        compression (str, optional): The compression codec of the ROOT file. Defaults to None (zlib).
+
+    Returns:
+        int: The number of events written.
+    """
+    def chunks():
+        for chunk_index, (start, stop) in enumerate(_chunk_runs(counts, runs_per_file, chunksize)):
+            rng = np.random.default_rng(np.random.SeedSequence(seed, spawn_key=(1, file_index, chunk_index)))
+            events = generate_events(run_ids[start:stop], counts[start:stop], rng, mix=mix)
+
+            if nnfit_dir is not None:
+                df_nnfit = nnfit_reconstructions(events, rng)
+                # The events are sorted by run, so each group of runs is a slice of the reconstructions
+                group_starts = run_ids[start:stop:runs_per_file]
+                bounds = np.append(np.searchsorted(df_nnfit["RunID"].to_numpy(), group_starts), len(df_nnfit))
+                for first_run, low, high in zip(group_starts, bounds[:-1], bounds[1:]):
+                    _write_nnfit(df_nnfit.iloc[low:high].reset_index(drop=True),
+                                 os.path.join(nnfit_dir, f"nnfit_{identifier}_{first_run}.hdf5"), hdf5_format)
+
+            yield events
+
+    export_dataframe_to_rootfile(chunks(), name, tree="sel", path=root_dir, compression=compression)
+    return int(counts.sum())
+
+def generate_sample(
+    output,
+    n_events,
+    run_range=(30000, 90000),
+    n_files=1,
+    name="synthetic_sample",
+    sub_path="cut_selection/low_energy",
+    identifier="numu",
+    nnfit=True,
+    seed=0,
+    chunksize=1_000_000,
+    runs_per_file=1,
+    hdf5_format="fixed",
+    mix=DEFAULT_MIX,
+    compression=None,
+    n_workers=1,
+):
+    """
+    Generate a synthetic ANTARES-like sample with the layout of the analysis directories: the ROOT sel trees
+    in output/sub_path and the NNFit HDF5 files in output/nnfit_reco.
+
+    The runs are split into n_files contiguous blocks, one ROOT file each, written in parallel by n_workers processes.
+    Each file is generated chunk by chunk, so the memory stays bounded for samples of 10^8 events.
+
+    Args:
+        output (str): The output directory.
+        n_events (int): The total number of events.
+        run_range (tuple, optional): The first and last run id (included). Defaults to (30000, 90000).
+        n_files (int, optional): The number of ROOT files. Defaults to 1.
+        name (str, optional): The name of the ROOT files (without extension), numbered when n_files > 1. Defaults to "synthetic_sample".
+        sub_path (str, optional): The directory of the ROOT files in the output directory. Defaults to "cut_selection/low_energy".
+        identifier (str, optional): The identifier in the names of the NNFit files. Defaults to "numu".
+        nnfit (bool, optional): Write the NNFit HDF5 files. Defaults to True.
+        seed (int, optional): The master seed. Defaults to 0.
+        chunksize (int, optional): The number of events generated at once. Defaults to 1_000_000.
+        runs_per_file (int, optional): The number of runs of each NNFit file. Defaults to 1.
+        hdf5_format (str, optional): The format of the NNFit files, "fixed" or "table". Defaults to "fixed".
+        mix (dict or str, optional): The fraction of each flavour, e.g. "nue=0.3,numu=0.5,nutau=0.2". Defaults to DEFAULT_MIX.
+        compression (str, optional): The compression codec of the ROOT files. Defaults to None (zlib).
+        n_workers (int, optional): The number of worker processes. Defaults to 1.
+
+    Returns:
+        list: The paths of the ROOT files.
+    """
+    mix = parse_mix(mix)
+
+    root_dir = os.path.join(output, sub_path)
+    nnfit_dir = os.path.join(output, "nnfit_reco") if nnfit else None
+    os.makedirs(root_dir, exist_ok=True)
+    if nnfit_dir is not None:
+        os.makedirs(nnfit_dir, exist_ok=True)
+
+    run_ids, counts = run_event_counts(n_events, run_range, seed)
+    blocks = np.array_split(np.arange(len(run_ids)), n_files)
+    names = [f"{name}.root"] if n_files == 1 else [f"{name}_{i}.root" for i in range(n_files)]
+
+    arguments = [
+        (i, run_ids[block], counts[block], root_dir, names[i], nnfit_dir, identifier, seed, chunksize,
+         runs_per_file, hdf5_format, mix, compression)
+        for i, block in enumerate(blocks)
+    ]
+
+    with stage("generate_sample", files=n_files, n_workers=n_workers) as current:
+        if n_workers <= 1:
+            written = [write_file(*argument) for argument in tqdm(arguments)]
+        else:
+            with ProcessPoolExecutor(max_workers=n_workers) as executor:
+                written = list(tqdm(executor.map(write_file, *zip(*arguments)), total=len(arguments)))
+        current.rows_out = sum(written)
+
+    return [os.path.join(root_dir, file_name) for file_name in names]
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a synthetic ANTARES-like sample (ROOT sel trees and NNFit HDF5 files).")
+    parser.add_argument("output", type=str, help="The output directory.")
+    parser.add_argument("--n_events", type=float, default=1e6, help="The total number of events.")
+    parser.add_argument("--runs", type=str, default="30000-90000", help="The run-id range, e.g. 30000-90000.")
+    parser.add_argument("--n_files", type=int, default=1, help="The number of ROOT files.")
+    parser.add_argument("--name", type=str, default="synthetic_sample", help="The name of the ROOT files.")
+    parser.add_argument("--sub_path", type=str, default="cut_selection/low_energy", help="The directory of the ROOT files in the output.")
+    parser.add_argument("--identifier", type=str, default="numu", help="The identifier in the names of the NNFit files.")
+    parser.add_argument("--no_nnfit", action="store_true", help="Do not write the NNFit HDF5 files.")
+    parser.add_argument("--mix", type=str, default="nue=0.3,numu=0.5,nutau=0.2", help="The flavour mix.")
+    parser.add_argument("--seed", type=int, default=0, help="The master seed.")
+    parser.add_argument("--chunksize", type=int, default=1_000_000, help="The number of events generated at once.")
+    parser.add_argument("--runs_per_file", type=int, default=1, help="The number of runs of each NNFit file.")
+    parser.add_argument("--hdf5_format", type=str, default="fixed", choices=["fixed", "table"], help="The format of the NNFit files.")
+    parser.add_argument("--compression", type=str, default=None, help="The compression codec of the ROOT files.")
+    parser.add_argument("--n_workers", type=int, default=1, help="The number of worker processes.")
+    args = parser.parse_args()
+
+    first_run, last_run = (int(run) for run in args.runs.split("-"))
+    generate_sample(args.output, int(args.n_events), (first_run, last_run), args.n_files, args.name, args.sub_path,
+                    args.identifier, not args.no_nnfit, args.seed, args.chunksize, args.runs_per_file, args.hdf5_format,
+                    args.mix, args.compression, args.n_workers)
+
+if __name__ == "__main__":
+    main()